@@ -0,0 +1,76 @@
+"""Time how long the TiDES entry points take to start in a fresh interpreter
+Usage:
+    benchColdStart.py [--repeats=<NUM>]
+    benchColdStart.py -h | --help
+
+Options:
+    -n NUM, --repeats=NUM      The number of fresh interpreters started per entry point. [default: 7]
+    -h --help                  Show this screen
+
+Each entry point is run in a new python process from a scratch working
+directory holding a flowSettings.yaml, and the median wall time is reported
+together with whether matplotlib, prefect and dask ended up imported. This is
+what every Prefect worker start, Dask task deserialization or checkObjects.py
+run pays before doing any work.
+"""
+
+from docopt import docopt
+import numpy as np
+import yaml
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+TARGETING = REPO / 'tidesTargeting'
+COMMUNICATE = REPO / 'tidesCommunicate'
+
+PRELUDE = ("import sys; sys.path[:0] = [%r, %r]; sys.modules.setdefault('submit_transients', __import__('fakeSubmitTransients'))\n"
+           % (str(TARGETING), str(COMMUNICATE)))
+REPORT = "\nprint(','.join(x for x in ['matplotlib', 'prefect', 'dask'] if x in sys.modules))"
+
+ENTRY_POINTS = {
+    'python (baseline)': 'pass',
+    'import lightcurveSelection': 'import lightcurveSelection',
+    'import lightcurvePlot': 'import lightcurvePlot',
+    'import commStages': 'import commStages',
+    'import tidesCom': 'import tidesCom',
+}
+
+
+def timeCommand(cmd, cwd, repeats):
+    '''Median wall time of cmd over repeats runs, and the last run's output. None if it fails.'''
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        if out.returncode != 0:
+            return None, out.stderr.strip().splitlines()[-1]
+    return np.median(times), out.stdout.strip().splitlines()[-1] if out.stdout.strip() else ''
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    repeats = int(args['--repeats'])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings = {'devConfig': {
+            'topic': 'benchmark', 'groupID': 'benchmark', 'lasairToken': 'benchmark',
+            'selectFunctionPath': str(TARGETING / 'tidesSelectionFunctions.yml'), 'selectFunction': 'tidesSNZTFSelect',
+            'tidesDBUser': None, 'tidesDBpass': None, 'tidesDBdatabase': None, 'fourMostFake': True,
+        }}
+        with open(Path(tmp) / 'flowSettings.yaml', 'w') as f:
+            yaml.dump(settings, f)
+
+        ## Only the python -c entry points print what they imported
+        commands = {name: ([sys.executable, '-c', PRELUDE + code + REPORT], True) for name, code in ENTRY_POINTS.items()}
+        commands['checkObjects.py --version'] = ([sys.executable, str(TARGETING / 'checkObjects.py'), '--version'], False)
+        for name, (cmd, reports) in commands.items():
+            seconds, detail = timeCommand(cmd, tmp, repeats)
+            if seconds is None:
+                print('%-30s failed: %s' % (name, detail))
+            else:
+                print('%-30s %6.3fs  %s' % (name, seconds, 'imports ' + detail if reports and detail else ''))
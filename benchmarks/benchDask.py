@@ -0,0 +1,96 @@
+"""Benchmark fetch-and-evaluate on a local Dask cluster of growing size
+Usage:
+    benchDask.py [--objects=<NUM>] [--length=<NUM>] [--latency=<SEC>] [--workers=<LIST>] [--threads=<NUM>] [--address=<URL>] [--seed=<NUM>]
+    benchDask.py -h | --help
+
+Options:
+    -n NUM, --objects=NUM      The number of synthetic objects. [default: 5000]
+    -l NUM, --length=NUM       The mean number of epochs per light curve. [default: 40]
+    --latency=SEC              Seconds each (fake) Lasair call takes. [default: 0.2]
+    -w LIST, --workers=LIST    Comma separated numbers of worker processes to try. [default: 1,2,4,8]
+    -t NUM, --threads=NUM      Threads per worker process. [default: 2]
+    -a URL, --address=URL      Scheduler of an existing cluster to run on instead of local ones.
+    --seed=NUM                 Random seed for the synthetic data. [default: 42]
+    -h --help                  Show this screen
+
+Every chunk of 50 objects is one commStages.fetchAndSatisfyChunk task, the
+unit of work chunkyAssign submits through Prefect: the light curves are
+fetched from a FakeLasairClient on the worker and only the pass/fail results
+come back. The Lasair latency dominates, as it does against the real API,
+so throughput should grow with the number of workers until the CPU or the
+rate limit (none here) runs out.
+
+#Example:
+#    python benchDask.py --objects=5000 --workers=1,2,4,8
+"""
+
+from docopt import docopt
+import sys
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(REPO / 'tidesTargeting'), str(REPO / 'tidesCommunicate')]
+
+import yaml
+from distributed import Client, LocalCluster
+
+from syntheticLightcurves import makeResponses
+from fakeLasair import FakeLasairClient
+import commStages
+
+SELECTION_PATH = str(REPO / 'tidesTargeting' / 'tidesSelectionFunctions.yml')
+SELECTION_NAME = 'tidesSNZTFSelect'
+
+
+def runOn(client, L, criteria, ztfNameChunks):
+    '''Seconds to fetch and evaluate every chunk on the cluster, and the results.'''
+    start = time.perf_counter()
+    futures = client.map(commStages.fetchAndSatisfyChunk, [L]*len(ztfNameChunks), [criteria]*len(ztfNameChunks),
+                         ztfNameChunks, pure=False)
+    results = [x for chunkResult in client.gather(futures) for x in chunkResult]
+    return time.perf_counter() - start, results
+
+
+def report(label, nObjects, seconds, baseline):
+    print('%-24s %6d objects %8.2fs %8.0f objects/s %6.2fx' % (label, nObjects, seconds, nObjects/seconds,
+                                                               baseline/seconds if baseline else 1.0))
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    nObjects = int(args['--objects'])
+    threads = int(args['--threads'])
+    latency = float(args['--latency'])
+
+    responses = makeResponses(nObjects, int(args['--length']), seed=int(args['--seed']))
+    criteria = yaml.load(open(SELECTION_PATH), Loader=yaml.SafeLoader)[SELECTION_NAME]
+    ztfNameChunks = [list(x) for x in commStages.splitIntoChunks(list(responses), 50)]
+    expected = sorted(commStages.passFailChunks(FakeLasairClient(responses), criteria, ztfNameChunks, rate=0))
+
+    ## The same chunks fetched one after the other on this process, as passFailChunks does with one thread
+    start = time.perf_counter()
+    commStages.passFailChunks(FakeLasairClient(responses, latency=latency), criteria, ztfNameChunks, workers=1, rate=0)
+    baseline = time.perf_counter() - start
+    report('serial', nObjects, baseline, None)
+
+    if args['--address'] is not None:
+        clusters = [('cluster ' + args['--address'], None)]
+    else:
+        clusters = [('%d worker(s) x %d thread(s)' % (int(n), threads), int(n)) for n in args['--workers'].split(',')]
+    for label, nWorkers in clusters:
+        if nWorkers is None:
+            client = Client(args['--address'])
+            cluster = None
+        else:
+            cluster = LocalCluster(n_workers=nWorkers, threads_per_worker=threads, dashboard_address=None)
+            client = Client(cluster)
+        ## The light curves are sent to every worker once, not with every task
+        L = client.scatter(FakeLasairClient(responses, latency=latency), broadcast=True)
+        seconds, results = runOn(client, L, criteria, ztfNameChunks)
+        if sorted(results) != expected:
+            print(label, 'gave different results to the serial run')
+        report(label, nObjects, seconds, baseline)
+        client.close()
+        if cluster is not None:
+            cluster.close()
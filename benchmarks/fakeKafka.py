@@ -0,0 +1,46 @@
+'''
+A stand-in for the Kafka consumer used by tidesCom.
+
+FakeConsumer serves a list of alert dicts as JSON messages through the same
+poll()/consume()/commit()/close() calls as a confluent_kafka Consumer, so the
+batch and streaming readers can be run without a broker.
+'''
+
+import json
+
+
+class FakeMessage():
+    def __init__(self, value, offset):
+        self._value = value
+        self._offset = offset
+
+    def value(self):
+        return self._value
+
+    def offset(self):
+        return self._offset
+
+    def error(self):
+        return None
+
+
+class FakeConsumer():
+    def __init__(self, alerts):
+        self.messages = [FakeMessage(json.dumps(x).encode(), i) for i, x in enumerate(alerts)]
+        self.position = 0
+        self.committed = 0
+
+    def consume(self, num_messages=1, timeout=-1):
+        batch = self.messages[self.position:self.position + num_messages]
+        self.position += len(batch)
+        return batch
+
+    def poll(self, timeout=None):
+        batch = self.consume(1, timeout)
+        return batch[0] if batch else None
+
+    def commit(self, asynchronous=True):
+        self.committed = self.position
+
+    def close(self):
+        pass
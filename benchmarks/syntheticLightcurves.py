@@ -0,0 +1,89 @@
+'''
+Synthetic ZTF-like light curves and alerts for the benchmarks.
+
+makeResponses builds what L.lightcurves would return for each object, a dict
+with a 'candidates' list of detections and non-detections (candid None and
+only a diffmaglim). makeAlerts builds the Kafka alerts Lasair would send for
+the same objects. Everything is seeded so repeated runs see the same data.
+'''
+
+import numpy as np
+
+START_JD = 2459000.5
+# ZTF night ids count from 2017-11-21, which is JD 2458078.5
+NID_ZERO_JD = 2458078.5
+FILTER_IDS = [1, 2, 3]
+FILTER_WEIGHTS = [0.45, 0.45, 0.1]
+
+
+def makeLightcurve(objectId, nPoints, rng, nonDetectionFraction=0.3):
+    '''
+    A SN-like light curve of nPoints epochs: a rise to a random peak magnitude
+    followed by a slower decline, observed every one to three nights in g, r or i.
+    '''
+    peakMag = rng.uniform(17, 21.5)
+    peakJd = START_JD + rng.uniform(0, 700)
+    jd = peakJd - 20 + np.cumsum(rng.uniform(1, 3, nPoints)) + rng.uniform(0.6, 0.9, nPoints)
+    fid = rng.choice(FILTER_IDS, size=nPoints, p=FILTER_WEIGHTS)
+    phase = jd - peakJd
+    trueMag = peakMag + np.where(phase < 0, 0.08*phase**2/5, 0.04*phase)
+    limit = rng.normal(20.5, 0.4, nPoints)
+    detected = (trueMag < limit) & (rng.random(nPoints) > nonDetectionFraction/2)
+    sigma = np.clip(0.02*10**(0.4*(trueMag - 18)), 0.01, 0.5)
+    magpsf = trueMag + rng.normal(0, sigma)
+    ra = rng.uniform(0, 360)
+    dec = np.degrees(np.arcsin(rng.uniform(-1, 0.6)))
+
+    candidates = []
+    for i in range(nPoints):
+        row = {'jd': float(jd[i]), 'fid': int(fid[i]), 'nid': int(jd[i] - NID_ZERO_JD),
+               'diffmaglim': float(limit[i])}
+        if detected[i]:
+            row.update({'candid': int(rng.integers(10**17, 10**18)), 'magpsf': float(magpsf[i]),
+                        'sigmapsf': float(sigma[i]), 'isdiffpos': 't', 'ra': float(ra), 'dec': float(dec)})
+        else:
+            row['candid'] = None
+        candidates.append(row)
+    return {'objectId': objectId, 'candidates': candidates}
+
+
+def makeResponses(nObjects, nPoints, seed=0, noDataFraction=0.02):
+    '''objectId -> Lasair light curve response for nObjects synthetic objects.'''
+    rng = np.random.default_rng(seed)
+    responses = {}
+    for i in range(nObjects):
+        objectId = 'ZTF99synth%07d' % i
+        if rng.random() < noDataFraction:
+            responses[objectId] = []
+        else:
+            responses[objectId] = makeLightcurve(objectId, max(2, int(rng.poisson(nPoints))), rng)
+    return responses
+
+
+def makeAlerts(responses, alertsPerObject=3, seed=0):
+    '''
+    Kafka alerts for the objects, as a Lasair filter would send them: one alert
+    per new detection, up to alertsPerObject per object, shuffled in time.
+    '''
+    rng = np.random.default_rng(seed)
+    alerts = []
+    for objectId, response in responses.items():
+        if len(response) == 0:
+            continue
+        dets = [x for x in response['candidates'] if x['candid'] is not None]
+        if len(dets) == 0:
+            continue
+        for k in range(max(0, len(dets) - alertsPerObject), len(dets)):
+            seen = dets[:k + 1]
+            mags = {f: [x['magpsf'] for x in seen if x['fid'] == f] for f in (1, 2)}
+            alerts.append({
+                'objectId': objectId, 'ramean': seen[0]['ra'], 'decmean': seen[0]['dec'],
+                'jdmin': seen[0]['jd'], 'jdmax': seen[-1]['jd'],
+                'magrmin': min(mags[2]) if mags[2] else None, 'maggmin': min(mags[1]) if mags[1] else None,
+                'rmag': mags[2][-1] if mags[2] else None, 'gmag': mags[1][-1] if mags[1] else None,
+                'jdrmax': max([x['jd'] for x in seen if x['fid'] == 2], default=None),
+                'jdgmax': max([x['jd'] for x in seen if x['fid'] == 1], default=None),
+                'ncand': len(seen), 'ncandgp': len(seen), 'classification': 'SN',
+            })
+    order = rng.permutation(len(alerts))
+    return [alerts[i] for i in order]
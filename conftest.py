@@ -0,0 +1,19 @@
+'''
+The tests sit beside the code they check and import modules by their plain
+names, as the scripts do, with the fakes from benchmarks/ (fakeKafka,
+syntheticLightcurves), tidesTargeting/ (fakeLasair) and tidesCommunicate/
+(fakeSubmitTransients).
+
+Tests that need Postgres read its SQLAlchemy (psycopg2) URL from
+TIDES_TEST_DB and are skipped without it. They work in a scratch schema that
+is dropped afterwards.
+'''
+
+import os
+import sys
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+for _path in ['benchmarks', 'tidesCommunicate', 'tidesTargeting']:
+    _path = os.path.join(_HERE, _path)
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
@@ -0,0 +1,68 @@
+'''
+The stages of the TiDES communication flow and its settings, importable
+without Prefect, Dask or a flowSettings.yaml.
+
+    from tidesCommunicate import consumeAlerts, passFailChunks, upsertToMaster, getConfig
+
+The flows themselves are in tidesCom.py. Importing the package puts this
+directory and tidesTargeting at the front of sys.path: as in tidesTargeting,
+the modules import each other by their plain names and are loaded as top-level
+modules (commStages, commConfig, lightcurveSelection, ...). Take names from the
+package rather than importing tidesCommunicate.<module>, which would load a
+second copy of the module.
+'''
+
+import importlib
+import os
+import sys
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+for _path in [os.path.join(os.path.dirname(_HERE), 'tidesTargeting'), _HERE]:
+  if _path not in sys.path:
+    sys.path.insert(0, _path)
+
+# Public name -> module it lives in
+_EXPORTS = {
+  'AlertBuffer': 'commStages',
+  'consumeAlerts': 'commStages',
+  'getLatestBatch': 'commStages',
+  'splitIntoChunks': 'commStages',
+  'satisfyChunk': 'commStages',
+  'fetchAndSatisfyChunk': 'commStages',
+  'prefilterBatch': 'commStages',
+  'evaluateChunk': 'commStages',
+  'archiveChunk': 'commStages',
+  'passFailChunks': 'commStages',
+  'passFailIncremental': 'commStages',
+  'loadSelectionState': 'commStages',
+  'saveSelectionState': 'commStages',
+  'saveDetections': 'commStages',
+  'rescoreDetections': 'commStages',
+  'rescoreMaster': 'commStages',
+  'passFailResultsDFandMerge': 'commStages',
+  'makeEngine': 'commStages',
+  'makeAsyncEngine': 'commStages',
+  'createTransientStage': 'commStages',
+  'crossMatchStage': 'commStages',
+  'upsertToMaster': 'commStages',
+  'deactivateUnobservedTransients': 'commStages',
+  'prepare4MOSTUpdate': 'commStages',
+  'markTargetsSent': 'commStages',
+  'send4MOSTUpdatesAsync': 'commStages',
+  'coneBoxes': 'commStages',
+  'coneSearch': 'commStages',
+  'updateTiDESMasterwith4MOSTKey': 'commStages',
+  'latencyReport': 'commStages',
+  'makeStreamConsumer': 'commStages',
+  'submitTransients': 'fourMostSubmit',
+  'getConfig': 'commConfig',
+  'FlowConfig': 'commConfig',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+  if name not in _EXPORTS:
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+  return getattr(importlib.import_module(_EXPORTS[name]), name)
@@ -0,0 +1,13 @@
+-- Indexes used by the merge, deactivate and 4MOST staging queries.
+-- Safe to run on an existing tides_master, every index is created only once.
+CREATE UNIQUE INDEX IF NOT EXISTS tides_master_name_idx ON tides_master (name);
+
+-- Active targets by last update, used to find targets that have gone unobserved
+CREATE INDEX IF NOT EXISTS tides_master_active_updated_idx ON tides_master (updated) WHERE active;
+
+-- Active targets that have faded below the 4MOST limit
+CREATE INDEX IF NOT EXISTS tides_master_active_faint_idx ON tides_master (tides_id) WHERE active AND rmag > 20.5 AND gmag > 20.5;
+
+-- Sky positions, for the duplicate cross-match (every target) and field lookups (active targets)
+CREATE INDEX IF NOT EXISTS tides_master_radec_idx ON tides_master USING gist (point(ra, dec));
+CREATE INDEX IF NOT EXISTS tides_master_active_radec_idx ON tides_master USING gist (point(ra, dec)) WHERE active;
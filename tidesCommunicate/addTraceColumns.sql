@@ -0,0 +1,13 @@
+-- The trace times of createMasterTable.sql, for a tides_master made before they were added.
+-- Checked first so the merge does not take an exclusive lock on tides_master every run.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = 'tides_master'::regclass AND attname = 'trace_acked' AND NOT attisdropped) THEN
+        ALTER TABLE tides_master ADD COLUMN IF NOT EXISTS trace_received TIMESTAMP WITH TIME ZONE,
+                                 ADD COLUMN IF NOT EXISTS trace_fetched TIMESTAMP WITH TIME ZONE,
+                                 ADD COLUMN IF NOT EXISTS trace_selected TIMESTAMP WITH TIME ZONE,
+                                 ADD COLUMN IF NOT EXISTS trace_upserted TIMESTAMP WITH TIME ZONE,
+                                 ADD COLUMN IF NOT EXISTS trace_acked TIMESTAMP WITH TIME ZONE;
+    END IF;
+END
+$$;
@@ -0,0 +1,3 @@
+UPDATE tides_targets tt SET dirty=False, create_unsure=False
+FROM unnest(CAST(:tides_id AS integer[]), CAST(:version AS bigint[])) AS done(tides_id, version)
+WHERE tt.tides_id = done.tides_id AND tt.version = done.version;
@@ -0,0 +1,189 @@
+'''
+Settings of the communication flow.
+
+flowSettings.yaml is read once per process, on first use, into a FlowConfig:
+the devConfig block with every optional key filled in with its default.
+The load*Settings helpers pick out the values each stage needs.
+'''
+
+import functools
+
+import yaml
+
+# Optional keys of the devConfig block and their defaults, see README.md
+DEFAULTS = {
+  'batchMaxAlerts': None,
+  'batchMaxSeconds': None,
+  'batchConsumeSize': 500,
+  'streamBatchSize': 1000,
+  'streamBatchSeconds': 10,
+  'stageUnlogged': True,
+  'crossMatchRadius': None,
+  'alertPrefilter': True,
+  'alertBands': ['g', 'r'],
+  'selectionState': False,
+  'lasairWorkers': 4,
+  'lasairRate': 2,
+  'lightcurveCache': None,
+  'lightcurveCacheMB': 1000,
+  'lightcurveCacheDays': 30,
+  'lightcurveOffline': False,
+  'daskAddress': None,
+  'daskWorkers': 4,
+  'daskThreads': 2,
+  'dbHost': 'localhost',
+  'dbPort': 5432,
+  'dbPoolSize': 5,
+  'dbMaxOverflow': 5,
+  'dbPoolRecycle': 1800,
+  'dbAsync': False,
+  'fourMostBatchSize': 500,
+  'fourMostFake': False,
+  'fourMostWorkers': 4,
+  'fourMostRetries': 3,
+  'archivePath': None,
+  'storeDetections': False,
+  'metricsLog': None,
+  'metricsTextfile': None,
+}
+
+
+class FlowConfig(dict):
+  '''One block of flowSettings.yaml, keys also readable as attributes.'''
+  def __getattr__(self, name):
+    try:
+      return self[name]
+    except KeyError:
+      raise AttributeError(name)
+
+
+@functools.lru_cache(maxsize=None)
+def getConfig(key='devConfig', path='./flowSettings.yaml'):
+  '''The key block of the settings file, read the first time it is asked for.'''
+  with open(path) as f:
+    settingsOpen = yaml.load(f, Loader=yaml.SafeLoader)
+  return FlowConfig(DEFAULTS, **settingsOpen[key])
+
+
+def loadTopicSettings(key):
+  cfg = getConfig(key)
+  return cfg['topic'], cfg['groupID']
+
+def loadBatchSettings(key):
+  '''
+  Limits on how much of the topic one flow run reads, None for no limit.
+  '''
+  cfg = getConfig(key)
+  return cfg.batchMaxAlerts, cfg.batchMaxSeconds, cfg.batchConsumeSize
+
+def loadStreamSettings(key):
+  '''
+  Micro-batch limits for the streaming flow: alerts per batch and seconds per batch.
+  '''
+  cfg = getConfig(key)
+  return cfg.streamBatchSize, cfg.streamBatchSeconds
+
+def loadStageSettings(key):
+  '''
+  Whether tides_stage is created UNLOGGED. It is rebuilt every run so there is
+  nothing to lose in a crash, and skipping the WAL makes the load faster.
+  '''
+  return getConfig(key).stageUnlogged
+
+def loadLasairDetails(key):
+  return getConfig(key)['lasairToken']
+
+def loadLasairFetchSettings(key):
+  '''
+  How many Lasair requests to keep in flight and the requests-per-second budget.
+  '''
+  cfg = getConfig(key)
+  return cfg.lasairWorkers, cfg.lasairRate
+
+def loadPrefilterSettings(key):
+  '''
+  Whether objects are checked against their alert before fetching light
+  curves, and the bands the light curves can contain.
+  '''
+  cfg = getConfig(key)
+  return cfg.alertPrefilter, tuple(cfg.alertBands)
+
+def loadLightcurveCacheSettings(key):
+  '''
+  Path, size budget (MB) and maximum age (days) of the local light curve cache,
+  and whether to run offline from it. No path means no cache.
+  '''
+  cfg = getConfig(key)
+  return cfg.lightcurveCache, cfg.lightcurveCacheMB, cfg.lightcurveCacheDays, cfg.lightcurveOffline
+
+def loadDaskSettings(key):
+  '''
+  Scheduler address of the Dask cluster the light curves are fetched and
+  evaluated on, None for a local cluster. The number of worker processes
+  (the size of the local cluster, or of the one at the address) shares out
+  the Lasair rate budget. Threads per worker only apply to a local cluster.
+  '''
+  cfg = getConfig(key)
+  return cfg.daskAddress, cfg.daskWorkers, cfg.daskThreads
+
+def loadSelectionFunctionDetails(key):
+  cfg = getConfig(key)
+  return cfg['selectFunctionPath'], cfg['selectFunction']
+
+def loadSelectionStateSettings(key):
+  '''
+  Whether light curves are evaluated incrementally against the state kept in
+  tides_selection_state rather than from their whole history every run.
+  '''
+  return getConfig(key).selectionState
+
+def loadCrossMatchSettings(key):
+  '''
+  Radius in arcsec within which a new object is merged into an existing
+  target in tides_master, None to never merge.
+  '''
+  return getConfig(key).crossMatchRadius
+
+def loadTiDESdbSettings(key):
+  cfg = getConfig(key)
+  return cfg['tidesDBUser'], cfg['tidesDBpass'], cfg['tidesDBdatabase']
+
+def loadDbPoolSettings(key):
+  '''
+  Host and port of the TiDES DB, the size of the connection pool kept for
+  the life of the process (pool size, extra connections allowed on top and
+  seconds after which a connection is replaced), and whether the 4MOST
+  updates go through the async path.
+  '''
+  cfg = getConfig(key)
+  return cfg.dbHost, cfg.dbPort, cfg.dbPoolSize, cfg.dbMaxOverflow, cfg.dbPoolRecycle, cfg.dbAsync
+
+def load4MOSTSubmitSettings(key):
+  '''
+  Number of concurrent 4MOST API calls, how often a failed call is retried
+  and how many targets the async path reads and sends at a time.
+  '''
+  cfg = getConfig(key)
+  return cfg.fourMostWorkers, cfg.fourMostRetries, cfg.fourMostBatchSize
+
+def loadArchiveSettings(key):
+  '''
+  Directory of the Parquet archive the fetched light curves and results are
+  appended to, None for no archive.
+  '''
+  return getConfig(key).archivePath
+
+def loadDetectionSettings(key):
+  '''
+  Whether the detection summaries of fetched light curves are kept in
+  tides_detections, so selection functions can be re-scored in the database.
+  '''
+  return getConfig(key).storeDetections
+
+def loadMetricsSettings(key):
+  '''
+  Where to write the JSON lines log of stage timings and the Prometheus
+  textfile of counters and histograms. Neither means no instrumentation.
+  '''
+  cfg = getConfig(key)
+  return cfg.metricsLog, cfg.metricsTextfile
@@ -0,0 +1,680 @@
+'''
+The stages of the TiDES communication flow, as plain functions.
+
+Reading alerts from Kafka, evaluating light curves, staging and merging into
+tides_master and preparing the 4MOST updates live here, with no Prefect, Dask
+or settings file involved, so they can be imported and reused on their own
+(by the benchmarks, a notebook or a Dask worker) without connecting to
+anything or reading settings.
+tidesCom.py wraps them as Prefect tasks and strings them together into flows.
+'''
+
+import asyncio
+import json
+import time
+from io import StringIO
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+## The light curve selection code is shared with the tidesTargeting scripts. Importing
+## this module leaves sys.path alone: the package __init__, tidesCom.py and the
+## command-line scripts put tidesTargeting on it.
+import lightcurveSelection as lcs
+from lightcurveChunk import LightcurveChunk
+from lasairFetch import fetchChunk, fetchChunks, RateLimiter
+from pipelineMetrics import NO_METRICS
+from alertPrefilter import mayPass, STREAM_BANDS
+from selectionState import STATE_COLUMNS, foldChunk, stateFromTable, stateToTable
+from detectionSummary import SUMMARY_COLUMNS, summariseChunk
+
+# The SQL files are read from next to this module, wherever the flow is run from
+SQL_DIR = Path(__file__).resolve().parent
+
+# Columns of tides_stage, as laid out in createStageTable.sql
+STAGE_COLUMNS = ['name', 'ramean', 'decmean', 'jdmin', 'jdmax', 'magrmin', 'maggmin', 'rmag', 'gmag',
+                 'jdgmax', 'jdrmax', 'ncandgp', 'classification', 'triggerjd',
+                 'trace_received', 'trace_fetched', 'trace_selected']
+# Steps between the trace times of tides_master reported by latencyReport, see traceLatencies.sql
+LATENCY_STEPS = ['alert_to_fetch', 'fetch_to_selection', 'selection_to_master', 'master_to_4most',
+                 'alert_to_master', 'alert_to_4most']
+
+
+# Columns of tides_master and tides_targets stored as REAL, see createMasterTable.sql and createTargetListTable.sql
+REAL_COLUMNS = ['magrmin', 'maggmin', 'rmag', 'gmag', 'ncandgp', 'mag', 'priority']
+
+
+def readSQL(name):
+  with open(SQL_DIR / name) as f:
+    return f.read()
+
+
+class AlertBuffer():
+  '''
+  Column-wise buffer of Kafka alerts holding only the latest alert (highest
+  jdmax) per objectId. Alerts are folded in as they are read, so memory grows
+  with the number of unique objects rather than the number of alerts, and the
+  DataFrame is built once at the end instead of concatenated per message.
+  The time each kept alert was read is its trace_received column.
+  '''
+  def __init__(self):
+    self.columns = {}
+    self.rowOf = {}
+    self.received = []
+    self.nRows = 0
+    self.nAlerts = 0
+
+  def add(self, jmsg, received=None):
+    self.nAlerts += 1
+    row = self.rowOf.get(jmsg['objectId'])
+    if row is None:
+      row = self.nRows
+      self.rowOf[jmsg['objectId']] = row
+      self.nRows += 1
+      self.received.append(None)
+      for col in self.columns.values():
+        col.append(None)
+    elif (jmsg.get('jdmax') or -np.inf) <= (self.columns.get('jdmax', [None]*self.nRows)[row] or -np.inf):
+      return
+    self.received[row] = time.time() if received is None else received
+    for k, v in jmsg.items():
+      if k not in self.columns:
+        self.columns[k] = [None]*self.nRows
+      self.columns[k][row] = v
+
+  def __len__(self):
+    return self.nRows
+
+  def toDataFrame(self):
+    recentUniqueObjects = pd.DataFrame(self.columns)
+    if len(recentUniqueObjects)!=0:
+      recentUniqueObjects['trace_received'] = np.asarray(self.received, dtype=np.float64)
+      recentUniqueObjects = recentUniqueObjects.sort_values("jdmax", ascending = False, ignore_index=True)
+    return recentUniqueObjects
+
+
+def consumeAlerts(consumer, maxAlerts=None, maxSeconds=None, consumeSize=500, pollTimeout=5):
+  '''
+  Read alerts from the topic in batches until it is drained (nothing arrives
+  within pollTimeout seconds) or until maxAlerts messages or maxSeconds have
+  gone by. Whatever is left stays on the topic for the next run.
+  Uses the batched consume() of the underlying confluent_kafka consumer when
+  there is one and falls back to poll() otherwise.
+  '''
+  kafkaConsumer = getattr(consumer, 'consumer', consumer)
+  buffer = AlertBuffer()
+  start = time.monotonic()
+  while True:
+    if maxAlerts is not None and buffer.nAlerts >= maxAlerts:
+      print('Reached the batch limit of', maxAlerts, 'alerts')
+      break
+    if maxSeconds is not None and time.monotonic() - start >= maxSeconds:
+      print('Reached the batch time limit of', maxSeconds, 's')
+      break
+    nWant = consumeSize if maxAlerts is None else min(consumeSize, maxAlerts - buffer.nAlerts)
+    if hasattr(kafkaConsumer, 'consume'):
+      msgs = kafkaConsumer.consume(num_messages=nWant, timeout=pollTimeout)
+    else:
+      msg = kafkaConsumer.poll(timeout=pollTimeout)
+      msgs = [] if msg is None else [msg]
+    if len(msgs) == 0:
+      print('no more transients')
+      break
+    received = time.time()
+    for msg in msgs:
+      if msg.error():
+        print(str(msg.error()))
+        continue
+      buffer.add(json.loads(msg.value()), received)
+  print('Alerts read: ', buffer.nAlerts, 'Unique objects: ', len(buffer))
+  return buffer
+
+
+def getLatestBatch(consumer, maxAlerts=None, maxSeconds=None, consumeSize=500, metrics=NO_METRICS):
+  '''
+  This task will query the topic and download the data in one batch,
+  keeping the latest alert for each object
+  '''
+  with metrics.timer('kafka'):
+    buffer = consumeAlerts(consumer, maxAlerts=maxAlerts, maxSeconds=maxSeconds, consumeSize=consumeSize)
+  metrics.count('alerts_consumed', buffer.nAlerts)
+  return buffer.toDataFrame()
+
+
+def splitIntoChunks(inLst, n):
+    """The Lasair API can only handle 50 light curves a time.
+    This function will split the list up into chunks of n objects.
+    """
+    for i in range(0, len(inLst), n):
+        yield inLst[i:i + n]
+
+
+def evaluateChunk(criteria, lcChunk):
+    '''
+    Evaluate the selection function for a whole LightcurveChunk in one
+    vectorised pass. Returns [name, pass, trigger JD] in the order of the chunk.
+    '''
+    chunkPF = lcs.satisfyBatch(criteria, lcChunk) & lcChunk.hasData
+    chunkTrigger = lcs.triggerBatch(criteria, lcChunk)
+    return [[name, bool(pf), float(trig)] for name, pf, trig in zip(lcChunk.objectIds, chunkPF, chunkTrigger)]
+
+
+def satisfyChunk(criteria, chunk, c):
+    '''evaluateChunk for the Lasair response c to the objects in chunk.'''
+    return evaluateChunk(criteria, LightcurveChunk.fromResponses(chunk, c))
+
+
+def archiveChunk(archive, selection, lcChunk, namePassFail):
+  '''Append a chunk and its [name, pass, trigger JD] results to a LightcurveArchive.'''
+  archive.write(lcChunk, [selection], [x[1] for x in namePassFail], [x[2] for x in namePassFail])
+
+
+def prefilterBatch(criteria, latestTransients, bands=STREAM_BANDS, metrics=NO_METRICS):
+  '''
+  Split the objects of a batch into the ones whose light curves need
+  fetching and the ones their alert already rules out, see alertPrefilter.
+  Returns the objectIds to fetch and [name, False, NO_TRIGGER] for the rest.
+  '''
+  possible, reasons = mayPass(criteria, latestTransients, bands=bands)
+  names = np.asarray(latestTransients['objectId'])
+  toFetch = np.unique(names[possible])
+  skipped = np.setdiff1d(np.unique(names), toFetch)
+  print('Prefilter skipped', len(skipped), 'of', len(skipped) + len(toFetch), 'light curve fetches', reasons)
+  metrics.count('fetches_saved', len(skipped))
+  for rule, n in reasons.items():
+    metrics.count('prefilter_'+rule, n)
+  return toFetch, [[name, False, float(lcs.NO_TRIGGER)] for name in skipped]
+
+
+# One rate limiter per process and rate, shared by the tasks running on a Dask worker's threads
+_limiters = {}
+
+def processLimiter(rate):
+  if rate not in _limiters:
+    _limiters[rate] = RateLimiter(rate)
+  return _limiters[rate]
+
+
+def fetchAndSatisfyChunk(L, criteria, chunk, rate=None, retries=3, withLightcurves=False, withTimes=False):
+  '''
+  Fetch one chunk of light curves and evaluate it, as a single unit of work
+  for a Dask worker. Only the [name, pass, trigger JD] results travel back,
+  with withLightcurves the LightcurveChunk as well, for archiving, and with
+  withTimes the (fetched, selected) time.time() of the chunk, for the
+  LatencyTrace. rate is this process's share of the Lasair
+  requests-per-second budget.
+  '''
+  c = fetchChunk(L, chunk, limiter=processLimiter(rate), retries=retries)
+  fetched = time.time()
+  lcChunk = LightcurveChunk.fromResponses(chunk, c)
+  namePassFail = evaluateChunk(criteria, lcChunk)
+  if not (withLightcurves or withTimes):
+    return namePassFail
+  return (namePassFail,) + ((lcChunk,) if withLightcurves else ()) + (((fetched, time.time()),) if withTimes else ())
+
+
+def passFailChunks(L, criteria, ztfNameChunks, workers=4, rate=2, metrics=NO_METRICS, archive=None, selection='',
+                   detections=None, trace=None):
+  '''
+  Fetch and evaluate chunks of light curves in this process, as
+  [name, pass, trigger JD] for every object. With an archive the light
+  curves and results are appended to it under the selection name. With a
+  detections list the detection summary of every chunk is appended to it,
+  for saveDetections. With a LatencyTrace the time each light curve was
+  fetched and evaluated is marked in it.
+  '''
+  namePassFail = []
+  for idx, chunk, c in fetchChunks(L, ztfNameChunks, workers=workers, rate=rate, metrics=metrics):
+    if trace is not None:
+      trace.mark('fetched', chunk)
+    with metrics.timer('selection', objects=len(chunk)):
+      lcChunk = LightcurveChunk.fromResponses(chunk, c)
+      chunkPassFail = evaluateChunk(criteria, lcChunk)
+    if trace is not None:
+      trace.mark('selected', chunk)
+    if archive is not None:
+      with metrics.timer('archive'):
+        archiveChunk(archive, selection, lcChunk, chunkPassFail)
+    if detections is not None:
+      detections.append(summariseChunk(lcChunk))
+    namePassFail += chunkPassFail
+  return namePassFail
+
+
+def loadSelectionState(engine, names, selection):
+  '''
+  The stored selection state (see selectionState) of the named objects for
+  one selection function key, creating the state tables on first use.
+  '''
+  with engine.begin() as conn:
+    conn.execute(sqlalchemy.text(readSQL('createSelectionStateTable.sql')))
+    return pd.read_sql(sqlalchemy.text('SELECT * FROM tides_selection_state WHERE selection = :selection AND name = ANY(:names)'),
+                       con=conn, params={'selection': selection, 'names': [str(x) for x in names]})
+
+
+def saveSelectionState(engine, table, selection):
+  '''
+  Upsert state rows into tides_selection_state, COPYing them in through an
+  unlogged stage as createTransientStage does.
+  '''
+  out = StringIO()
+  table.reindex(columns=['name']+STATE_COLUMNS).to_csv(out, header=False, index=False)
+  out.seek(0)
+  with engine.begin() as conn:
+    cur = conn.connection.cursor()
+    cur.execute('TRUNCATE tides_selection_state_stage')
+    cur.copy_expert('COPY tides_selection_state_stage (name, '+', '.join(STATE_COLUMNS)+') FROM STDIN WITH (FORMAT csv)', out)
+    conn.execute(sqlalchemy.text(readSQL('upsertSelectionState.sql')), {'selection': selection})
+
+
+def passFailIncremental(L, criteria, selection, ztfNameChunks, engine, workers=4, rate=2, metrics=NO_METRICS,
+                        archive=None, selectionName=None, detections=None, trace=None):
+  '''
+  Like passFailChunks, but only the rows of each light curve after the last
+  one seen are evaluated, folded into the state kept in tides_selection_state
+  under the selection key. Objects that have already passed are answered from
+  their state without fetching their light curves. Fetched light curves are
+  archived under selectionName, the selection key if not given, and their
+  detection summaries appended to detections and times marked in trace, as in
+  passFailChunks. Objects answered from their state are only marked selected.
+  '''
+  names = [x for chunk in ztfNameChunks for x in chunk]
+  with metrics.timer('state_load'):
+    stored = loadSelectionState(engine, names, selection)
+  done = stored[stored['passed'].astype(bool)]
+  namePassFail = [[name, True, float(trig)] for name, trig in zip(done['name'], done['triggerjd'])]
+  if trace is not None:
+    trace.mark('selected', done['name'])
+  doneNames = set(done['name'])
+  toFetch = [x for x in names if x not in doneNames]
+  metrics.count('state_passed', len(done))
+  print('Already passed:', len(done), 'Light curves to fold in:', len(toFetch))
+
+  chunkSize = max([len(x) for x in ztfNameChunks], default=50)
+  updated = []
+  for idx, chunk, c in fetchChunks(L, list(splitIntoChunks(toFetch, chunkSize)), workers=workers, rate=rate, metrics=metrics):
+    if trace is not None:
+      trace.mark('fetched', chunk)
+    with metrics.timer('selection', objects=len(chunk)):
+      lcChunk = LightcurveChunk.fromResponses(chunk, c)
+      before = stateFromTable(stored, lcChunk.objectIds)
+      state = foldChunk(criteria, lcChunk, before)
+    if trace is not None:
+      trace.mark('selected', chunk)
+    metrics.count('newly_passed', int((state['passed'] & ~before['passed']).sum()))
+    chunkPassFail = [[name, bool(pf), float(trig)] for name, pf, trig in zip(chunk, state['passed'], state['triggerjd'])]
+    if archive is not None:
+      with metrics.timer('archive'):
+        archiveChunk(archive, selection, lcChunk, chunkPassFail)
+    if detections is not None:
+      detections.append(summariseChunk(lcChunk))
+    namePassFail += chunkPassFail
+    changed = state['lastjd'] != before['lastjd']
+    updated.append(stateToTable(chunk, state)[changed])
+  if len(updated) != 0:
+    with metrics.timer('state_save'):
+      saveSelectionState(engine, pd.concat(updated, ignore_index=True), selection)
+  return namePassFail
+
+
+def saveDetections(engine, table):
+  '''
+  Replace the stored detection summaries (see detectionSummary) of every
+  object in table with its rows, COPYing them in through an unlogged stage
+  as saveSelectionState does. Objects fetched without any detections keep
+  what was stored for them.
+  '''
+  out = StringIO()
+  table.reindex(columns=SUMMARY_COLUMNS).to_csv(out, header=False, index=False)
+  out.seek(0)
+  with engine.begin() as conn:
+    conn.execute(sqlalchemy.text(readSQL('createDetectionTable.sql')))
+    cur = conn.connection.cursor()
+    cur.execute('TRUNCATE tides_detections_stage')
+    cur.copy_expert('COPY tides_detections_stage ('+', '.join(SUMMARY_COLUMNS)+') FROM STDIN WITH (FORMAT csv)', out)
+    conn.execute(sqlalchemy.text(readSQL('upsertDetections.sql')), {'names': [str(x) for x in table['name'].unique()]})
+  print('Saved detection summaries', len(table))
+
+
+def rescoreDetections(cnx, criteria):
+  '''
+  Evaluate a selection function over every light curve in tides_detections
+  in one SQL aggregation, without fetching any. Returns the name and trigger
+  JD of every object that passes, also left in the temporary table
+  tides_rescored until the transaction ends. Gives the same answers as
+  satisfyBatch and triggerBatch on the light curves themselves.
+  '''
+  params = {'fids': [int(x) for x in np.flatnonzero(lcs.allowedBands(criteria))],
+            'significance': float(criteria['significance']), 'magLimit': float(criteria['magLimit']),
+            'minBands': int(criteria['minBands']), 'minNights': int(criteria['minNights'])}
+  cnx.execute(sqlalchemy.text(readSQL('rescoreDetections.sql')), params)
+  return pd.read_sql(sqlalchemy.text('SELECT name, triggerjd FROM tides_rescored'), con=cnx)
+
+
+def rescoreMaster(cnx, criteria):
+  '''
+  Re-score every target with stored detections against a new selection
+  function (rescoreDetections) and bring tides_master in line in bulk: a
+  target is active when it passes and has been updated within 4 days and not
+  faded, and passing targets take the new trigger JD. Targets whose active
+  flag changed are marked dirty in tides_targets for 4MOST. Returns the
+  passing objects, and the tides_id with the old and new active flag of
+  every target changed.
+  '''
+  cnx.execute(sqlalchemy.text(readSQL('createDetectionTable.sql')))
+  cnx.execute(sqlalchemy.text(readSQL('createTargetListTable.sql')))
+  passing = rescoreDetections(cnx, criteria)
+  changed = pd.DataFrame(cnx.execute(sqlalchemy.text(readSQL('rescoreMaster.sql'))).all(),
+                         columns=['tides_id', 'was_active', 'active'])
+  cnx.execute(sqlalchemy.text(readSQL('rescoreTargets.sql')), {'rescored': changed['tides_id'].astype(int).tolist()})
+  was, now = changed['was_active'].eq(True), changed['active'].eq(True)
+  print('Re-scored objects passing', len(passing), 'targets activated', int((now & ~was).sum()),
+        'deactivated', int((was & ~now).sum()), 'trigger moved', int((was == now).sum()))
+  return passing, changed
+
+
+def passFailResultsDFandMerge(rPF, latestT, trace=None):
+  nPFdf = pd.DataFrame(rPF, columns=['Name','Pass','TriggerJD'])
+  merged = latestT.merge(nPFdf, left_on='objectId', right_on='Name', how='left')
+  if trace is not None:
+    merged['trace_fetched'] = trace.times('fetched', merged['objectId'])
+    merged['trace_selected'] = trace.times('selected', merged['objectId'])
+  return merged
+
+
+def makeEngine(dbUsername, dbPassword, dbDatabase, host='localhost', port=5432, poolSize=5, maxOverflow=5,
+               poolRecycle=1800):
+  '''
+  A pooled engine, meant to be made once and kept for the life of the
+  process. Connections are checked before they are handed out and replaced
+  after poolRecycle seconds, so a long-lived engine survives database
+  restarts and idle timeouts.
+  '''
+  url = sqlalchemy.URL.create('postgresql+psycopg2', username=dbUsername, password=dbPassword, host=host, port=port,
+                              database=dbDatabase)
+  return sqlalchemy.create_engine(url, future=True, pool_size=poolSize, max_overflow=maxOverflow,
+                                  pool_recycle=poolRecycle, pool_pre_ping=True)
+
+
+def makeAsyncEngine(dbUsername, dbPassword, dbDatabase, host='localhost', port=5432, poolSize=5, maxOverflow=5,
+                    poolRecycle=1800):
+  '''
+  makeEngine for asyncio, on asyncpg. Its connections belong to the event
+  loop they were opened on, so it must only be used from one loop.
+  '''
+  from sqlalchemy.ext.asyncio import create_async_engine
+  url = sqlalchemy.URL.create('postgresql+asyncpg', username=dbUsername, password=dbPassword, host=host, port=port,
+                              database=dbDatabase)
+  return create_async_engine(url, pool_size=poolSize, max_overflow=maxOverflow, pool_recycle=poolRecycle,
+                             pool_pre_ping=True)
+
+
+def createTransientStage(dataTable, cnx, unlogged=True):
+  '''
+  Bulk load the passing transients into tides_stage. The stage is a persistent
+  (by default UNLOGGED) table with fixed column types, so rather than dropping
+  and recreating it we truncate it and COPY the rows in from an in-memory CSV.
+  '''
+  dataTable.columns = map(str.lower, dataTable.columns)
+  staged = dataTable[dataTable['pass']==True].reindex(columns=STAGE_COLUMNS)
+
+  createQuery = readSQL('createStageTable.sql')
+  if not unlogged:
+    createQuery = createQuery.replace('UNLOGGED ', '')
+
+  out = StringIO()
+  staged.to_csv(out, header=False, index=False, na_rep='\\N')
+  out.seek(0)
+
+  raw_con = cnx.raw_connection()
+  try:
+    cur = raw_con.cursor()
+    cur.execute(createQuery)
+    cur.execute('TRUNCATE tides_stage')
+    cur.copy_expert("COPY tides_stage ("+', '.join(STAGE_COLUMNS)+") FROM STDIN WITH (FORMAT csv, NULL '\\N')", out)
+    raw_con.commit()
+  finally:
+    raw_con.close()
+  print('Staged transients: ', len(staged))
+
+
+def upsertToMaster(cnx):
+  '''
+  Merge tides_stage into tides_master, then carry the staged targets into the
+  tides_targets list. Only targets whose 4MOST payload columns changed are
+  marked dirty.
+  '''
+  cnx.execute(sqlalchemy.text(readSQL('createTargetListTable.sql')))
+  cnx.execute(sqlalchemy.text(readSQL('addTraceColumns.sql')))
+  cnx.execute(sqlalchemy.text(readSQL('upsertTiDESstage.sql')))
+  marked = cnx.execute(sqlalchemy.text(readSQL('upsertTargetList.sql'))).rowcount
+  print('Targets changed for 4MOST', marked)
+
+
+def crossMatchStage(cnx, radius):
+  '''
+  Merge near-duplicates: staged alerts of objects not in tides_master that lie
+  within radius arcsec of an existing target are renamed to it, so the upsert
+  updates that target. Each pair is recorded in tides_alias. Returns the
+  (alias, name) pairs merged.
+  '''
+  cnx.execute(sqlalchemy.text(readSQL('createAliasTable.sql')))
+  merged = cnx.execute(sqlalchemy.text(readSQL('crossMatchStage.sql')), {'radius': radius/3600}).all()
+  print('Merged near-duplicate transients', len(merged))
+  return merged
+
+
+def coneBoxes(ra, dec, radius):
+  '''
+  One or two (ra1, ra2, dec1, dec2) boxes in degrees that between them hold
+  every position within radius of (ra, dec), split where they cross RA 0 and
+  open to every RA when they reach a pole.
+  '''
+  dec1, dec2 = max(float(dec) - radius, -90.0), min(float(dec) + radius, 90.0)
+  if dec1 <= -90 or dec2 >= 90:
+    return [(0.0, 360.0, dec1, dec2)]
+  ## Widest RA offset of the circle, reached away from its centre declination
+  dra = float(np.degrees(np.arcsin(min(1.0, np.sin(np.radians(radius))/np.cos(np.radians(dec))))))
+  ra = float(ra) % 360
+  if dra >= 180:
+    return [(0.0, 360.0, dec1, dec2)]
+  if ra - dra < 0:
+    return [(0.0, ra + dra, dec1, dec2), (ra - dra + 360, 360.0, dec1, dec2)]
+  if ra + dra > 360:
+    return [(ra - dra, 360.0, dec1, dec2), (0.0, ra + dra - 360, dec1, dec2)]
+  return [(ra - dra, ra + dra, dec1, dec2)]
+
+
+def coneSearch(cnx, ra, dec, radius, limit=None):
+  '''
+  Active targets within radius degrees of (ra, dec), brightest first, with
+  their separation in degrees. Served by the GiST index on point(ra, dec).
+  '''
+  boxes = coneBoxes(ra, dec, radius)
+  (ra1, ra2, dec1, dec2), (ra3, ra4, _, _) = boxes[0], boxes[-1]
+  params = {'ra': float(ra) % 360, 'dec': float(dec), 'radius': float(radius), 'limit': limit,
+            'ra1': ra1, 'ra2': ra2, 'ra3': ra3, 'ra4': ra4, 'dec1': dec1, 'dec2': dec2}
+  return pd.read_sql(sqlalchemy.text(readSQL('coneSearchActive.sql')), con=cnx, params=params)
+
+
+def deactivateUnobservedTransients(cnx):
+  '''
+  Deactivate targets that have not been updated for 4 days or have faded, in
+  tides_master and tides_targets (marked dirty), returns the tides_id of every
+  target deactivated.
+  '''
+  deactivated = cnx.execute(sqlalchemy.text(readSQL('deactivateUnobserved.sql'))).scalars().all()
+  cnx.execute(sqlalchemy.text(readSQL('deactivateTargets.sql')), {'deactivated': list(deactivated)})
+  print('Deactivated Transients', len(deactivated))
+  return deactivated
+
+
+def prepare4MOSTUpdate(cnx):
+  '''
+  The targets to send to 4MOST: every dirty row of tides_targets, highest
+  priority first, with its payload columns, version and the pk_4most and
+  payload_hash from tides_master.
+  '''
+  return pd.read_sql(sqlalchemy.text(readSQL('stage4MOSTupdates.sql')), con=cnx)
+
+
+def _realAsText(values):
+  '''
+  REAL values as psycopg2 reads them, which is from their shortest decimal
+  text form: each float32 rounded to the fewest digits that give it back.
+  asyncpg instead widens the float32 to double bit for bit.
+  '''
+  return np.array([float(np.format_float_positional(x, unique=True)) for x in np.asarray(values, dtype=np.float32)],
+                  dtype=np.float64)
+
+
+def _doneTargets(toUpdate, failed):
+  '''Parameters of clearTargetsDirty.sql for the targets of toUpdate not in failed.'''
+  done = toUpdate[~toUpdate['tides_id'].isin(list(failed))]
+  return {'tides_id': done['tides_id'].astype(int).tolist(), 'version': done['version'].astype(int).tolist()}
+
+
+def markTargetsSent(cnx, toUpdate, failed=(), unsure=()):
+  '''
+  Clear the dirty flag of the targets of toUpdate that were sent or needed no
+  update, leaving those in failed to be tried again next run. A target that
+  changed again since it was read (its version moved on) stays dirty. Targets
+  in unsure are marked create_unsure, so they are looked up in 4MOST before
+  being created again (see fourMostSubmit).
+  '''
+  cnx.execute(sqlalchemy.text(readSQL('clearTargetsDirty.sql')), _doneTargets(toUpdate, failed))
+  if len(unsure) > 0:
+    cnx.execute(sqlalchemy.text(readSQL('markCreateUnsure.sql')), {'unsure': [int(x) for x in unsure]})
+
+
+def latencyReport(cnx):
+  '''
+  The seconds between the trace times (see LatencyTrace) of every target
+  staged this run, from alert to 4MOST, one LATENCY_STEPS column each, and
+  the count, 50th, 90th and 99th percentiles and maximum of every step.
+  Missing steps (a target that needed no 4MOST update) are left out.
+  '''
+  latencies = pd.read_sql(sqlalchemy.text(readSQL('traceLatencies.sql')), con=cnx)
+  report = pd.DataFrame([{'objects': int(latencies[x].notna().sum()),
+                          'p50': latencies[x].quantile(0.5), 'p90': latencies[x].quantile(0.9),
+                          'p99': latencies[x].quantile(0.99), 'max': latencies[x].max()} for x in LATENCY_STEPS],
+                        index=LATENCY_STEPS)
+  return latencies, report
+
+
+def updateTiDESMasterwith4MOSTKey(newTable, cnx):
+  newTable.columns = map(str.lower, newTable.columns)
+  newTable['pk_4most'] = newTable['pk_4most'].astype(np.int64).copy()
+  newTable['trace_acked'] = newTable['trace_acked'].astype(np.float64)
+  newTable.to_sql('latest_4most', con=cnx, if_exists='replace', index=False)
+  cnx.execute(sqlalchemy.text(readSQL('updateMasterWith4MOSTkey.sql')))
+
+
+def _reportUnwritten(sentKeys):
+  '''Say which targets reached 4MOST when writing their keys to tides_master failed.'''
+  sent = pd.concat(sentKeys, ignore_index=True) if sentKeys else pd.DataFrame(columns=['tides_id', 'pk_4most'])
+  print('Writing 4MOST keys to tides_master failed, %d targets were sent but their keys not stored:' % len(sent))
+  print(sent[['tides_id', 'pk_4most']].to_string(index=False))
+
+
+async def send4MOSTUpdatesAsync(asyncEngine, submit, batchSize=500):
+  '''
+  prepare4MOSTUpdate, the 4MOST submission, updateTiDESMasterwith4MOSTKey and
+  markTargetsSent as a pipeline, for once the merge and deactivation have
+  been committed.
+
+  The rows of stage4MOSTupdates.sql are read batchSize at a time on one
+  pooled connection. Each batch is passed to submit on a thread as soon as
+  it is read. submit is a blocking function of a DataFrame returning the
+  keys sent, the tides_id of the targets that failed and of those whose
+  create is unsure, like fourMostSubmit.submitTransients with failed and
+  unsure. The keys that come back are
+  written to tides_master, and the batch marked sent in tides_targets, on a
+  second connection. Reading the next batch,
+  sending this one and writing back the last one's keys all overlap. If
+  writing back fails, no further batches are sent, the targets already sent
+  are listed and the error raised. Returns the keys of every target sent.
+  '''
+  batches = asyncio.Queue(maxsize=2)
+  keys = asyncio.Queue()
+  sentKeys = []
+
+  async def read():
+    try:
+      async with asyncEngine.connect() as conn:
+        result = await conn.stream(sqlalchemy.text(readSQL('stage4MOSTupdates.sql')))
+        columns = list(result.keys())
+        async for rows in result.partitions(batchSize):
+          batch = pd.DataFrame([tuple(x) for x in rows], columns=columns)
+          ## Match psycopg2 so payloads and their hashes are the same either way
+          for column in REAL_COLUMNS:
+            if column in batch:
+              batch[column] = _realAsText(batch[column])
+          await batches.put(batch)
+    except Exception:
+      await batches.put(None)
+      raise
+    await batches.put(None)
+
+  async def send():
+    try:
+      while (batch := await batches.get()) is not None:
+        ## Stop sending as soon as the keys can no longer be written back
+        if writer.done():
+          writer.result()
+          raise RuntimeError('The 4MOST key writer stopped before every batch was sent')
+        sent, failed, unsure = await asyncio.to_thread(submit, batch)
+        sentKeys.append(sent)
+        await keys.put((batch, sent, failed, unsure))
+    finally:
+      await keys.put(None)
+
+  async def writeBack():
+    async with asyncEngine.begin() as conn:
+      while (item := await keys.get()) is not None:
+        batch, sent, failed, unsure = item
+        if len(sent) > 0:
+          await conn.execute(sqlalchemy.text(readSQL('update4MOSTkeyRow.sql')), sent.to_dict('records'))
+        await conn.execute(sqlalchemy.text(readSQL('clearTargetsDirty.sql')), _doneTargets(batch, failed))
+        if len(unsure) > 0:
+          await conn.execute(sqlalchemy.text(readSQL('markCreateUnsure.sql')), {'unsure': [int(x) for x in unsure]})
+
+  reader = asyncio.create_task(read())
+  writer = asyncio.create_task(writeBack())
+  try:
+    await send()
+    await reader
+  except BaseException:
+    ## Stop reading, but still write back the keys of what was already sent
+    reader.cancel()
+    await asyncio.wait([reader])
+    raise
+  finally:
+    await asyncio.wait([writer])
+    if not writer.cancelled() and writer.exception() is not None:
+      _reportUnwritten(sentKeys)
+  await writer
+  if not sentKeys:
+    return pd.DataFrame(columns=['tides_id', 'pk_4most', 'payload_hash', 'trace_acked'])
+  return pd.concat(sentKeys, ignore_index=True)
+
+
+def makeStreamConsumer(host, groupID, topic):
+  '''
+  A Kafka consumer like lasair_consumer, but with automatic offset commits
+  switched off. The streaming flow commits offsets itself, once a batch has
+  been upserted and pushed to 4MOST, so a crash replays the batch rather than
+  losing it.
+  '''
+  from confluent_kafka import Consumer
+  settings = {
+    'bootstrap.servers': host,
+    'group.id': groupID,
+    'enable.auto.commit': False,
+    'default.topic.config': {'auto.offset.reset': 'smallest'}
+  }
+  consumer = Consumer(settings)
+  consumer.subscribe([topic])
+  return consumer
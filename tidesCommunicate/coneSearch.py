@@ -0,0 +1,72 @@
+"""Active TiDES targets around a 4MOST field centre
+Usage:
+    coneSearch.py --ra=<DEG> --dec=<DEG> [--radius=<DEG>] [--limit=<NUM>] [--output=<PATH>] [--db=<URL>] [--settings=<PATH>]
+    coneSearch.py -h | --help
+
+Options:
+    --ra=DEG                   Right ascension of the field centre in degrees.
+    --dec=DEG                  Declination of the field centre in degrees.
+    -r DEG, --radius=DEG       Search radius in degrees, a 4MOST field is about 1.2 degrees in radius. [default: 1.2]
+    -l NUM, --limit=NUM        Return only the first NUM targets.
+    -o PATH, --output=PATH     Write the targets to this CSV file rather than print them.
+    --db=URL                   SQLAlchemy URL of the TiDES database, instead of the one in the settings file.
+    --settings=PATH            The flow settings file with the TiDES database details. [default: ./flowSettings.yaml]
+    -h --help                  Show this screen
+
+Targets come back brightest (in g or r) first, with their separation from the
+field centre in degrees. The lookup runs on the GiST index over point(ra, dec)
+of the active targets (addMasterIndexes.sql), so it touches only the rows
+near the field.
+
+#Example:
+#    python coneSearch.py --ra=150.1 --dec=-2.2 --radius=1.2 --limit=100
+"""
+
+from docopt import docopt
+import sys
+import time
+from pathlib import Path
+
+import sqlalchemy
+
+## The stages use the light curve code in tidesTargeting
+TARGETING = str(Path(__file__).resolve().parent.parent / 'tidesTargeting')
+if TARGETING not in sys.path:
+  sys.path.insert(0, TARGETING)
+
+import commStages
+from commConfig import getConfig
+
+
+def main():
+  args = docopt(__doc__)
+  try:
+    ra = float(args['--ra'])
+    dec = float(args['--dec'])
+    radius = float(args['--radius'])
+    limit = None if args['--limit'] is None else int(args['--limit'])
+  except ValueError as ve:
+    print('The ra, dec and radius must be numbers, the limit an integer')
+    sys.exit(1)
+
+  if args['--db'] is not None:
+    engine = sqlalchemy.create_engine(args['--db'], future=True)
+  else:
+    cfg = getConfig('devConfig', args['--settings'])
+    engine = commStages.makeEngine(cfg['tidesDBUser'], cfg['tidesDBpass'], cfg['tidesDBdatabase'],
+                                   host=cfg.dbHost, port=cfg.dbPort)
+
+  with engine.connect() as conn:
+    start = time.perf_counter()
+    targets = commStages.coneSearch(conn, ra, dec, radius, limit=limit)
+    elapsed = time.perf_counter() - start
+
+  if args['--output'] is not None:
+    targets.to_csv(args['--output'], index=False)
+  else:
+    print(targets.to_string(index=False))
+  print('%d active targets within %g deg of (%g, %g) in %.1f ms' % (len(targets), radius, ra, dec, 1000*elapsed))
+
+
+if __name__ == "__main__":
+  main()
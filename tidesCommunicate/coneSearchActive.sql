@@ -0,0 +1,13 @@
+SELECT tides_id, name, ra, dec, rmag, gmag, triggerjd, pk_4most, separation
+FROM (
+  SELECT tm.*,
+         degrees(2*asin(least(1, sqrt(sin(radians(tm.dec - :dec)/2)^2
+                                      + cos(radians(tm.dec))*cos(radians(:dec))*sin(radians(tm.ra - :ra)/2)^2)))) AS separation
+  FROM tides_master tm
+  WHERE tm.active
+    AND (point(tm.ra, tm.dec) <@ box(point(:ra1, :dec1), point(:ra2, :dec2))
+      OR point(tm.ra, tm.dec) <@ box(point(:ra3, :dec1), point(:ra4, :dec2)))
+) candidates
+WHERE separation <= :radius
+ORDER BY least(rmag, gmag) NULLS LAST, separation
+LIMIT :limit;
@@ -0,0 +1,6 @@
+CREATE TABLE IF NOT EXISTS tides_alias(
+    alias VARCHAR PRIMARY KEY,
+    tides_id integer NOT NULL,
+    sep_arcsec double precision,
+    created TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,20 @@
+CREATE TABLE IF NOT EXISTS tides_detections(
+    name VARCHAR NOT NULL,
+    fid smallint NOT NULL,
+    nid integer NOT NULL,
+    jd double precision NOT NULL,
+    magpsf double precision,
+    sig double precision
+);
+
+-- Every light curve is replaced whole when it is fetched again
+CREATE INDEX IF NOT EXISTS tides_detections_name_idx ON tides_detections (name);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS tides_detections_stage(
+    name VARCHAR NOT NULL,
+    fid smallint,
+    nid integer,
+    jd double precision,
+    magpsf double precision,
+    sig double precision
+);
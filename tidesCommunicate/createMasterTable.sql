@@ -13,7 +13,22 @@ CREATE TABLE tides_master(
     jdrmax double precision,
     ncandgp real,
     sherlock_class VARCHAR,
+    triggerjd double precision,
+    pk_4most bigint,
+    payload_hash VARCHAR,
     active BOOL DEFAULT FALSE,
     created TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-    updated TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    updated TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    -- When the last alert merged was read, its light curve fetched and evaluated, merged here and acknowledged by 4MOST
+    trace_received TIMESTAMP WITH TIME ZONE,
+    trace_fetched TIMESTAMP WITH TIME ZONE,
+    trace_selected TIMESTAMP WITH TIME ZONE,
+    trace_upserted TIMESTAMP WITH TIME ZONE,
+    trace_acked TIMESTAMP WITH TIME ZONE
 );
+
+CREATE UNIQUE INDEX tides_master_name_idx ON tides_master (name);
+CREATE INDEX tides_master_active_updated_idx ON tides_master (updated) WHERE active;
+CREATE INDEX tides_master_active_faint_idx ON tides_master (tides_id) WHERE active AND rmag > 20.5 AND gmag > 20.5;
+CREATE INDEX tides_master_radec_idx ON tides_master USING gist (point(ra, dec));
+CREATE INDEX tides_master_active_radec_idx ON tides_master USING gist (point(ra, dec)) WHERE active;
@@ -0,0 +1,23 @@
+CREATE TABLE IF NOT EXISTS tides_selection_state(
+    name VARCHAR NOT NULL,
+    selection VARCHAR NOT NULL,
+    bands integer NOT NULL,
+    nnights integer NOT NULL,
+    lastnid integer NOT NULL,
+    minmag double precision NOT NULL,
+    lastjd double precision NOT NULL,
+    passed BOOL NOT NULL,
+    triggerjd double precision NOT NULL,
+    updated TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (name, selection)
+);
+CREATE UNLOGGED TABLE IF NOT EXISTS tides_selection_state_stage(
+    name VARCHAR NOT NULL,
+    bands integer,
+    nnights integer,
+    lastnid integer,
+    minmag double precision,
+    lastjd double precision,
+    passed BOOL,
+    triggerjd double precision
+);
@@ -0,0 +1,24 @@
+CREATE UNLOGGED TABLE IF NOT EXISTS tides_stage(
+    name VARCHAR NOT NULL,
+    ramean double precision,
+    decmean double precision,
+    jdmin double precision,
+    jdmax double precision,
+    magrmin real,
+    maggmin real,
+    rmag real,
+    gmag real,
+    jdgmax double precision,
+    jdrmax double precision,
+    ncandgp real,
+    classification VARCHAR,
+    triggerjd double precision,
+    trace_received double precision,
+    trace_fetched double precision,
+    trace_selected double precision
+);
+
+-- Stages made before the trace times were added
+ALTER TABLE tides_stage ADD COLUMN IF NOT EXISTS trace_received double precision,
+                        ADD COLUMN IF NOT EXISTS trace_fetched double precision,
+                        ADD COLUMN IF NOT EXISTS trace_selected double precision;
@@ -0,0 +1,34 @@
+CREATE TABLE IF NOT EXISTS tides_targets(
+    tides_id integer PRIMARY KEY REFERENCES tides_master ON DELETE CASCADE,
+    name VARCHAR NOT NULL,
+    ra double precision,
+    dec double precision,
+    mag real,
+    date_earliest double precision,
+    date_latest double precision,
+    is_active BOOL NOT NULL,
+    priority real,
+    dirty BOOL NOT NULL DEFAULT TRUE,
+    version bigint NOT NULL DEFAULT 1,
+    create_unsure BOOL NOT NULL DEFAULT FALSE,
+    changed TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- A target list made before create_unsure was added, checked first so the merge does not lock it every run
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = 'tides_targets'::regclass AND attname = 'create_unsure' AND NOT attisdropped) THEN
+        ALTER TABLE tides_targets ADD COLUMN create_unsure BOOL NOT NULL DEFAULT FALSE;
+    END IF;
+END
+$$;
+
+-- Targets still to be sent to 4MOST, highest priority first
+CREATE INDEX IF NOT EXISTS tides_targets_dirty_idx ON tides_targets (priority DESC NULLS LAST, tides_id) WHERE dirty;
+
+-- Filled from tides_master the first time, targets that never reached 4MOST are left to send
+INSERT INTO tides_targets (tides_id, name, ra, dec, mag, date_earliest, date_latest, is_active, priority, dirty)
+SELECT tides_id, name, ra, dec, rmag, jdmax, jdmax + 4, coalesce(active, False), 20.5 - rmag,
+       coalesce(active, False) AND pk_4most IS NULL
+FROM tides_master
+WHERE NOT EXISTS (SELECT 1 FROM tides_targets);
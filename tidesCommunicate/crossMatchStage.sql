@@ -0,0 +1,33 @@
+-- Point staged alerts of objects not yet in tides_master at an existing target
+-- within :radius degrees, so the merge updates that target instead of adding a
+-- near-duplicate. Each target takes at most one alias per run, the most recent,
+-- and only if it is not staged itself under its own name.
+WITH nearest AS (
+  SELECT DISTINCT ON (m.tides_id) ts.name AS alias, m.tides_id, m.name, m.separation
+  FROM tides_stage ts
+  -- Half width in RA of a box holding the circle, wide open near the poles
+  CROSS JOIN LATERAL (SELECT least(180, :radius/greatest(cos(radians(least(89.999, abs(ts.decmean) + :radius))), 1e-6)) AS dra) w
+  CROSS JOIN LATERAL (
+    SELECT tm.tides_id, tm.name,
+           degrees(2*asin(least(1, sqrt(sin(radians(tm.dec - ts.decmean)/2)^2
+                                        + cos(radians(tm.dec))*cos(radians(ts.decmean))*sin(radians(tm.ra - ts.ramean)/2)^2)))) AS separation
+    FROM tides_master tm
+    WHERE (point(tm.ra, tm.dec) <@ box(point(ts.ramean - w.dra, ts.decmean - :radius), point(ts.ramean + w.dra, ts.decmean + :radius))
+        OR point(tm.ra, tm.dec) <@ box(point(ts.ramean - w.dra - 360, ts.decmean - :radius), point(ts.ramean + w.dra - 360, ts.decmean + :radius))
+        OR point(tm.ra, tm.dec) <@ box(point(ts.ramean - w.dra + 360, ts.decmean - :radius), point(ts.ramean + w.dra + 360, ts.decmean + :radius)))
+      AND tm.name <> ts.name
+    ORDER BY separation
+    LIMIT 1
+  ) m
+  WHERE m.separation <= :radius
+    AND NOT EXISTS (SELECT 1 FROM tides_master same WHERE same.name = ts.name)
+    AND NOT EXISTS (SELECT 1 FROM tides_stage other WHERE other.name = m.name)
+  ORDER BY m.tides_id, ts.jdmax DESC NULLS LAST
+), aliased AS (
+  INSERT INTO tides_alias (alias, tides_id, sep_arcsec)
+  SELECT alias, tides_id, separation*3600 FROM nearest
+  ON CONFLICT (alias) DO NOTHING
+)
+UPDATE tides_stage ts SET name = nearest.name
+FROM nearest WHERE ts.name = nearest.alias
+RETURNING nearest.alias, nearest.name;
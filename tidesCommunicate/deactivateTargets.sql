@@ -0,0 +1,2 @@
+UPDATE tides_targets SET is_active=False, dirty=True, version=version + 1, changed=CURRENT_TIMESTAMP
+WHERE tides_id = ANY(:deactivated);
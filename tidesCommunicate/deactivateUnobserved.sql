@@ -1,4 +1,4 @@
-CREATE TEMP TABLE to_deactivate AS SELECT * from tides_master where active=True and updated < now() - interval '4days' or (rmag>20.5 and gmag>20.5);
-
-UPDATE tides_master SET active=False FROM to_deactivate WHERE to_deactivate.tides_id=tides_master.tides_id;  
-
+UPDATE tides_master SET active=False
+WHERE (active AND updated < now() - interval '4days')
+   OR (active AND rmag > 20.5 AND gmag > 20.5)
+RETURNING tides_id;
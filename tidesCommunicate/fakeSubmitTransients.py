@@ -0,0 +1,84 @@
+'''
+A local stand-in for the proprietary submit_transients 4MOST API module.
+
+It keeps the transients it is sent in memory and hands out increasing
+primary keys, so the 4MOST submission stage can be run and tested without
+access to 4MOST. Latency and intermittent failures can be simulated by
+setting LATENCY and FAILURE_RATE, and creates that are made but whose answer
+never comes back (a timeout after 4MOST accepted the request) by setting
+LOST_REPLY_RATE.
+'''
+
+import random
+import threading
+import time
+
+SCHEMA = None
+USERNAME = None
+PASSWORD = None
+ACCESS_TOKEN = None
+
+LATENCY = 0.0
+FAILURE_RATE = 0.0
+LOST_REPLY_RATE = 0.0
+
+transients = {}
+calls = {'create': 0, 'update': 0, 'find': 0}
+_lock = threading.Lock()
+_random = random.Random(0)
+
+
+class FakeAPIError(Exception):
+  '''Raised to simulate a failed 4MOST API call.'''
+
+
+class FakeTimeout(Exception):
+  '''Raised to simulate a call whose answer never came back.'''
+
+
+def _call(kind):
+  with _lock:
+    calls[kind] += 1
+    fail = _random.random() < FAILURE_RATE
+  if LATENCY:
+    time.sleep(LATENCY)
+  if fail:
+    raise FakeAPIError('Simulated 4MOST failure')
+
+
+def create_transient(data, printout=False):
+  _call('create')
+  with _lock:
+    pk = len(transients) + 1
+    transients[pk] = dict(data)
+    lost = _random.random() < LOST_REPLY_RATE
+  if lost:
+    raise FakeTimeout('Simulated timeout after the transient was made')
+  return dict(data, id=pk)
+
+
+def update_transient(pk, data, printout=False):
+  _call('update')
+  with _lock:
+    if pk not in transients:
+      raise FakeAPIError('No transient with id %d' % pk)
+    transients[pk] = dict(data)
+  return dict(data, id=pk)
+
+
+def find_transient(name):
+  '''The transient made for name, with its id, or None.'''
+  _call('find')
+  with _lock:
+    for pk, data in transients.items():
+      if data.get('name') == name:
+        return dict(data, id=pk)
+  return None
+
+
+def reset():
+  '''Forget every transient and call count.'''
+  with _lock:
+    transients.clear()
+    for kind in calls:
+      calls[kind] = 0
@@ -0,0 +1,191 @@
+'''
+Submission of TiDES targets to the 4MOST transient API.
+
+Payloads are built column-wise for the whole table rather than row by row.
+Every payload sent is hashed and the hash is stored alongside pk_4most in
+tides_master, so a target whose payload has not changed since the last
+update is not sent again. The remaining calls go out through a bounded
+worker pool, updates retried with exponential backoff. Creates are not
+idempotent: a create that timed out may still have been made in 4MOST, and
+sending it again would make a duplicate. They are only retried when the
+connection was never made, so the request cannot have reached 4MOST. A
+create that failed once sent is reported as unsure (create_unsure in
+tides_targets). Before such a target is created again it is looked up by
+name with st.find_transient, and the transient found is updated instead.
+An API module without find_transient cannot check, so unsure targets are
+held back, and reported every run, until create_unsure is cleared by hand.
+
+st is the submit_transients module, or anything with the same
+create_transient/update_transient (and optionally find_transient) functions (see fakeSubmitTransients.py).
+Each API call is timed as the 4most_create or 4most_update stage of the
+metrics passed in (see pipelineMetrics).
+'''
+
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from pipelineMetrics import NO_METRICS
+
+# Columns of the targets sent, written back to tides_master by updateMasterWith4MOSTkey.sql
+SENT_COLUMNS = ['tides_id', 'pk_4most', 'payload_hash', 'trace_acked']
+
+# Fields that are the same for every TiDES SN target
+PAYLOAD_TEMPLATE = {
+  "uploadedfor_survey_id": 15,
+  "pmra": 0.0, "pmdec": 0.0,
+  "epoch": 2000,
+  "resolution": 1,
+  "subsurvey": 'tides-sn',
+  "cadence": 1048576,
+  "template": 'SN_spec_specid56_snt1_phase5_redshift0.169.fits',
+  "ruleset": 'tides_snJuly2022',
+  "redshift_estimate": 0.1, "redshift_error": 0,
+  "extent_flag": 0, "extent_parameter": 0, "extent_index": 0,
+  "mag_err": 0, "mag_type": 'SDSS_r_AB',
+  "reddening": 0,
+  "t_exp_b": 60., "t_exp_d": 60., "t_exp_g": 60.,
+}
+
+
+def buildPayloads(tableIn):
+  '''
+  One 4MOST payload dict per row of tableIn (rows of tides_targets, whose
+  payload columns are kept up to date by the upsert and deactivation), built
+  column-wise.
+  '''
+  columns = {
+    "name": tableIn['name'].astype(str).tolist(),
+    "ra": tableIn['ra'].to_numpy(dtype=np.float64).tolist(),
+    "dec": np.minimum(40, tableIn['dec'].to_numpy(dtype=np.float64)).tolist(),
+    "mag": tableIn['mag'].to_numpy(dtype=np.float64).tolist(),
+    "date_earliest": tableIn['date_earliest'].to_numpy(dtype=np.float64).tolist(),
+    "date_latest": tableIn['date_latest'].to_numpy(dtype=np.float64).tolist(),
+    "is_active": tableIn['is_active'].astype(bool).tolist(),
+  }
+  return [dict(PAYLOAD_TEMPLATE, **dict(zip(columns, values))) for values in zip(*columns.values())]
+
+
+def payloadHash(payload):
+  '''Stable hash of a payload, used to skip updates that would change nothing.'''
+  return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+# Errors, by class name so requests and urllib3 need not be imported, raised before a request is sent
+NOT_SENT_ERRORS = {'ConnectionRefusedError', 'ConnectTimeout', 'NewConnectionError', 'NameResolutionError'}
+
+
+def _notSent(e):
+  '''True when e, or an error it was raised from, shows the request never left this machine.'''
+  seen = set()
+  while e is not None and id(e) not in seen:
+    seen.add(id(e))
+    if any(x.__name__ in NOT_SENT_ERRORS for x in type(e).__mro__):
+      return True
+    ## requests keeps the urllib3 error as the first argument rather than the cause
+    inner = [x for x in getattr(e, 'args', ()) if isinstance(x, BaseException)]
+    reason = getattr(e, 'reason', None)
+    e = e.__cause__ or e.__context__ or (reason if isinstance(reason, BaseException) else None) or (inner[0] if inner else None)
+  return False
+
+
+class UnsureCreate(Exception):
+  '''A create that failed after it was sent, 4MOST may or may not have made the transient.'''
+
+
+def _withRetry(call, retries, backoff, metrics=NO_METRICS, stage='4most', retryIf=None):
+  '''call(), retried up to retries times with exponential backoff on the errors retryIf accepts, any error if None.'''
+  for attempt in range(retries + 1):
+    try:
+      with metrics.timer(stage):
+        return call()
+    except Exception as e:
+      metrics.count('fourmost_errors')
+      if attempt == retries or (retryIf is not None and not retryIf(e)):
+        raise
+      print('4MOST call failed (%s), retrying in %.1fs' % (e, backoff*2**attempt))
+      time.sleep(backoff*2**attempt)
+
+
+def submitTransients(st, tableIn, workers=4, retries=3, backoff=1.0, metrics=NO_METRICS, failed=None, unsure=None):
+  '''
+  Create the rows of tableIn without a pk_4most in 4MOST and update the rows
+  that have one, skipping updates whose payload hash matches payload_hash.
+
+  Returns a DataFrame of tides_id, pk_4most, payload_hash and trace_acked
+  (the time.time() 4MOST answered) for every target that was sent
+  successfully, and a dict of counts. Targets that still fail
+  after the retries are reported and left for the next run, their tides_id
+  appended to the list failed if one is given. Targets whose create failed
+  once it was sent, and unsure targets that could not be checked, are also
+  appended to the list unsure. Rows with create_unsure set are looked up
+  before they are created (see the module docstring).
+  '''
+  counts = {'created': 0, 'updated': 0, 'unchanged': 0, 'recovered': 0, 'failed': 0, 'unsure': 0}
+  if len(tableIn) == 0:
+    return pd.DataFrame(columns=SENT_COLUMNS), counts
+
+  payloads = buildPayloads(tableIn)
+  hashes = [payloadHash(x) for x in payloads]
+  pks = tableIn['pk_4most'].to_numpy() if 'pk_4most' in tableIn.columns else np.full(len(tableIn), np.nan)
+  lastHashes = tableIn['payload_hash'].tolist() if 'payload_hash' in tableIn.columns else [None]*len(tableIn)
+  checkFirst = tableIn['create_unsure'].eq(True).to_numpy() if 'create_unsure' in tableIn.columns else np.zeros(len(tableIn), dtype=bool)
+
+  def update(i, pk):
+    _withRetry(lambda: st.update_transient(pk=int(pk), data=payloads[i], printout=False), retries, backoff,
+               metrics, '4most_update')
+    return np.int64(pk), time.time()
+
+  def send(i):
+    if not pd.isnull(pks[i]):
+      return ('updated',) + update(i, pks[i])
+    if checkFirst[i]:
+      ## An earlier create may have gone through, use the transient it made
+      if not hasattr(st, 'find_transient'):
+        raise UnsureCreate('an earlier create may have gone through, and this API cannot look it up')
+      found = _withRetry(lambda: st.find_transient(name=payloads[i]['name']), retries, backoff, metrics, '4most_find')
+      if found is not None:
+        return ('recovered',) + update(i, found['id'])
+    ## Only retried when the request never reached 4MOST, see the module docstring
+    try:
+      created = _withRetry(lambda: st.create_transient(data=payloads[i], printout=False), retries, backoff,
+                           metrics, '4most_create', retryIf=_notSent)
+    except Exception as e:
+      if _notSent(e):
+        raise
+      raise UnsureCreate(e) from e
+    return 'created', np.int64(created['id']), time.time()
+
+  toSend = []
+  for i in range(len(payloads)):
+    if not pd.isnull(pks[i]) and lastHashes[i] == hashes[i]:
+      counts['unchanged'] += 1
+    else:
+      toSend.append(i)
+
+  sent = []
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    for i, future in zip(toSend, [pool.submit(send, i) for i in toSend]):
+      try:
+        action, pk, acked = future.result()
+      except Exception as e:
+        print('Failed to send', payloads[i]['name'], 'to 4MOST:', e)
+        counts['failed'] += 1
+        if failed is not None:
+          failed.append(tableIn['tides_id'].iloc[i])
+        if isinstance(e, UnsureCreate):
+          counts['unsure'] += 1
+          if unsure is not None:
+            unsure.append(tableIn['tides_id'].iloc[i])
+        continue
+      counts[action] += 1
+      sent.append((tableIn['tides_id'].iloc[i], pk, hashes[i], acked))
+
+  print('4MOST targets:', counts)
+  for action, n in counts.items():
+    metrics.count('fourmost_' + action, n)
+  return pd.DataFrame(sent, columns=SENT_COLUMNS), counts
@@ -0,0 +1,2 @@
+-- Targets whose create may have reached 4MOST without an answer, looked up by name before they are created again
+UPDATE tides_targets SET create_unsure = TRUE WHERE tides_id = ANY(CAST(:unsure AS integer[]));
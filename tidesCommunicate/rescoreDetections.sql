@@ -0,0 +1,33 @@
+-- One selection function over every stored light curve, as lightcurveSelection.triggerGroups:
+-- the JD each object met minBands, minNights and magLimit, and its trigger JD, the latest of the three.
+-- Only the objects that pass are kept, in tides_rescored until the end of the transaction.
+DROP TABLE IF EXISTS tides_rescored;
+CREATE TEMP TABLE tides_rescored ON COMMIT DROP AS
+WITH objects AS (
+    -- The first significant detection in each band (fid 1-3, BAND_NAMES in lightcurveSelection)
+    -- and the first detection brighter than magLimit
+    SELECT name,
+           min(jd) FILTER (WHERE magpsf <= :magLimit) AS bright,
+           ARRAY[min(jd) FILTER (WHERE fid = 1 AND fid = ANY(:fids) AND sig >= :significance),
+                 min(jd) FILTER (WHERE fid = 2 AND fid = ANY(:fids) AND sig >= :significance),
+                 min(jd) FILTER (WHERE fid = 3 AND fid = ANY(:fids) AND sig >= :significance)] AS bands
+    FROM tides_detections
+    GROUP BY name
+), nights AS (
+    -- The first significant detection of each night, numbered in time order
+    SELECT name, jd, row_number() OVER (PARTITION BY name ORDER BY jd) AS k
+    FROM (SELECT name, min(jd) AS jd
+          FROM tides_detections
+          WHERE fid = ANY(:fids) AND sig >= :significance
+          GROUP BY name, nid) n
+)
+SELECT o.name, greatest(o.bright, b.jd, nights.jd) AS triggerjd
+FROM objects o
+LEFT JOIN LATERAL (SELECT x AS jd FROM unnest(o.bands) x WHERE x IS NOT NULL
+                   ORDER BY x OFFSET greatest(:minBands - 1, 0) LIMIT 1) b ON :minBands > 0
+LEFT JOIN nights ON nights.name = o.name AND nights.k = :minNights
+WHERE o.bright IS NOT NULL
+  AND (:minBands <= 0 OR b.jd IS NOT NULL)
+  AND (:minNights <= 0 OR nights.jd IS NOT NULL);
+CREATE UNIQUE INDEX ON tides_rescored (name);
+ANALYZE tides_rescored;
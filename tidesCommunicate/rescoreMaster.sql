@@ -0,0 +1,16 @@
+-- Objects with stored detections that pass the new selection function stay or become active
+-- (unless stale or faded, as deactivateUnobserved.sql), the rest are deactivated
+UPDATE tides_master tm SET
+active = r.active,
+triggerjd = coalesce(r.triggerjd, tm.triggerjd)
+FROM (
+    SELECT tm2.tides_id, p.triggerjd, tm2.active AS was_active,
+           p.name IS NOT NULL AND tm2.updated >= now() - interval '4days'
+           AND NOT coalesce(tm2.rmag > 20.5 AND tm2.gmag > 20.5, False) AS active
+    FROM tides_master tm2
+    LEFT JOIN tides_rescored p ON p.name = tm2.name
+    WHERE EXISTS (SELECT 1 FROM tides_detections d WHERE d.name = tm2.name)
+) r
+WHERE tm.tides_id = r.tides_id
+  AND (tm.active, tm.triggerjd) IS DISTINCT FROM (r.active, coalesce(r.triggerjd, tm.triggerjd))
+RETURNING tm.tides_id, r.was_active, tm.active;
@@ -0,0 +1,93 @@
+"""Re-score every stored light curve against a selection function, in the TiDES database
+Usage:
+    rescoreSelection.py [--selection=<PATH>] [--name=<NAME>] [--apply=<BOOL>] [--output=<PATH>] [--db=<URL>] [--settings=<PATH>]
+    rescoreSelection.py -h | --help
+
+Options:
+    -s PATH, --selection=PATH  The selection function YAML file, the selectFunctionPath of the settings file if not given.
+    -n NAME, --name=NAME       The selection function in it, the selectFunction of the settings file if not given.
+    -a BOOL, --apply=BOOL      Commit the new active flags and trigger dates. Otherwise only report what would change. [default: False]
+    -o PATH, --output=PATH     Write the name and trigger JD of every object that passes to this CSV file.
+    --db=URL                   SQLAlchemy URL of the TiDES database, instead of the one in the settings file.
+    --settings=PATH            The flow settings file with the TiDES database details. [default: ./flowSettings.yaml]
+    -h --help                  Show this screen
+
+The flow keeps a summary of every light curve it fetches in tides_detections
+when storeDetections is set in flowSettings.yaml (see detectionSummary in
+tidesTargeting). After editing magLimit, minNights, minBands, significance or
+filters, this evaluates the selection function over all of them in one SQL
+aggregation, with no Lasair requests, and updates the active flag and trigger
+JD of every target in tides_master in bulk. Targets that become active or
+inactive are marked dirty, so the next flow run sends them to 4MOST. Only
+targets already in tides_master are updated: objects that pass now but never
+did are listed in --output, not added, as there is no alert to stage them from.
+
+#Example:
+#    python rescoreSelection.py --selection=../tidesTargeting/tidesSelectionFunctions.yml --name=tidesSNLSSTSelect --apply=True
+"""
+
+from docopt import docopt
+import sys
+import time
+from pathlib import Path
+
+import sqlalchemy
+import yaml
+
+## The stages use the light curve code in tidesTargeting
+TARGETING = str(Path(__file__).resolve().parent.parent / 'tidesTargeting')
+if TARGETING not in sys.path:
+  sys.path.insert(0, TARGETING)
+
+import commStages
+from commConfig import getConfig
+
+
+def main():
+  args = docopt(__doc__)
+  if args['--apply'] not in ['True', 'False']:
+    print('--apply must be True or False')
+    sys.exit(1)
+  apply = args['--apply'] == 'True'
+
+  cfg = None
+  if args['--db'] is None or args['--selection'] is None or args['--name'] is None:
+    cfg = getConfig('devConfig', args['--settings'])
+  selectionPath = args['--selection'] if args['--selection'] is not None else cfg['selectFunctionPath']
+  name = args['--name'] if args['--name'] is not None else str(cfg['selectFunction'])
+  selectionFile = yaml.load(open(selectionPath), Loader=yaml.SafeLoader)
+  if name not in selectionFile:
+    print('No selection function', name, 'in', selectionPath)
+    sys.exit(1)
+  criteria = selectionFile[name]
+
+  if args['--db'] is not None:
+    engine = sqlalchemy.create_engine(args['--db'], future=True)
+  else:
+    engine = commStages.makeEngine(cfg['tidesDBUser'], cfg['tidesDBpass'], cfg['tidesDBdatabase'],
+                                   host=cfg.dbHost, port=cfg.dbPort)
+
+  with engine.connect() as conn:
+    trans = conn.begin()
+    start = time.perf_counter()
+    passing, changed = commStages.rescoreMaster(conn, criteria)
+    elapsed = time.perf_counter() - start
+    stored = conn.execute(sqlalchemy.text('SELECT count(DISTINCT name) FROM tides_detections')).scalar()
+    if apply:
+      trans.commit()
+    else:
+      trans.rollback()
+
+  if args['--output'] is not None:
+    passing.to_csv(args['--output'], index=False)
+  print('%s: %d of %d stored light curves pass, re-scored in %.2fs' % (name, len(passing), stored, elapsed))
+  was, now = changed['was_active'].eq(True), changed['active'].eq(True)
+  print('%d targets %s, %d deactivated, %d with a new trigger date' % (
+    int((now & ~was).sum()), 'activated' if apply else 'would be activated', int((was & ~now).sum()), int((was == now).sum())))
+  print('Only targets already in tides_master are updated, objects that now pass for the first time are not added')
+  if not apply:
+    print('Nothing changed, run with --apply=True to update tides_master')
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,3 @@
+UPDATE tides_targets tt SET is_active=tm.active, dirty=True, version=tt.version + 1, changed=CURRENT_TIMESTAMP
+FROM tides_master tm
+WHERE tm.tides_id = tt.tides_id AND tt.tides_id = ANY(:rescored) AND tt.is_active IS DISTINCT FROM tm.active;
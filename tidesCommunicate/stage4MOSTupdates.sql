@@ -1 +1,5 @@
-SELECT * from tides_master where tides_master.name in (select name from tides_stage) or tides_master.tides_id in (select tides_id from to_deactivate);
\ No newline at end of file
+SELECT tt.tides_id, tt.name, tt.ra, tt.dec, tt.mag, tt.date_earliest, tt.date_latest, tt.is_active,
+       tt.priority, tt.version, tt.create_unsure, tm.pk_4most, tm.payload_hash
+FROM tides_targets tt JOIN tides_master tm ON tm.tides_id = tt.tides_id
+WHERE tt.dirty
+ORDER BY tt.priority DESC NULLS LAST, tt.tides_id;
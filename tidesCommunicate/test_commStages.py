@@ -0,0 +1,157 @@
+'''
+Checks of the flow stages in commStages: reading alerts through the
+fakeKafka consumer offline, and, against the Postgres in TIDES_TEST_DB, the
+SQL rescore of the stored detection summaries and the 4MOST bookkeeping in
+tides_targets.
+'''
+
+import os
+import types
+import uuid
+
+import numpy as np
+import pandas as pd
+import pytest
+import sqlalchemy
+import yaml
+
+import commStages
+import fakeSubmitTransients
+import lightcurveSelection as lcs
+from detectionSummary import summariseChunk
+from fakeKafka import FakeConsumer
+from fourMostSubmit import submitTransients
+from lightcurveChunk import LightcurveChunk
+from syntheticLightcurves import makeAlerts, makeResponses
+
+SELECTION_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tidesTargeting',
+                              'tidesSelectionFunctions.yml')
+
+
+@pytest.fixture(scope='module')
+def responses():
+  resp = makeResponses(300, 20, seed=9)
+  rng = np.random.default_rng(4)
+  for r in resp.values():
+    for c in (r['candidates'] if len(r) != 0 else []):
+      if c.get('sigmapsf') is not None and rng.random() < 0.05:
+        c['sigmapsf'] = 0.0
+  return resp
+
+
+def test_consumeKeepsLatestAlert(responses):
+  alerts = makeAlerts(responses, alertsPerObject=3, seed=1)
+  consumer = FakeConsumer(alerts)
+  buffer = commStages.consumeAlerts(consumer, consumeSize=7, pollTimeout=0)
+  assert buffer.nAlerts == len(alerts) and consumer.position == len(alerts)
+  latest = buffer.toDataFrame()
+  expected = pd.DataFrame(alerts).groupby('objectId')['jdmax'].max()
+  assert len(latest) == len(expected) == latest['objectId'].nunique()
+  assert (latest.set_index('objectId')['jdmax'] == expected.reindex(latest['objectId'])).all()
+  assert latest['jdmax'].is_monotonic_decreasing
+  assert latest['trace_received'].notna().all()
+
+
+def test_consumeStopsAtMaxAlerts(responses):
+  alerts = makeAlerts(responses, seed=2)
+  consumer = FakeConsumer(alerts)
+  buffer = commStages.consumeAlerts(consumer, maxAlerts=25, consumeSize=10, pollTimeout=0)
+  assert buffer.nAlerts == 25 and consumer.position == 25
+
+
+def test_consumeByPoll(responses):
+  ## A consumer without the batched consume() is read one poll() at a time
+  alerts = makeAlerts(responses, seed=3)[:40]
+  consumer = FakeConsumer(alerts)
+  buffer = commStages.consumeAlerts(types.SimpleNamespace(poll=consumer.poll), pollTimeout=0)
+  assert buffer.nAlerts == 40 and len(buffer) == len({x['objectId'] for x in alerts})
+
+
+def test_alertsWithoutJdmax():
+  buffer = commStages.AlertBuffer()
+  buffer.add({'objectId': 'a', 'ramean': 1.0}, received=1.0)
+  buffer.add({'objectId': 'a', 'ramean': 2.0}, received=2.0)
+  buffer.add({'objectId': 'a', 'ramean': 3.0, 'jdmax': 2460000.5}, received=3.0)
+  buffer.add({'objectId': 'b', 'ramean': 4.0}, received=4.0)
+  assert buffer.nAlerts == 4 and len(buffer) == 2
+  assert buffer.columns['ramean'] == [3.0, 4.0] and buffer.received == [3.0, 4.0]
+
+
+@pytest.fixture
+def engine():
+  '''An engine on a scratch schema of the TIDES_TEST_DB database, dropped afterwards.'''
+  url = os.environ.get('TIDES_TEST_DB')
+  if not url:
+    pytest.skip('TIDES_TEST_DB is not set')
+  schema = 'tides_test_' + uuid.uuid4().hex[:8]
+  engine = sqlalchemy.create_engine(url, connect_args={'options': '-c search_path=' + schema})
+  with engine.begin() as conn:
+    conn.execute(sqlalchemy.text('CREATE SCHEMA ' + schema))
+  yield engine
+  with engine.begin() as conn:
+    conn.execute(sqlalchemy.text('DROP SCHEMA ' + schema + ' CASCADE'))
+  engine.dispose()
+
+
+def chunkOf(responses, cut=np.inf):
+  names = list(responses)
+  c = []
+  for name in names:
+    rows = [x for x in responses[name]['candidates'] if x['jd'] <= cut] if len(responses[name]) != 0 else []
+    c.append({'candidates': rows} if rows else [])
+  return LightcurveChunk.fromResponses(names, c)
+
+
+def test_rescoreMatchesSelection(engine, responses):
+  chunk = chunkOf(responses)
+  ## Saved once part way through the light curves, then replaced by the whole ones
+  jds = chunk.columns['jd']
+  commStages.saveDetections(engine, summariseChunk(chunkOf(responses, np.median(jds))))
+  commStages.saveDetections(engine, summariseChunk(chunk))
+
+  criteria = lcs.selectionFunctions(yaml.safe_load(open(SELECTION_FILE)))
+  criteria['rOnlyBright'] = dict(criteria['tidesSNZTFSelect'], filters=['r'], minBands=1, magLimit=19.0)
+  criteria['loose'] = dict(criteria['tidesSNZTFSelect'], significance=3, minBands=1, minNights=1)
+  names, passes, triggers = lcs.evaluateCriteriaSet(criteria, chunk)
+  passes &= chunk.hasData[:, None]
+  for j, name in enumerate(names):
+    with engine.connect() as conn:
+      rescored = commStages.rescoreDetections(conn, criteria[name])
+    expected = {x: t for x, p, t in zip(chunk.objectIds, passes[:, j], triggers[:, j]) if p}
+    assert len(expected) > 0, name
+    assert dict(zip(rescored['name'], rescored['triggerjd'])) == expected, name
+
+
+def test_unsureCreatesKeptUntilResolved(engine):
+  fakeSubmitTransients.reset()
+  with engine.begin() as conn:
+    conn.execute(sqlalchemy.text(commStages.readSQL('createMasterTable.sql')))
+    conn.execute(sqlalchemy.text("INSERT INTO tides_master (name, ra, dec, jdmax, rmag, gmag, active) "
+                                 "SELECT 'ZTF' || i, i, -i, 2460000.5 + i, 19 + i/10.0, 19.5, TRUE "
+                                 "FROM generate_series(1, 6) i"))
+    conn.execute(sqlalchemy.text(commStages.readSQL('createTargetListTable.sql')))
+
+  def run(lostReplyRate):
+    fakeSubmitTransients.LOST_REPLY_RATE = lostReplyRate
+    try:
+      with engine.begin() as conn:
+        toUpdate = commStages.prepare4MOSTUpdate(conn)
+        failed, unsure = [], []
+        sent, counts = submitTransients(fakeSubmitTransients, toUpdate, backoff=0.0, failed=failed, unsure=unsure)
+        if len(sent) > 0:
+          commStages.updateTiDESMasterwith4MOSTKey(sent, conn)
+        commStages.markTargetsSent(conn, toUpdate, failed, unsure)
+      return counts
+    finally:
+      fakeSubmitTransients.LOST_REPLY_RATE = 0.0
+
+  assert run(1.0)['unsure'] == 6
+  with engine.connect() as conn:
+    assert conn.execute(sqlalchemy.text('SELECT count(*) FROM tides_targets WHERE dirty AND create_unsure')).scalar() == 6
+  assert run(0.0)['recovered'] == 6
+  with engine.connect() as conn:
+    assert conn.execute(sqlalchemy.text('SELECT count(*) FROM tides_targets WHERE dirty OR create_unsure')).scalar() == 0
+    keys = conn.execute(sqlalchemy.text('SELECT name, pk_4most FROM tides_master')).all()
+  assert dict(keys) == {x['name']: pk for pk, x in fakeSubmitTransients.transients.items()}
+  assert fakeSubmitTransients.calls['create'] == 6
+  fakeSubmitTransients.reset()
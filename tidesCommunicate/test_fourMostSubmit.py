@@ -0,0 +1,138 @@
+'''
+Offline checks of the 4MOST submission paths in fourMostSubmit, against the
+fakeSubmitTransients stand-in.
+'''
+
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import fakeSubmitTransients
+import fourMostSubmit
+from fourMostSubmit import submitTransients
+
+
+@pytest.fixture(autouse=True)
+def fake():
+  fakeSubmitTransients.reset()
+  fakeSubmitTransients.FAILURE_RATE = fakeSubmitTransients.LOST_REPLY_RATE = 0.0
+  yield fakeSubmitTransients
+  fakeSubmitTransients.reset()
+  fakeSubmitTransients.FAILURE_RATE = fakeSubmitTransients.LOST_REPLY_RATE = 0.0
+
+
+def targets(n=3, pk=None, unsure=False):
+  '''Rows of stage4MOSTupdates.sql for n targets.'''
+  return pd.DataFrame({
+    'tides_id': np.arange(1, n + 1), 'name': ['ZTF00test%03d' % i for i in range(n)],
+    'ra': 10.0, 'dec': -20.0, 'mag': 19.0, 'date_earliest': 2460000.5, 'date_latest': 2460004.5,
+    'is_active': True, 'priority': 1.5, 'version': 1, 'create_unsure': unsure,
+    'pk_4most': np.nan if pk is None else pk, 'payload_hash': None,
+  })
+
+
+def flaky(call, error, times=1):
+  '''call, raising error on its first times calls.'''
+  left = [times]
+  def wrapped(*args, **kwargs):
+    if left[0] > 0:
+      left[0] -= 1
+      raise error
+    return call(*args, **kwargs)
+  return wrapped
+
+
+def submit(st, table, **kwargs):
+  failed, unsure = [], []
+  sent, counts = submitTransients(st, table, backoff=0.0, failed=failed, unsure=unsure, **kwargs)
+  return sent, counts, failed, unsure
+
+
+def test_createsAndUpdates(fake):
+  sent, counts, failed, unsure = submit(fake, targets())
+  assert counts['created'] == 3 and failed == [] and unsure == []
+  assert list(sent.columns) == fourMostSubmit.SENT_COLUMNS
+  again = targets(pk=sent['pk_4most'].to_numpy())
+  again['mag'] = 18.5
+  sent2, counts, failed, unsure = submit(fake, again)
+  assert counts['updated'] == 3 and fake.calls['create'] == 3
+  assert sorted(sent2['pk_4most']) == sorted(sent['pk_4most'])
+
+
+def test_unchangedPayloadNotSent(fake):
+  sent, counts, _, _ = submit(fake, targets())
+  again = targets(pk=sent['pk_4most'].to_numpy())
+  again['payload_hash'] = sent['payload_hash'].to_numpy()
+  sent, counts, _, _ = submit(fake, again)
+  assert counts['unchanged'] == 3 and len(sent) == 0 and fake.calls['update'] == 0
+
+
+def test_updateRetried(fake):
+  sent, _, _, _ = submit(fake, targets(1))
+  st = types.SimpleNamespace(create_transient=fake.create_transient,
+                             update_transient=flaky(fake.update_transient, fake.FakeAPIError('down'), times=2))
+  again = targets(1, pk=sent['pk_4most'].to_numpy())
+  again['mag'] = 18.0
+  sent, counts, failed, unsure = submit(st, again, retries=3)
+  assert counts['updated'] == 1 and failed == [] and fake.calls['update'] == 1
+
+
+def test_createRetriedWhenNeverSent(fake):
+  st = types.SimpleNamespace(create_transient=flaky(fake.create_transient, ConnectionRefusedError(), times=2),
+                             update_transient=fake.update_transient)
+  sent, counts, failed, unsure = submit(st, targets(1), retries=3)
+  assert counts['created'] == 1 and failed == [] and unsure == []
+  assert len(fake.transients) == 1
+
+
+def test_createNotRetriedOnceSent(fake):
+  fake.LOST_REPLY_RATE = 1.0
+  sent, counts, failed, unsure = submit(fake, targets(2), retries=3)
+  assert len(sent) == 0 and counts['unsure'] == 2
+  assert sorted(failed) == sorted(unsure) == [1, 2]
+  ## One call each: a retry would have made a second transient
+  assert fake.calls['create'] == 2 and len(fake.transients) == 2
+
+
+def test_unsureCreateRecovered(fake):
+  fake.LOST_REPLY_RATE = 1.0
+  _, _, _, unsure = submit(fake, targets(2))
+  fake.LOST_REPLY_RATE = 0.0
+  table = targets(2, unsure=True)
+  sent, counts, failed, unsure = submit(fake, table)
+  assert counts['recovered'] == 2 and failed == [] and unsure == []
+  assert fake.calls['create'] == 2 and len(fake.transients) == 2
+  made = {data['name']: pk for pk, data in fake.transients.items()}
+  assert dict(zip(table['name'], sent.sort_values('tides_id')['pk_4most'])) == made
+
+
+def test_unsureCreateNotFoundIsCreated(fake):
+  sent, counts, failed, unsure = submit(fake, targets(1, unsure=True))
+  assert counts['created'] == 1 and fake.calls['find'] == 1 and len(fake.transients) == 1
+
+
+def test_unsureHeldWithoutLookup(fake):
+  st = types.SimpleNamespace(create_transient=fake.create_transient, update_transient=fake.update_transient)
+  sent, counts, failed, unsure = submit(st, targets(2, unsure=True))
+  assert len(sent) == 0 and sorted(unsure) == [1, 2] and sorted(failed) == [1, 2]
+  assert fake.calls['create'] == 0
+
+
+def test_notSent():
+  class NewConnectionError(Exception):
+    pass
+  class ConnectionError(Exception):
+    pass
+  try:
+    try:
+      raise NewConnectionError('refused')
+    except Exception as e:
+      raise ConnectionError(e)
+  except Exception as e:
+    wrapped = e
+  assert fourMostSubmit._notSent(wrapped)
+  assert fourMostSubmit._notSent(ConnectionRefusedError())
+  assert not fourMostSubmit._notSent(TimeoutError('read timed out'))
+  assert not fourMostSubmit._notSent(fakeSubmitTransients.FakeTimeout('lost'))
@@ -0,0 +1,10 @@
+-- Seconds between the trace times of every target staged this run, NULL where a time is missing
+SELECT tm.tides_id, tm.name,
+       extract(epoch FROM tm.trace_fetched - tm.trace_received) AS alert_to_fetch,
+       extract(epoch FROM tm.trace_selected - tm.trace_fetched) AS fetch_to_selection,
+       extract(epoch FROM tm.trace_upserted - tm.trace_selected) AS selection_to_master,
+       extract(epoch FROM tm.trace_acked - tm.trace_upserted) AS master_to_4most,
+       extract(epoch FROM tm.trace_upserted - tm.trace_received) AS alert_to_master,
+       extract(epoch FROM tm.trace_acked - tm.trace_received) AS alert_to_4most
+FROM tides_master tm
+JOIN tides_stage ts ON ts.name = tm.name;
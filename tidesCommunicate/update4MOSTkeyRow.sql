@@ -0,0 +1 @@
+UPDATE tides_master SET pk_4most = :pk_4most, payload_hash = :payload_hash, trace_acked = to_timestamp(:trace_acked) WHERE tides_id = :tides_id;
\ No newline at end of file
@@ -1 +1 @@
-UPDATE tides_master SET pk_4most = latest_4most.pk_4most FROM latest_4most WHERE latest_4most.tides_id=tides_master.tides_id;
\ No newline at end of file
+UPDATE tides_master SET pk_4most = latest_4most.pk_4most, payload_hash = latest_4most.payload_hash, trace_acked = to_timestamp(latest_4most.trace_acked) FROM latest_4most WHERE latest_4most.tides_id=tides_master.tides_id;
\ No newline at end of file
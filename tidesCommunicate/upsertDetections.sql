@@ -0,0 +1,4 @@
+DELETE FROM tides_detections WHERE name = ANY(:names);
+INSERT INTO tides_detections (name, fid, nid, jd, magpsf, sig)
+SELECT name, fid, nid, jd, magpsf, sig
+FROM tides_detections_stage;
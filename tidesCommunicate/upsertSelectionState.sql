@@ -0,0 +1,12 @@
+INSERT INTO tides_selection_state (name, selection, bands, nnights, lastnid, minmag, lastjd, passed, triggerjd, updated)
+SELECT name, :selection, bands, nnights, lastnid, minmag, lastjd, passed, triggerjd, CURRENT_TIMESTAMP
+FROM tides_selection_state_stage
+ON CONFLICT (name, selection) DO UPDATE SET
+bands = EXCLUDED.bands,
+nnights = EXCLUDED.nnights,
+lastnid = EXCLUDED.lastnid,
+minmag = EXCLUDED.minmag,
+lastjd = EXCLUDED.lastjd,
+passed = EXCLUDED.passed,
+triggerjd = EXCLUDED.triggerjd,
+updated = CURRENT_TIMESTAMP;
@@ -0,0 +1,20 @@
+INSERT INTO tides_targets (tides_id, name, ra, dec, mag, date_earliest, date_latest, is_active, priority, dirty, version, changed)
+SELECT tm.tides_id, tm.name, tm.ra, tm.dec, tm.rmag, tm.jdmax, tm.jdmax + 4, tm.active, 20.5 - tm.rmag, True, 1, CURRENT_TIMESTAMP
+FROM tides_master tm JOIN tides_stage ts ON ts.name = tm.name
+ON CONFLICT (tides_id) DO UPDATE SET
+name = EXCLUDED.name,
+ra = EXCLUDED.ra,
+dec = EXCLUDED.dec,
+mag = EXCLUDED.mag,
+date_earliest = EXCLUDED.date_earliest,
+date_latest = EXCLUDED.date_latest,
+is_active = EXCLUDED.is_active,
+priority = EXCLUDED.priority,
+dirty = True,
+version = tides_targets.version + 1,
+changed = CURRENT_TIMESTAMP
+WHERE (tides_targets.name, tides_targets.ra, tides_targets.dec, tides_targets.mag,
+       tides_targets.date_earliest, tides_targets.date_latest, tides_targets.is_active)
+      IS DISTINCT FROM
+      (EXCLUDED.name, EXCLUDED.ra, EXCLUDED.dec, EXCLUDED.mag,
+       EXCLUDED.date_earliest, EXCLUDED.date_latest, EXCLUDED.is_active);
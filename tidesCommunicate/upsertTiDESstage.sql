@@ -12,9 +12,17 @@ jdgmax = ts.jdgmax,
 jdrmax = ts.jdrmax,
 ncandgp = ts.ncandgp,
 sherlock_class = ts.classification,
+triggerjd = ts.triggerjd,
 active = True,
-updated = CURRENT_TIMESTAMP
+updated = CURRENT_TIMESTAMP,
+trace_received = to_timestamp(ts.trace_received),
+trace_fetched = to_timestamp(ts.trace_fetched),
+trace_selected = to_timestamp(ts.trace_selected),
+trace_upserted = clock_timestamp(),
+trace_acked = NULL
 WHEN NOT MATCHED THEN
-INSERT (name, ra, dec, jdmin, jdmax, magrmin, maggmin, rmag, gmag, jdgmax, jdrmax, ncandgp, sherlock_class, active, created, updated )
+INSERT (name, ra, dec, jdmin, jdmax, magrmin, maggmin, rmag, gmag, jdgmax, jdrmax, ncandgp, sherlock_class, triggerjd, active, created, updated,
+ trace_received, trace_fetched, trace_selected, trace_upserted )
 VALUES (ts.name, ts.ramean, ts.decmean, ts.jdmin, ts.jdmax, ts.magrmin, ts.maggmin, ts.rmag, ts.gmag,
- ts.jdgmax, ts.jdrmax, ts.ncandgp, ts.classification, True, CURRENT_TIMESTAMP,CURRENT_TIMESTAMP );   
\ No newline at end of file
+ ts.jdgmax, ts.jdrmax, ts.ncandgp, ts.classification, ts.triggerjd, True, CURRENT_TIMESTAMP,CURRENT_TIMESTAMP,
+ to_timestamp(ts.trace_received), to_timestamp(ts.trace_fetched), to_timestamp(ts.trace_selected), clock_timestamp() );   
\ No newline at end of file
@@ -0,0 +1,64 @@
+'''
+The TiDES targeting library: light curve selection, fetching, caching and
+plotting, as used by checkObjects.py and the communication flow.
+
+    from tidesTargeting import LightcurveChunk, fetchChunks, satisfyBatch
+
+Importing the package has one side effect: this directory is put at the
+front of sys.path. The modules import each other by their plain names, as they
+do when checkObjects.py is run from this directory, so they are loaded as
+top-level modules (lightcurveChunk, lasairFetch, ...), and a module of the same
+name elsewhere on the path is shadowed. Take names from the package rather than
+importing the modules as tidesTargeting.<module>, which would load a second
+copy of them. The modules themselves are not imported until a name is first
+used, and matplotlib only when a plot is drawn.
+'''
+
+import importlib
+import os
+import sys
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+if _HERE not in sys.path:
+    sys.path.insert(0, _HERE)
+
+# Public name -> module it lives in
+_EXPORTS = {
+    'LightcurveChunk': 'lightcurveChunk',
+    'Lightcurve': 'lightcurveChunk',
+    'satisfyBatch': 'lightcurveSelection',
+    'triggerBatch': 'lightcurveSelection',
+    'evaluateCriteriaSet': 'lightcurveSelection',
+    'selectionFunctions': 'lightcurveSelection',
+    'lightcurveSatify': 'lightcurveSelection',
+    'lightcurveTriggerDate': 'lightcurveSelection',
+    'NO_TRIGGER': 'lightcurveSelection',
+    'fetchChunks': 'lasairFetch',
+    'LasairFetchError': 'lasairFetch',
+    'RateLimiter': 'lasairFetch',
+    'LightcurveCache': 'lightcurveCache',
+    'CachedLasairClient': 'lightcurveCache',
+    'mayPass': 'alertPrefilter',
+    'foldChunk': 'selectionState',
+    'criteriaKey': 'selectionState',
+    'summariseChunk': 'detectionSummary',
+    'LightcurveArchive': 'lightcurveArchive',
+    'openArchive': 'lightcurveArchive',
+    'PassFailOutput': 'passFailOutput',
+    'readObjectIds': 'passFailOutput',
+    'LightcurvePlotter': 'lightcurvePlot',
+    'plotLightCurve': 'lightcurvePlot',
+    'FakeLasairClient': 'fakeLasair',
+    'Metrics': 'pipelineMetrics',
+    'makeMetrics': 'pipelineMetrics',
+    'NO_METRICS': 'pipelineMetrics',
+    'LatencyTrace': 'pipelineMetrics',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    return getattr(importlib.import_module(_EXPORTS[name]), name)
@@ -0,0 +1,88 @@
+'''
+Reject objects that cannot pass a selection function from their alert alone.
+
+A Lasair alert already summarises the object's light curve: the brightest
+magnitude in each band (maggmin, magrmin), the number of detections and the
+first and last detection dates (jdmin, jdmax). From these we can bound what
+the full evaluation in lightcurveSelection could find, and skip the light
+curve fetch for objects that are sure to fail:
+
+- brightness: no detection in any band is brighter than magLimit
+- bands: fewer than minBands of the requested filters have any detection
+- nights: fewer detections than minNights, or all of them within too short a
+  span of time to fall on minNights nights
+
+Every rule only ever looks at upper bounds (significant detections are a
+subset of all detections, a night needs at least one detection), so an
+object that would pass the full evaluation is never rejected. A rule is
+skipped for objects whose alert lacks the fields it needs.
+
+The brightness and band rules rely on the alert having a minimum magnitude
+field for every band the light curves can contain, `bands`. The public ZTF
+stream only carries g and r. If the light curves can hold other bands, list
+them and those two rules switch themselves off.
+
+Counting uses ncand, the number of detections. ncandgp only counts the good
+positive detections, while the selection also counts negative differences,
+so it cannot bound the number of nights.
+'''
+
+import numpy as np
+
+# Field holding the brightest detection in each band
+BAND_MIN_FIELDS = {'g': 'maggmin', 'r': 'magrmin'}
+# Bands of the public ZTF alert stream
+STREAM_BANDS = ('g', 'r')
+COUNT_FIELD = 'ncand'
+
+
+def _field(alerts, name):
+    '''Column of the alerts as floats, NaN where missing. None if the alerts have no such column.'''
+    if name not in alerts:
+        return None
+    return np.asarray(alerts[name], dtype=np.float64)
+
+
+def mayPass(criteria, alerts, bands=STREAM_BANDS):
+    '''
+    False for every alert (a row of the alerts DataFrame) whose object cannot
+    pass the selection function, True where it might.
+
+    Returns the mask and the number of objects rejected by each rule.
+    An object failing several rules is counted against each of them.
+    '''
+    nAlerts = len(alerts)
+    reasons = {'magLimit': 0, 'minBands': 0, 'minNights': 0}
+    possible = np.ones(nAlerts, dtype=bool)
+    if nAlerts == 0:
+        return possible, reasons
+
+    ## A band's minimum magnitude is null when it has no detections (a Lasair
+    ## filter sends the same columns in every alert). Bands without a summary
+    ## field leave the brightness and band rules unusable.
+    bandMins = {x: _field(alerts, BAND_MIN_FIELDS.get(x, '')) for x in bands}
+    if all(v is not None for v in bandMins.values()):
+        brightest = np.fmin.reduce(np.vstack(list(bandMins.values())), axis=0)
+        tooFaint = ~(brightest <= criteria['magLimit'])
+        nBands = np.zeros(nAlerts, dtype=np.int64)
+        for x, v in bandMins.items():
+            if x in criteria['filters']:
+                nBands += np.isfinite(v)
+        tooFewBands = nBands < criteria['minBands']
+        reasons['magLimit'] = int(tooFaint.sum())
+        reasons['minBands'] = int(tooFewBands.sum())
+        possible &= ~tooFaint & ~tooFewBands
+
+    ## Each night needs a detection, and detections spread over a span of d
+    ## days can fall on at most ceil(d) + 1 nights
+    maxNights = np.full(nAlerts, np.inf)
+    nDetections = _field(alerts, COUNT_FIELD)
+    if nDetections is not None:
+        maxNights = np.fmin(maxNights, nDetections)
+    jdmin, jdmax = _field(alerts, 'jdmin'), _field(alerts, 'jdmax')
+    if jdmin is not None and jdmax is not None:
+        maxNights = np.fmin(maxNights, np.ceil(jdmax - jdmin) + 1)
+    tooFewNights = maxNights < criteria['minNights']
+    reasons['minNights'] = int(tooFewNights.sum())
+    possible &= ~tooFewNights
+    return possible, reasons
@@ -1,16 +1,29 @@
 """Check the ZTF Objects using Lasair
 Usage:
-    checkObjects.py [--input=<PATH>] [--output=<PATH>] [--selection=<PATH>] [--name=<NAME>] [--key=<KEY>] [--chunk=<NUM>] [--plot=<BOOL>]
+    checkObjects.py [--input=<PATH>] [--output=<PATH>] [--selection=<PATH>] [--name=<NAME>] [--key=<KEY>] [--chunk=<NUM>] [--plot=<BOOL>] [--workers=<NUM>] [--rate=<NUM>] [--cache=<PATH>] [--cachesize=<MB>] [--offline=<BOOL>] [--plotpass=<BOOL>] [--plotformat=<EXT>] [--dpi=<NUM>] [--plotworkers=<NUM>] [--metrics=<PATH>] [--promfile=<PATH>] [--archive=<PATH>] [--resume=<BOOL>]
     checkObjects.py -h | --help | --version
 
 Options:
     -i PATH, --input=PATH      The full path to the list containing the ZTF objects.
     -o PATH, --output=PATH     The full path to the output directory.
     -s PATH, --selection=PATH  The full path to the YAML file containing the selection function criteria.
-    -n NAME, --name=NAME       The name of the selection function in the YAML file.
+    -n NAME, --name=NAME       The name of the selection function in the YAML file. Several comma separated names, or all, evaluates them all in one pass.
     -k KEY, --key=KEY          Your Lasair access token key or path to the YAML file containing it.
     -c NUM, --chunk=NUM        The number of objects to query at once. The Lasair API has a max of 50 objects per call. [default: 50]
     -p BOOL, --plot=BOOL       Do you want to save light curve plots in in the output directory? [default: True]
+    -w NUM, --workers=NUM      The number of Lasair requests to keep in flight at once. [default: 4]
+    -r NUM, --rate=NUM         The maximum number of Lasair requests per second, 0 for no limit. [default: 2]
+    --cache=PATH               The full path to a SQLite file used to cache light curves between runs.
+    --cachesize=MB             The maximum size of the light curve cache in MB. [default: 1000]
+    --offline=BOOL             Only use light curves already in the cache, no Lasair requests. [default: False]
+    --plotpass=BOOL            Only save plots of the objects that pass the selection function. [default: False]
+    --plotformat=EXT           The file format of the plots, e.g. png, jpg or pdf. [default: png]
+    --dpi=NUM                  The resolution of the plots. [default: 300]
+    --plotworkers=NUM          The number of processes drawing plots, 0 to draw them in the main process. [default: 2]
+    --metrics=PATH             Write stage timings and counters as JSON lines to this file, - for stdout.
+    --promfile=PATH            Write stage timings and counters to this Prometheus textfile at the end of the run.
+    --archive=PATH             Append the light curves and results to the Parquet archive in this directory.
+    --resume=BOOL              Carry on from the checkpoint left in the output directory by an earlier run, skipping the objects it finished. [default: False]
     -h --help                  Show this screen
     --version                  Show version
 
@@ -21,217 +34,249 @@ Options:
 """
 
 from docopt import docopt
-import matplotlib
-matplotlib.use('Agg')
-import lasair
 import numpy as np
-import pandas as pd
-import json
 import yaml
 import os, sys
 from pathlib import Path
-import matplotlib.pyplot as plt
-import pprint
-
-args = docopt(__doc__, version="Lasair Check Objects v0.1") ## Using the docopt method of parsing args
-
-input = args['--input']
-output = args['--output']
-key = args['--key']
-plot = args['--plot']
-selection = args['--selection']
-name = args['--name']
-try:
-    chunk = int(args['--chunk'])
-except ValueError as ve:
-    print('The chunk must be an integer')
-    sys.exit(1)
-
-if None in [input, output, key, selection, name]:
-    message = """
-    You must input at least:
-    --input=<PATH>
-    --output=<PATH>
-    --key=<KEY>
-    --selection=<PATH>
-    --name=<NAME>
-    """
-    print(message)
-    print(__doc__)
-    sys.exit(1)
-
-Path(output).mkdir(parents=True, exist_ok=True)
-
-## Here we check if the user added a YAML file containing their password
-## or if they added the key straight into the commandline
-apiInput = key
-if os.path.isfile(apiInput):
-    keyOpen = yaml.load(open(apiInput), Loader=yaml.SafeLoader)
-    token = keyOpen['lasair']['token']
-else:
-    token = str(apiInput)
-
-
-if plot in ['True', 't', 'T', True]:
-    makePlot = True
-    print('Plots will be saved in: ', str(output))
-elif plot in ['False', 'f', 'F', False]:
-    makePlot=False
-    print('No plots will be made.')
-else:
-    print("I don't understand the plot argument. Please provide a True/False input")
-    sys.exit(0)
-
-##Open Input YAML File
-inputCriteriaPath = selection
-inputCriteriaOpen = yaml.load(open(inputCriteriaPath), Loader=yaml.SafeLoader)
-inputCriteriaName = inputCriteriaOpen[str(name)]
-
-print('These are your filter criteria: ', inputCriteriaName)
-
-print('Chunk Size:', chunk)
-
-
-
-##Open the test file for the ZTF Objects
-sn = pd.read_csv(str(input),header=None, names=['ztfname'])
-numZTFtest = len(sn['ztfname'])
-
-
-def splitIntoChunks(inLst, n):
-    """The Lasair API can only handle 50 light curves a time.
-    This function will split the list up into chunks of n objects. 
-    """
-    for i in range(0, len(inLst), n):
-        yield inLst[i:i + n]
-
-print('You have requested light curves for '+str(numZTFtest)+' objects from ZTF')
-ztfNames = np.unique(sn['ztfname'])
-#print(ztfNames)
-
-#I've hardcoded 50 into the chunksize to comply with the LAsair API query. 
-chunSize = chunk
-if chunk>50:
-    print('Max chunk size is 50.')
-    print('')
-    chunSize=50
-ztfNameChunks = list(splitIntoChunks(ztfNames, chunSize))
-
-print('Number of Chunks: ', len(ztfNameChunks))
-
-# This is hardcoded for ZTF, will need to be changed for LSST as more filters are added.
-filterDict = {1:'g', 2:'r', 3:'i', 'g':1, 'r':2, 'i':3}
-
-##Lasair Acess Token
-L = lasair.lasair_client(token)
-
-#print(c)
-
-
-def lightcurveSatify(criteria,lightcurve):
+from lightcurveSelection import satisfyBatch, triggerBatch, evaluateCriteriaSet, selectionFunctions, NO_TRIGGER
+from lightcurveChunk import LightcurveChunk
+from lasairFetch import fetchChunks
+from lightcurveCache import LightcurveCache, CachedLasairClient
+from lightcurvePlot import LightcurvePlotter
+from pipelineMetrics import makeMetrics, NO_METRICS
+from passFailOutput import PassFailOutput, readObjectIds, splitIntoChunks
+
+
+def checkChunks(L, ztfNameChunks, criteriaSet, workers=4, rate=2, plotter=None, plotPassOnly=False, output='', metrics=NO_METRICS,
+                archive=None):
+    '''
+    Fetch and evaluate chunks of objects against one or more selection functions
+    (a dict of name -> criteria), plotting with plotter if one is given.
+    ztfNameChunks can be any iterable of chunks, it is read lazily.
+
+    Generator over (index, names, passFail, trigD, passMatrix, triggerMatrix)
+    per chunk, in the order the chunks arrive: the pass/fail ('No Data' for
+    objects Lasair has nothing for) and trigger date of the first selection
+    function, and the pass and trigger date matrices of all of them (objects x
+    functions) when there is more than one, else None.
     '''
-    Our paper states that the tides slection criteria is as follows:
-    - only consider griz
-    - must have at least 3 5sigma detections
-    - Must have 5sigma detections across 2 nights
-    - Must reach brighter than 22.5mag
+    criteria = next(iter(criteriaSet.values()))
+    for z, ztfLoopIn, c in fetchChunks(L, ztfNameChunks, workers=workers, rate=rate, metrics=metrics):
+        passFail = []
+        trigD = []
+        with metrics.timer('selection', objects=len(ztfLoopIn)):
+            ##Does the whole chunk Pass/Fail our cuts, evaluated in one pass
+            lcChunk = LightcurveChunk.fromResponses(ztfLoopIn, c)
+            hasData = lcChunk.hasData
+            if len(criteriaSet) > 1:
+                ## Every selection function in one pass, sharing the significant detections
+                _, passMatrix, triggerMatrix = evaluateCriteriaSet(criteriaSet, lcChunk)
+                chunkPF, chunkTrigger = passMatrix[:, 0], triggerMatrix[:, 0]
+            else:
+                passMatrix = triggerMatrix = None
+                chunkPF = satisfyBatch(criteria, lcChunk)
+                ## and _when_ did each object pass, in one time-ordered pass over the chunk
+                chunkTrigger = triggerBatch(criteria, lcChunk)
+        if archive is not None:
+            with metrics.timer('archive'):
+                if len(criteriaSet) > 1:
+                    archive.write(lcChunk, list(criteriaSet), passMatrix, triggerMatrix)
+                else:
+                    archive.write(lcChunk, list(criteriaSet), chunkPF & hasData, chunkTrigger)
+        metrics.count('objects', len(ztfLoopIn))
+        metrics.count('no_data', int((~hasData).sum()))
+        metrics.count('passes', int((chunkPF & hasData).sum()))
+        for i in range(len(c)): #Change the range to len(c)
+            ztfN = ztfLoopIn[i]        
+            print(ztfN)
+            if not hasData[i]:
+                passFail.append('No Data')
+                trigD.append(NO_TRIGGER)
+                continue
+            wholePF = bool(chunkPF[i])
+            passFail.append(wholePF)
+            dateItPasses = chunkTrigger[i]
+            if plotter is not None and (wholePF or not plotPassOnly):
+                with metrics.timer('plot_submit'):
+                    plotter.submit(ztfN, lcChunk[i], dateItPasses, output)
+            trigD.append(dateItPasses)
+        yield z, ztfLoopIn, passFail, trigD, passMatrix, triggerMatrix
+
+
+def checkObjects(L, ztfNameChunks, criteriaSet, workers=4, rate=2, plotter=None, plotPassOnly=False, output='', metrics=NO_METRICS,
+                 archive=None):
+    '''
+    checkChunks over a list of chunks, with the results put back together.
+
+    Returns, in the order of the objects, the pass/fail ('No Data' for objects
+    Lasair has nothing for) and trigger date of the first selection function,
+    and the pass and trigger date matrices of all of them (objects x functions)
+    when there is more than one, else None.
     '''
-    needFilters = criteria['filters']
-    needSignificance = criteria['significance']
-    minBands = criteria['minBands']
-    minNights = criteria['minNights']
-    magLimit = criteria['magLimit']
-    
-    filtersBool = np.array([filterDict[x] in inputCriteriaName['filters'] for x in lightcurve['fid']])
-    significanceBool = 1.09/lightcurve['sigmapsf'] >= needSignificance
-    
-    sigAndFilterBool = filtersBool & significanceBool
-    
-    meetMinBands = len(np.unique(lightcurve['fid'][sigAndFilterBool])) >= minBands
-    
-    meetMinNight = len(np.unique(lightcurve['nid'][sigAndFilterBool])) >= minNights
-    
-    meetMagLimit = min(lightcurve['magpsf']) <= magLimit
-    
-    if meetMinBands == meetMinNight == meetMagLimit == True:
-        return True
+    ## Results are stored by chunk index as chunks can arrive out of order
+    results = [None]*len(ztfNameChunks)
+    for z, _, passFail, trigD, passMatrix, triggerMatrix in checkChunks(
+            L, ztfNameChunks, criteriaSet, workers=workers, rate=rate, plotter=plotter, plotPassOnly=plotPassOnly,
+            output=output, metrics=metrics, archive=archive):
+        results[z] = (passFail, trigD, passMatrix, triggerMatrix)
+
+    passFail = [x for chunk in results for x in chunk[0]]
+    trigD = [x for chunk in results for x in chunk[1]]
+    if len(criteriaSet) > 1:
+        return passFail, trigD, np.concatenate([x[2] for x in results]), np.concatenate([x[3] for x in results])
+    return passFail, trigD, None, None
+
+
+def main():
+    args = docopt(__doc__, version="Lasair Check Objects v0.1") ## Using the docopt method of parsing args
+
+    input = args['--input']
+    output = args['--output']
+    key = args['--key']
+    plot = args['--plot']
+    selection = args['--selection']
+    name = args['--name']
+    cache = args['--cache']
+    offline = args['--offline'] in ['True', 't', 'T', True]
+    resume = args['--resume'] in ['True', 't', 'T', True]
+    plotPassOnly = args['--plotpass'] in ['True', 't', 'T', True]
+    plotFormat = args['--plotformat']
+    metrics = makeMetrics('tides_check', jsonLog=args['--metrics'], textfile=args['--promfile'])
+    try:
+        chunk = int(args['--chunk'])
+    except ValueError as ve:
+        print('The chunk must be an integer')
+        sys.exit(1)
+    try:
+        workers = int(args['--workers'])
+        rate = float(args['--rate'])
+        cacheSize = float(args['--cachesize'])
+        plotDPI = int(args['--dpi'])
+        plotWorkers = int(args['--plotworkers'])
+    except ValueError as ve:
+        print('The workers, dpi and plot workers must be integers, the rate and cache size numbers')
+        sys.exit(1)
+
+    if offline and cache is None:
+        print('Offline mode needs a light curve cache, please provide --cache=<PATH>')
+        sys.exit(1)
+
+    if None in [input, output, key, selection, name]:
+        message = """
+        You must input at least:
+        --input=<PATH>
+        --output=<PATH>
+        --key=<KEY>
+        --selection=<PATH>
+        --name=<NAME>
+        """
+        print(message)
+        print(__doc__)
+        sys.exit(1)
+
+    Path(output).mkdir(parents=True, exist_ok=True)
+
+    ## Here we check if the user added a YAML file containing their password
+    ## or if they added the key straight into the commandline
+    apiInput = key
+    if os.path.isfile(apiInput):
+        keyOpen = yaml.load(open(apiInput), Loader=yaml.SafeLoader)
+        token = keyOpen['lasair']['token']
+    else:
+        token = str(apiInput)
+
+
+    if plot in ['True', 't', 'T', True]:
+        makePlot = True
+        print('Plots will be saved in: ', str(output))
+    elif plot in ['False', 'f', 'F', False]:
+        makePlot=False
+        print('No plots will be made.')
+    else:
+        print("I don't understand the plot argument. Please provide a True/False input")
+        sys.exit(0)
+
+    ##Open Input YAML File
+    inputCriteriaPath = selection
+    inputCriteriaOpen = yaml.load(open(inputCriteriaPath), Loader=yaml.SafeLoader)
+    if str(name) == 'all':
+        criteriaNames = list(selectionFunctions(inputCriteriaOpen))
     else:
-        return False
-
-def plotLightCurve(name, lc, triggerDate=None, saveName=None):
-    gIDX = lc['fid']==1
-    rIDX = lc['fid']==2
-    iIDX = lc['fid']==3
-    nonDets = lc['candid'].isna()
-    sigSatisfy = 1.09/lc['sigmapsf'] >= inputCriteriaName['significance']
-    if 'diffmaglim' in lc.columns:
-        plt.scatter(lc['jd'][nonDets & gIDX], lc['diffmaglim'][nonDets & gIDX], marker='v', color='green', alpha=0.5)
-        plt.scatter(lc['jd'][nonDets & rIDX], lc['diffmaglim'][nonDets & rIDX], marker='v', color='red', alpha=0.5)
-        plt.scatter(lc['jd'][nonDets & iIDX], lc['diffmaglim'][nonDets & iIDX], marker='v', color='yellow', alpha=0.5)
-
-    plt.errorbar(lc['jd'][gIDX & sigSatisfy], lc['magpsf'][gIDX & sigSatisfy], yerr=lc['sigmapsf'][gIDX & sigSatisfy], fmt='o', color='green', label='g')
-    plt.errorbar(lc['jd'][rIDX & sigSatisfy], lc['magpsf'][rIDX & sigSatisfy], yerr=lc['sigmapsf'][rIDX & sigSatisfy], fmt='o', color='red', label='r')
-    plt.errorbar(lc['jd'][iIDX & sigSatisfy], lc['magpsf'][iIDX & sigSatisfy], yerr=lc['sigmapsf'][iIDX & sigSatisfy], fmt='o', color='yellow', label='i')
-
-    if sum(gIDX & ~sigSatisfy & ~nonDets)!=0:
-        plt.errorbar(lc['jd'][gIDX & ~sigSatisfy & ~nonDets], lc['magpsf'][gIDX & ~sigSatisfy & ~nonDets], yerr=lc['sigmapsf'][gIDX & ~sigSatisfy & ~nonDets], color='green', label='g < SNR',
-    marker='x', linestyle='')
-    if sum(rIDX & ~sigSatisfy& ~nonDets)!=0:
-        plt.errorbar(lc['jd'][rIDX & ~sigSatisfy & ~nonDets], lc['magpsf'][rIDX & ~sigSatisfy & ~nonDets], yerr=lc['sigmapsf'][rIDX & ~sigSatisfy & ~nonDets], color='red', label='r < SNR',
-    marker='x', linestyle='')
-    if sum(iIDX & ~sigSatisfy& ~nonDets)!=0:
-        plt.errorbar(lc['jd'][iIDX & ~sigSatisfy & ~nonDets], lc['magpsf'][iIDX & ~sigSatisfy & ~nonDets], yerr=lc['sigmapsf'][iIDX & ~sigSatisfy & ~nonDets], color='yellow', label='i < SNR',
-    marker='x', linestyle='')
-    
-    if triggerDate!=-9999:
-        plt.axvline(triggerDate, ls='--', c='k', label='Trigger Date')
-    plt.gca().invert_yaxis()
-    plt.title(name)
-    plt.legend(loc='upper right')
-    plt.xlabel('JD')
-    plt.ylabel('Mag')
-    
-    if saveName is not None:
-        plt.savefig(saveName, dpi=300, bbox_inches='tight')
-
-totalListPassFail = []
-totalDateTrigger = []
-for z in range(len(ztfNameChunks)):
-    passFail = []
-    trigD = []
-    ztfLoopIn = ztfNameChunks[z]
-    c = L.lightcurves(ztfLoopIn)
-    for i in range(len(c)): #Change the range to len(c)
-        ztfN = ztfLoopIn[i]        
-        print(ztfN)
-        if len(c[i])==0:
-            passFail.append('No Data')
-            trigD.append(-9999)
-            continue
-        lc = pd.json_normalize(c[i]['candidates'])
-                
-
-        nonDets = lc['candid'].isna()
-
-        
-        ##Does the whole object Pass/Fail our cuts
-        wholePF = lightcurveSatify(inputCriteriaName, lc)
-        passFail.append(wholePF)
-        if wholePF == True:
-            ## Now we step through all the detections to test _when_ the object passed
-            datesTest = np.unique(lc['jd'][~nonDets])
-            pf = np.array(list((map(lambda x: lightcurveSatify(inputCriteriaName, lc[lc['jd']<=x]), datesTest))))
-            dateItPasses = min(datesTest[pf])
-        else: 
-            dateItPasses = -9999
-        if makePlot:
-            plotLightCurve(str(ztfN),lc,triggerDate=dateItPasses, saveName=output+str(ztfN)+'.png')
-            #plt.savefig(output+str(ztfN)+'_LightcurveCheck.png', bbox_inches='tight')
-            plt.close()
-        trigD.append(dateItPasses)
-    totalListPassFail.append(passFail)
-    totalDateTrigger.append(trigD)
-
-
-listofObjectsPF = pd.DataFrame(np.column_stack((ztfNames,np.concatenate(totalListPassFail),np.concatenate(totalDateTrigger))), columns=['ZTFName', 'PassCut', 'TriggerDate'])
-listofObjectsPF.to_csv(output+'PassFailCut.csv', index=False)
\ No newline at end of file
+        criteriaNames = str(name).split(',')
+    ## With several selection functions the first one also fills PassFailCut.csv and the plots
+    criteriaSet = {x: inputCriteriaOpen[x] for x in criteriaNames}
+    inputCriteriaName = criteriaSet[criteriaNames[0]]
+    multiCriteria = len(criteriaNames) > 1
+
+    print('These are your filter criteria: ', criteriaSet if multiCriteria else inputCriteriaName)
+
+    print('Chunk Size:', chunk)
+
+
+
+    ## Results are written a chunk at a time, with a checkpoint a restarted run carries on from
+    out = PassFailOutput(output, criteriaNames, resume=resume)
+    skipped = len(out.done)
+
+    ##Open the test file for the ZTF Objects, read as the chunks are fetched
+    ztfNames = readObjectIds(input, skip=out.done)
+
+    #I've hardcoded 50 into the chunksize to comply with the LAsair API query. 
+    chunSize = chunk
+    if chunk>50:
+        print('Max chunk size is 50.')
+        print('')
+        chunSize=50
+    ztfNameChunks = splitIntoChunks(ztfNames, chunSize)
+
+    ##Lasair Acess Token
+    import lasair
+    L = lasair.lasair_client(token)
+    if cache is not None:
+        ## Serve light curves we already have from the local cache
+        L = CachedLasairClient(L, LightcurveCache(cache, maxBytes=cacheSize*1e6), offline=offline)
+        print('Light curve cache:', cache, '(offline)' if offline else '')
+
+    #print(c)
+
+
+    plotter = None
+    if makePlot:
+        ## Plots are rendered on separate processes while we carry on fetching
+        plotter = LightcurvePlotter(inputCriteriaName['significance'], workers=plotWorkers, dpi=plotDPI, fileFormat=plotFormat)
+
+    archive = None
+    if args['--archive'] is not None:
+        ## pyarrow is only needed when archiving
+        from lightcurveArchive import LightcurveArchive
+        archive = LightcurveArchive(args['--archive'], source='checkObjects')
+        print('Archiving light curves and results in', args['--archive'])
+
+    try:
+        for z, names, passFail, trigD, passMatrix, triggerMatrix in checkChunks(
+                L, ztfNameChunks, criteriaSet, workers=workers, rate=rate, plotter=plotter, plotPassOnly=plotPassOnly,
+                output=output, metrics=metrics, archive=archive):
+            with metrics.timer('write'):
+                out.write(z, names, passFail, trigD, passMatrix, triggerMatrix)
+    finally:
+        out.close()
+        if archive is not None:
+            archive.close()
+    if makePlot:
+        with metrics.timer('plot_wait'):
+            plotter.close()
+
+    print('Checked', out.written, 'objects,', skipped, 'already done by an earlier run')
+    print('Pass/fail saved in', output+'PassFailCut.csv')
+    if multiCriteria:
+        ## One pass and one trigger date column per selection function
+        print('Pass/fail of every selection function saved in', output+'PassFailMatrix.csv')
+    if cache is not None:
+        print('Light curve cache hits:', L.cache.hits, 'misses:', L.cache.misses)
+        metrics.count('cache_hits', L.cache.hits)
+        metrics.count('cache_misses', L.cache.misses)
+    metrics.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+'''
+Summaries of light curves that any selection function can be evaluated on.
+
+A selection function asks of a light curve for the JD at which its k-th band
+and k-th night with a detection of at least some significance first appear,
+and the JD of its first detection brighter than some magnitude (see
+lightcurveSelection.triggerGroups). Walking the light curve in time order,
+only a few detections can ever be that first JD, whatever the thresholds:
+
+    in each band and night, a detection more significant than every earlier one
+    in the whole light curve, a detection brighter than every earlier one
+
+summariseChunk keeps just those detections, as rows of
+(name, fid, nid, jd, magpsf, sig) with sig = 1.09/sigmapsf. Stored in
+Postgres (tides_detections), they let a new or edited selection function be
+evaluated over every object ever fetched as one SQL aggregation
+(tidesCommunicate/rescoreDetections.sql), giving the same pass/fail and
+trigger JD as the light curves themselves.
+
+    table = summariseChunk(LightcurveChunk.fromResponses(objectIds, c))
+'''
+
+import numpy as np
+import pandas as pd
+
+from lightcurveSelection import BAND_NAMES
+
+SUMMARY_COLUMNS = ['name', 'fid', 'nid', 'jd', 'magpsf', 'sig']
+
+
+def _records(segment, values):
+    '''
+    True for the rows whose value is higher than that of every earlier row of
+    the same segment. segment must be sorted, and the rows in time order
+    within it. Rows with equal values may both count.
+    '''
+    rank = np.empty(len(values), dtype=np.int64)
+    rank[np.argsort(values, kind='stable')] = np.arange(len(values))
+    ## Every row of a later segment outranks every row of an earlier one
+    key = segment*len(values) + rank
+    best = np.maximum.accumulate(key)
+    return np.concatenate(([True], key[1:] > best[:-1]))[:len(values)]
+
+
+def _segments(*keys):
+    '''Segment number of every row of rows sorted by keys.'''
+    change = np.zeros(len(keys[0]), dtype=bool)
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.cumsum(change)
+
+
+def summariseChunk(chunk):
+    '''
+    The detections of a LightcurveChunk any selection function can depend on,
+    as a DataFrame of SUMMARY_COLUMNS sorted by object and JD. Objects without
+    any such detection have no rows.
+    '''
+    if chunk.nRows == 0:
+        return pd.DataFrame({x: [] for x in SUMMARY_COLUMNS})
+    cols = chunk.columns
+    group = chunk.group
+    jd = cols['jd']
+    fid = cols['fid'].astype(np.int64)
+    nid = cols['nid'].astype(np.int64)
+    magpsf = cols['magpsf']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sig = 1.09/cols['sigmapsf']
+    keep = np.zeros(chunk.nRows, dtype=bool)
+
+    ## Significance records in each band and night, only known bands can count. A
+    ## sigmapsf of 0 is infinitely significant, as it is to satisfyBatch
+    inBand = ~np.isnan(sig) & (fid > 0) & (fid < len(BAND_NAMES))
+    rows = np.flatnonzero(inBand)
+    order = rows[np.lexsort((jd[rows], nid[rows], fid[rows], group[rows]))]
+    keep[order[_records(_segments(group[order], fid[order], nid[order]), sig[order])]] = True
+
+    ## Brightness records over the whole light curve, in any band
+    rows = np.flatnonzero(np.isfinite(magpsf))
+    order = rows[np.lexsort((jd[rows], group[rows]))]
+    keep[order[_records(_segments(group[order]), -magpsf[order])]] = True
+
+    rows = np.flatnonzero(keep)
+    rows = rows[np.lexsort((jd[rows], group[rows]))]
+    return pd.DataFrame({
+        'name': np.asarray(chunk.objectIds, dtype=object)[group[rows]],
+        'fid': fid[rows],
+        'nid': nid[rows],
+        'jd': jd[rows],
+        'magpsf': magpsf[rows],
+        'sig': sig[rows],
+    })
@@ -0,0 +1,55 @@
+'''
+A stand-in for lasair.lasair_client that serves light curves locally.
+
+Useful for running checkObjects.py, the fetch layer or the communication flow
+offline. Light curves come from a dict or a JSON file mapping objectId to the
+response Lasair would give for it ({'objectId':..., 'candidates': [...]}).
+Unknown objects come back empty, like objects Lasair has no data for. Network
+latency and intermittent failures can be simulated to exercise the retries.
+'''
+
+import json
+import random
+import threading
+import time
+
+
+class FakeLasairError(Exception):
+    '''Raised by FakeLasairClient to simulate a failed API call.'''
+
+
+class FakeLasairClient():
+    def __init__(self, lightcurves=None, latency=0.0, failureRate=0.0, seed=None):
+        '''
+        lightcurves: dict of objectId -> Lasair response, or a path to a JSON file of one.
+        latency:     seconds each call takes.
+        failureRate: fraction of calls that raise FakeLasairError.
+        '''
+        if isinstance(lightcurves, str):
+            with open(lightcurves) as f:
+                lightcurves = json.load(f)
+        self.store = dict(lightcurves or {})
+        self.latency = latency
+        self.failureRate = failureRate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def lightcurves(self, objectIds):
+        with self.lock:
+            self.calls += 1
+            fail = self.random.random() < self.failureRate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise FakeLasairError('Simulated Lasair failure')
+        return [self.store.get(objectId, []) for objectId in objectIds]
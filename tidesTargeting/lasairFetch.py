@@ -0,0 +1,110 @@
+'''
+Concurrent fetching of Lasair light curves.
+
+The Lasair API only serves 50 light curves per call, so a long object list is
+a long sequence of network round trips. fetchChunks keeps several chunks in
+flight on a small thread pool and hands each one back as soon as it arrives,
+so evaluation (and plotting) overlaps with the next requests. Every call is
+retried with exponential backoff and all workers share one requests-per-second
+budget so we stay inside the Lasair rate limits.
+'''
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from pipelineMetrics import NO_METRICS
+
+
+class LasairFetchError(Exception):
+    '''Raised when a chunk could not be fetched after all retries.'''
+
+
+class RateLimiter():
+    '''
+    Token bucket shared between threads. At most `rate` calls per second on
+    average, with bursts of up to `burst` calls. A rate of None or 0 disables it.
+    '''
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last)*self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                sleepFor = (1 - self.tokens)/self.rate
+            time.sleep(sleepFor)
+
+
+def fetchChunk(client, chunk, limiter=None, retries=3, backoff=1.0, metrics=NO_METRICS):
+    '''
+    L.lightcurves(chunk) with retries. Waits backoff, 2*backoff, 4*backoff...
+    seconds between attempts and raises LasairFetchError once they run out.
+    Every call is timed as the 'lasair' stage of metrics, failures are counted.
+    '''
+    for attempt in range(retries + 1):
+        if limiter is not None:
+            limiter.wait()
+        try:
+            metrics.count('lasair_calls')
+            with metrics.timer('lasair', objects=len(chunk)):
+                c = client.lightcurves(list(chunk))
+            # lasair_client.fetch hands back an error dict when it cannot parse the response
+            if isinstance(c, dict) and 'error' in c:
+                raise LasairFetchError(c['error'])
+            return c
+        except Exception as e:
+            metrics.count('lasair_errors')
+            if attempt == retries:
+                raise LasairFetchError('Failed to fetch %d light curves after %d attempts: %s'
+                                       % (len(chunk), retries + 1, e)) from e
+            print('Lasair fetch failed (%s), retrying in %.1fs' % (e, backoff*2**attempt))
+            time.sleep(backoff*2**attempt)
+
+
+def fetchChunks(client, chunks, workers=4, inFlight=None, rate=None, retries=3, backoff=1.0, metrics=NO_METRICS):
+    '''
+    Generator over (index, chunk, c) where c = client.lightcurves(chunk).
+
+    Up to `workers` requests run at once and at most `inFlight` chunks (default
+    2*workers) are fetched ahead of the consumer, so memory stays bounded when
+    evaluation is slower than the network. Chunks are yielded in the order they
+    arrive, use the index to put results back in input order.
+    '''
+    inFlight = inFlight or 2*workers
+    limiter = RateLimiter(rate)
+    chunks = iter(enumerate(chunks))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+
+        def topUp():
+            while len(pending) < inFlight:
+                try:
+                    idx, chunk = next(chunks)
+                except StopIteration:
+                    return
+                pending[pool.submit(fetchChunk, client, chunk, limiter, retries, backoff, metrics)] = (idx, chunk)
+
+        topUp()
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    idx, chunk = pending.pop(future)
+                    c = future.result()
+                    topUp()
+                    yield idx, chunk, c
+        finally:
+            for future in pending:
+                future.cancel()
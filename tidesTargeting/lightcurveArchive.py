@@ -0,0 +1,157 @@
+'''
+Append-only Parquet archive of fetched light curves and selection results.
+
+Everything the pipeline downloads and decides is kept in two Hive-partitioned
+Parquet datasets under one root, so efficiency studies and reprocessing can
+read them back with column and predicate pushdown rather than asking Lasair
+again:
+
+    root/candidates/night=2026-10-17/<run>-<n>.parquet   one row per candidate
+    root/results/night=2026-10-17/<run>-<n>.parquet      one row per object and selection function
+
+The night is the processing night: the UTC date 12 hours before the time of
+writing, so one night's processing lands in one partition wherever the
+observatory is. Rows are buffered and written out a row group at a time as
+chunks complete, so memory stays flat however long the run. Every run writes
+new files and never touches old ones.
+
+    archive = LightcurveArchive('/data/tides/archive', source='checkObjects')
+    archive.write(lcChunk, ['tidesSNZTFSelect'], passes, triggers)
+    archive.close()
+
+    candidates = openArchive('/data/tides/archive', 'candidates')
+    candidates.to_table(filter=pc.field('night') >= '2026-10-01', columns=['objectId', 'jd', 'magpsf'])
+'''
+
+import datetime
+import os
+import time
+import uuid
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from lightcurveChunk import COLUMN_DTYPES
+
+CANDIDATE_SCHEMA = pa.schema([('objectId', pa.string())] +
+                             [(name, pa.from_numpy_dtype(dtype)) for name, dtype in COLUMN_DTYPES] +
+                             [('processed', pa.float64()), ('source', pa.string())])
+RESULT_SCHEMA = pa.schema([('objectId', pa.string()), ('selection', pa.string()), ('pass', pa.bool_()),
+                           ('triggerjd', pa.float64()), ('ncandidates', pa.int32()),
+                           ('processed', pa.float64()), ('source', pa.string())])
+SCHEMAS = {'candidates': CANDIDATE_SCHEMA, 'results': RESULT_SCHEMA}
+
+
+def processingNight(t=None):
+    '''Partition name of the processing night unix time t (default now) falls in.'''
+    t = time.time() if t is None else t
+    return (datetime.datetime.fromtimestamp(t, datetime.timezone.utc) - datetime.timedelta(hours=12)).date().isoformat()
+
+
+def openArchive(root, kind='results'):
+    '''The candidates or results of an archive as a pyarrow dataset, with night as a partition column.'''
+    return ds.dataset(os.path.join(root, kind), format='parquet', partitioning='hive')
+
+
+class _PartitionWriter():
+    '''Buffers the rows of one dataset and writes them a row group at a time into the current night's file.'''
+    def __init__(self, root, kind, run, rowGroupSize, fileRows):
+        self.root = root
+        self.kind = kind
+        self.run = run
+        self.schema = SCHEMAS[kind]
+        self.rowGroupSize = rowGroupSize
+        self.fileRows = fileRows
+        self.buffer = []
+        self.buffered = 0
+        self.writer = None
+        self.night = None
+        self.fileRowsWritten = 0
+        self.files = 0
+
+    def add(self, batch, night):
+        if night != self.night:
+            self.flush()
+            self._closeFile()
+            self.night = night
+        self.buffer.append(batch)
+        self.buffered += batch.num_rows
+        if self.buffered >= self.rowGroupSize:
+            self.flush()
+
+    def flush(self):
+        if self.buffered == 0:
+            return
+        if self.writer is None:
+            directory = os.path.join(self.root, self.kind, 'night=' + self.night)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, '%s-%d.parquet' % (self.run, self.files))
+            self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+            self.files += 1
+        self.writer.write_table(pa.Table.from_batches(self.buffer, schema=self.schema), row_group_size=self.rowGroupSize)
+        self.fileRowsWritten += self.buffered
+        self.buffer = []
+        self.buffered = 0
+        if self.fileRowsWritten >= self.fileRows:
+            self._closeFile()
+
+    def _closeFile(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            self.fileRowsWritten = 0
+
+    def close(self):
+        self.flush()
+        self._closeFile()
+
+
+class LightcurveArchive():
+    def __init__(self, root, source='', rowGroupSize=100000, fileRows=2000000):
+        '''
+        root:         directory of the archive, created if it does not exist.
+        source:       name of the entry point, stored with every row.
+        rowGroupSize: rows buffered before a row group is written.
+        fileRows:     rows after which a new file is started, so a crash loses little.
+        '''
+        self.root = root
+        self.source = source
+        run = time.strftime('%Y%m%dT%H%M%S') + '-' + uuid.uuid4().hex[:8]
+        self.writers = {kind: _PartitionWriter(root, kind, run, rowGroupSize, fileRows) for kind in SCHEMAS}
+
+    def write(self, lcChunk, selections, passes, triggers):
+        '''
+        Archive a LightcurveChunk and its results. selections are the names of
+        the selection functions, passes and triggers their pass/fail and
+        trigger JD per object, of shape (objects,) for one function or
+        (objects, functions).
+        '''
+        now = time.time()
+        night = processingNight(now)
+        nObjects = len(lcChunk)
+        nRows = lcChunk.nRows
+
+        candidates = [pa.array(np.repeat(np.asarray(lcChunk.objectIds, dtype=object), lcChunk.counts), pa.string())]
+        candidates += [pa.array(lcChunk.columns[name]) for name, _ in COLUMN_DTYPES]
+        candidates += [pa.array(np.full(nRows, now)), pa.array([self.source]*nRows, pa.string())]
+        self.writers['candidates'].add(pa.RecordBatch.from_arrays(candidates, schema=CANDIDATE_SCHEMA), night)
+
+        passes = np.asarray(passes, dtype=bool).reshape(nObjects, -1)
+        triggers = np.asarray(triggers, dtype=np.float64).reshape(nObjects, -1)
+        nFunc = len(selections)
+        results = [
+            pa.array(np.repeat(np.asarray(lcChunk.objectIds, dtype=object), nFunc), pa.string()),
+            pa.array(np.tile(np.asarray(selections, dtype=object), nObjects), pa.string()),
+            pa.array(passes.ravel()),
+            pa.array(triggers.ravel()),
+            pa.array(np.repeat(lcChunk.counts, nFunc).astype(np.int32)),
+            pa.array(np.full(nObjects*nFunc, now)),
+            pa.array([self.source]*(nObjects*nFunc), pa.string()),
+        ]
+        self.writers['results'].add(pa.RecordBatch.from_arrays(results, schema=RESULT_SCHEMA), night)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
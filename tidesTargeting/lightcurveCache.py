@@ -0,0 +1,165 @@
+'''
+Persistent on-disk cache of Lasair light curves.
+
+Each L.lightcurves response is stored per objectId in a local SQLite file,
+compressed, together with the JD of its latest detection. A cached light curve
+is served again as long as it is at least as recent as the alert that asked
+for it (the alert's jdmax), so repeat runs only download objects that have new
+detections. The cache is kept under a size budget by evicting the least
+recently used light curves, and entries older than a maximum age are dropped.
+'''
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+import numpy as np
+
+
+def latestDetection(response):
+    '''JD of the latest detection (candid not null) in a Lasair light curve response.'''
+    if len(response) == 0:
+        return -np.inf
+    jds = [x['jd'] for x in response['candidates'] if x.get('candid') is not None]
+    return max(jds) if jds else -np.inf
+
+
+class LightcurveCache():
+    def __init__(self, path, maxBytes=None, maxAge=None):
+        '''
+        path:     SQLite file, created if it does not exist.
+        maxBytes: compressed size budget, least recently used entries go first.
+        maxAge:   seconds after which an entry is no longer served.
+        '''
+        self.path = path
+        self.maxBytes = maxBytes
+        self.maxAge = maxAge
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS lightcurves (
+                               objectId TEXT PRIMARY KEY,
+                               jdmax REAL,
+                               fetched REAL,
+                               accessed REAL,
+                               nbytes INTEGER,
+                               response BLOB)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS lightcurves_accessed ON lightcurves (accessed)')
+        self.db.commit()
+
+    def getMany(self, objectIds, jdmax=None):
+        '''
+        Cached responses for objectIds as a dict. Objects missing from the cache,
+        older than maxAge or with no detection as recent as jdmax[objectId] are
+        left out.
+        '''
+        jdmax = jdmax or {}
+        now = time.time()
+        found = {}
+        with self.lock:
+            for objectId in objectIds:
+                row = self.db.execute('SELECT jdmax, fetched, response FROM lightcurves WHERE objectId=?',
+                                      (str(objectId),)).fetchone()
+                if row is None:
+                    continue
+                cachedJdmax, fetched, response = row
+                if self.maxAge is not None and now - fetched > self.maxAge:
+                    continue
+                if objectId in jdmax and (cachedJdmax is None or cachedJdmax < jdmax[objectId]):
+                    continue
+                found[objectId] = json.loads(zlib.decompress(response))
+            self.db.executemany('UPDATE lightcurves SET accessed=? WHERE objectId=?',
+                                [(now, str(objectId)) for objectId in found])
+            self.db.commit()
+            self.hits += len(found)
+            self.misses += len(objectIds) - len(found)
+        return found
+
+    def putMany(self, responses):
+        '''Store a dict of objectId -> Lasair response, then apply the size and age limits.'''
+        now = time.time()
+        rows = []
+        for objectId, response in responses.items():
+            blob = zlib.compress(json.dumps(response).encode())
+            jd = latestDetection(response)
+            rows.append((str(objectId), jd if np.isfinite(jd) else None, now, now, len(blob), blob))
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO lightcurves VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.db.commit()
+        self.evict()
+
+    def evict(self):
+        '''Drop entries older than maxAge, then the least recently used until under maxBytes.'''
+        with self.lock:
+            if self.maxAge is not None:
+                self.db.execute('DELETE FROM lightcurves WHERE fetched < ?', (time.time() - self.maxAge,))
+            if self.maxBytes is not None:
+                total = self.db.execute('SELECT COALESCE(SUM(nbytes), 0) FROM lightcurves').fetchone()[0]
+                if total > self.maxBytes:
+                    excess = total - self.maxBytes
+                    stale = []
+                    for objectId, nbytes in self.db.execute('SELECT objectId, nbytes FROM lightcurves ORDER BY accessed'):
+                        if excess <= 0:
+                            break
+                        stale.append((objectId,))
+                        excess -= nbytes
+                    self.db.executemany('DELETE FROM lightcurves WHERE objectId=?', stale)
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def __getstate__(self):
+        # Unpickled (e.g. on a Dask worker) the cache opens its own connection to the file
+        return {'path': self.path, 'maxBytes': self.maxBytes, 'maxAge': self.maxAge}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], maxBytes=state['maxBytes'], maxAge=state['maxAge'])
+
+
+class CachedLasairClient():
+    '''
+    Wraps a lasair_client so that lightcurves() is served from a LightcurveCache
+    where possible and only the remaining objects are requested from Lasair.
+
+    In offline mode nothing is requested at all, objects that are not cached come
+    back empty, as if Lasair had no data for them.
+    '''
+    def __init__(self, client, cache, offline=False):
+        self.client = client
+        self.cache = cache
+        self.offline = offline
+        self.jdmax = {}
+
+    def expect(self, jdmax):
+        '''
+        The latest alert jdmax per objectId of this batch, cached light curves
+        older than this are refetched. Replaces the last batch's, so a
+        long-lived client does not keep every objectId it has seen.
+        '''
+        self.jdmax = dict(jdmax)
+
+    def subset(self, objectIds):
+        '''A client sharing the cache that only expects the given objects, to ship to a Dask worker.'''
+        other = CachedLasairClient(self.client, self.cache, offline=self.offline)
+        other.jdmax = {x: self.jdmax[x] for x in objectIds if x in self.jdmax}
+        return other
+
+    def lightcurves(self, objectIds):
+        objectIds = list(objectIds)
+        found = self.cache.getMany(objectIds, self.jdmax)
+        missing = [x for x in objectIds if x not in found]
+        if missing and not self.offline:
+            c = self.client.lightcurves(missing)
+            # Pass Lasair errors back untouched so the caller can retry
+            if isinstance(c, dict):
+                return c
+            fetched = dict(zip(missing, c))
+            self.cache.putMany(fetched)
+            found.update(fetched)
+        return [found.get(x, []) for x in objectIds]
@@ -0,0 +1,154 @@
+'''
+Compact columnar storage for a chunk of light curves.
+
+The candidates of every object in a Lasair response are read straight from
+the JSON into typed numpy columns, without building a DataFrame. All columns
+of a chunk are carved out of one shared buffer, and object i owns rows
+offsets[i]:offsets[i+1] of every column. chunk[i] is a view of one object's
+rows, nothing is copied.
+
+    chunk = LightcurveChunk.fromResponses(objectIds, L.lightcurves(objectIds))
+    chunk.group            # object index of every row, for the grouped selection code
+    chunk[3]['magpsf']     # magnitudes of the fourth object, a view
+'''
+
+import numpy as np
+
+# Column dtypes, largest item size first so every column in the shared buffer
+# stays aligned. Non-detections have candid 0 and NaN magpsf/sigmapsf, missing
+# filter ids are 0 (not a ZTF band) and missing night ids -1.
+COLUMN_DTYPES = [
+    ('jd', np.float64),
+    ('magpsf', np.float64),
+    ('sigmapsf', np.float64),
+    ('candid', np.int64),
+    ('diffmaglim', np.float32),
+    ('nid', np.int32),
+    ('fid', np.int8),
+]
+COLUMN_MISSING = {'jd': np.nan, 'magpsf': np.nan, 'sigmapsf': np.nan, 'candid': 0,
+                  'diffmaglim': np.nan, 'nid': -1, 'fid': 0}
+
+
+def _carveColumns(buffer, nRows):
+    '''Column arrays of nRows rows each, laid out one after the other in buffer.'''
+    columns = {}
+    start = 0
+    for name, dtype in COLUMN_DTYPES:
+        size = nRows*np.dtype(dtype).itemsize
+        columns[name] = buffer[start:start + size].view(dtype)
+        start += size
+    return columns
+
+
+def _column(rows, name, dtype, out):
+    '''Fill out with the name field of every candidate dict, None or absent read as missing.'''
+    missing = COLUMN_MISSING[name]
+    out[:] = np.fromiter((missing if (v := x.get(name)) is None else v for x in rows), dtype=dtype, count=len(rows))
+
+
+class Lightcurve():
+    '''One object's rows of a LightcurveChunk. Columns are views into the chunk.'''
+    def __init__(self, chunk, i):
+        self.objectId = chunk.objectIds[i]
+        self._slice = slice(chunk.offsets[i], chunk.offsets[i + 1])
+        self._chunk = chunk
+
+    def __getitem__(self, name):
+        return self._chunk.columns[name][self._slice]
+
+    def __len__(self):
+        return self._slice.stop - self._slice.start
+
+    @property
+    def isDetection(self):
+        return self['candid'] != 0
+
+
+class LightcurveChunk():
+    def __init__(self, objectIds, offsets, columns, buffer=None):
+        self.objectIds = list(objectIds)
+        self.offsets = offsets
+        self.columns = columns
+        self.buffer = buffer
+
+    @classmethod
+    def fromCandidates(cls, objectIds, candidates):
+        '''Build from one list of candidate dicts per object.'''
+        counts = np.fromiter((len(x) for x in candidates), dtype=np.int64, count=len(candidates))
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        nRows = int(offsets[-1])
+        rows = [row for x in candidates for row in x]
+
+        buffer = np.empty(nRows*sum(np.dtype(d).itemsize for _, d in COLUMN_DTYPES), dtype=np.uint8)
+        columns = _carveColumns(buffer, nRows)
+        for name, dtype in COLUMN_DTYPES:
+            _column(rows, name, dtype, columns[name])
+        return cls(objectIds, offsets, columns, buffer)
+
+    @classmethod
+    def fromColumns(cls, objectIds, counts, columns):
+        '''
+        Build from columns that are already typed (e.g. read back from the
+        archive), rows grouped by object in the order of objectIds, counts[i]
+        rows for object i. Missing columns are filled as missing.
+        '''
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        nRows = int(offsets[-1])
+        buffer = np.empty(nRows*sum(np.dtype(d).itemsize for _, d in COLUMN_DTYPES), dtype=np.uint8)
+        chunkColumns = _carveColumns(buffer, nRows)
+        for name, dtype in COLUMN_DTYPES:
+            if name in columns:
+                chunkColumns[name][:] = np.asarray(columns[name])
+            else:
+                chunkColumns[name][:] = COLUMN_MISSING[name]
+        return cls(objectIds, offsets, chunkColumns, buffer)
+
+    @classmethod
+    def fromResponses(cls, objectIds, c):
+        '''Build from the response of L.lightcurves(objectIds), [] for objects with no data.'''
+        return cls.fromCandidates(objectIds, [x['candidates'] if len(x) != 0 else [] for x in c])
+
+    def __len__(self):
+        return len(self.objectIds)
+
+    def __getitem__(self, i):
+        return Lightcurve(self, i)
+
+    def __iter__(self):
+        return (Lightcurve(self, i) for i in range(len(self)))
+
+    @property
+    def nRows(self):
+        return int(self.offsets[-1])
+
+    @property
+    def counts(self):
+        '''Number of candidates of every object.'''
+        return np.diff(self.offsets)
+
+    @property
+    def hasData(self):
+        '''True for the objects Lasair returned any candidates for.'''
+        return self.counts != 0
+
+    @property
+    def group(self):
+        '''Index of the object every row belongs to.'''
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.counts)
+
+    @property
+    def isDetection(self):
+        return self.columns['candid'] != 0
+
+    def __getstate__(self):
+        # Only the buffer is pickled, the column views are rebuilt from it
+        return {'objectIds': self.objectIds, 'offsets': self.offsets, 'buffer': self.buffer}
+
+    def __setstate__(self, state):
+        self.objectIds = state['objectIds']
+        self.offsets = state['offsets']
+        self.buffer = state['buffer']
+        self.columns = _carveColumns(self.buffer, int(self.offsets[-1]))
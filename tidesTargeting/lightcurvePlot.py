@@ -0,0 +1,139 @@
+'''
+Light curve plots for checkObjects.py.
+
+Plots are drawn with the object-oriented matplotlib API on an Agg canvas, not
+through pyplot, so no global figure state is involved. Each worker process
+creates one figure and clears and reuses it for every light curve it draws.
+LightcurvePlotter hands the rendering to a pool of such workers so that the
+fetch and selection loop never waits on matplotlib.
+'''
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from lightcurveSelection import NO_TRIGGER
+from lightcurveChunk import Lightcurve
+
+# Colour used for each filter id (fid)
+BAND_COLOURS = {1: ('g', 'green'), 2: ('r', 'red'), 3: ('i', 'yellow')}
+
+# Only these columns are shipped to the plotting workers
+PLOT_COLUMNS = ['jd', 'fid', 'magpsf', 'sigmapsf', 'diffmaglim']
+
+_figure = None
+
+
+def _reusedAxes():
+    '''The figure of this process, created on first use and cleared afterwards.'''
+    global _figure
+    if _figure is None:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        _figure = Figure()
+        FigureCanvasAgg(_figure)
+        _figure.add_subplot()
+    ax = _figure.axes[0]
+    ax.cla()
+    return _figure, ax
+
+
+def _initWorker():
+    '''Start a plotting worker on the Agg backend, with its figure ready.'''
+    import matplotlib
+    matplotlib.use('Agg')
+    _reusedAxes()
+
+
+def lightcurveArrays(lc):
+    '''
+    The columns needed for plotting, as numpy arrays. lc is one object of a
+    LightcurveChunk, whose columns are passed on as they are, or a DataFrame.
+    '''
+    if isinstance(lc, Lightcurve):
+        arrays = {col: lc[col] for col in PLOT_COLUMNS}
+        arrays['nonDets'] = ~lc.isDetection
+        return arrays
+    arrays = {col: lc[col].to_numpy(dtype=np.float64) for col in PLOT_COLUMNS if col in lc.columns}
+    arrays['nonDets'] = lc['candid'].isna().to_numpy()
+    return arrays
+
+
+def plotLightCurve(name, lc, significance, triggerDate=NO_TRIGGER, saveName=None, dpi=300):
+    '''
+    Plot one light curve and save it to saveName. lc is a dict of arrays (see
+    lightcurveArrays). Non-detections are drawn as upper limits, detections
+    below the significance threshold as crosses.
+    '''
+    fig, ax = _reusedAxes()
+    nonDets = lc['nonDets']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigSatisfy = 1.09/lc['sigmapsf'] >= significance
+    lowSig = ~sigSatisfy & ~nonDets
+
+    inBand = {fid: lc['fid'] == fid for fid in BAND_COLOURS}
+    if 'diffmaglim' in lc:
+        for fid, (band, colour) in BAND_COLOURS.items():
+            limits = nonDets & inBand[fid]
+            ax.scatter(lc['jd'][limits], lc['diffmaglim'][limits], marker='v', color=colour, alpha=0.5)
+    for fid, (band, colour) in BAND_COLOURS.items():
+        sig = inBand[fid] & sigSatisfy
+        ax.errorbar(lc['jd'][sig], lc['magpsf'][sig], yerr=lc['sigmapsf'][sig], fmt='o', color=colour, label=band)
+    for fid, (band, colour) in BAND_COLOURS.items():
+        low = inBand[fid] & lowSig
+        if low.any():
+            ax.errorbar(lc['jd'][low], lc['magpsf'][low], yerr=lc['sigmapsf'][low], color=colour,
+                        label=band+' < SNR', marker='x', linestyle='')
+
+    if triggerDate != NO_TRIGGER:
+        ax.axvline(triggerDate, ls='--', c='k', label='Trigger Date')
+    ax.invert_yaxis()
+    ax.set_title(name)
+    ax.legend(loc='upper right')
+    ax.set_xlabel('JD')
+    ax.set_ylabel('Mag')
+
+    if saveName is not None:
+        fig.savefig(saveName, dpi=dpi, bbox_inches='tight')
+    return saveName
+
+
+class LightcurvePlotter():
+    '''
+    Renders light curve plots on a pool of worker processes. With workers=0
+    plots are drawn in the calling process instead.
+
+    At most maxPending plots are queued at once, submit() waits for the oldest
+    one when the queue is full so memory stays bounded on large runs.
+    '''
+    def __init__(self, significance, workers=2, dpi=300, fileFormat='png', maxPending=200):
+        self.significance = significance
+        self.dpi = dpi
+        self.fileFormat = fileFormat
+        self.maxPending = maxPending
+        self.pool = None
+        self.pending = []
+        if workers > 0:
+            # Workers start from a forkserver where there is one (not Windows), never
+            # forked from a process that may already run fetch threads or matplotlib
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else None)
+            self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_initWorker)
+
+    def submit(self, name, lc, triggerDate, outputPrefix):
+        saveName = outputPrefix + str(name) + '.' + self.fileFormat
+        args = (str(name), lightcurveArrays(lc), self.significance, triggerDate, saveName, self.dpi)
+        if self.pool is None:
+            plotLightCurve(*args)
+            return
+        if len(self.pending) >= self.maxPending:
+            self.pending.pop(0).result()
+        self.pending.append(self.pool.submit(plotLightCurve, *args))
+
+    def close(self):
+        '''Wait for the outstanding plots and shut the pool down.'''
+        for future in self.pending:
+            future.result()
+        self.pending = []
+        if self.pool is not None:
+            self.pool.shutdown()
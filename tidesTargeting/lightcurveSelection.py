@@ -0,0 +1,304 @@
+'''
+Vectorised evaluation of the TiDES light curve selection functions.
+
+Rather than building a DataFrame and evaluating the criteria object by object,
+the candidates of many objects (a whole Lasair chunk, or a whole night) are
+held in one LightcurveChunk with an integer group index per row. The criteria
+are then evaluated for every object in one grouped pass over its columns.
+'''
+
+import numpy as np
+
+from lightcurveChunk import Lightcurve
+
+# Band name for each filter id (fid), indexed by fid. This is hardcoded for ZTF,
+# will need to be changed for LSST as more filters are added.
+BAND_NAMES = np.array(['', 'g', 'r', 'i'])
+
+# Trigger date reported for objects that never pass, as in the PassFailCut.csv output
+NO_TRIGGER = -9999
+
+
+def allowedBands(criteria):
+    '''
+    Boolean lookup array, indexed by fid, that is True for the bands listed
+    in the selection function's 'filters'.
+    '''
+    return np.isin(BAND_NAMES, criteria['filters']) & (BAND_NAMES != '')
+
+
+def significantMask(criteria, fid, sigmapsf):
+    '''
+    True for every row that is in one of the requested bands and detected at
+    or above the requested significance. Unknown filter ids never pass.
+    '''
+    allowed = allowedBands(criteria)
+    fid = np.asarray(fid, dtype=np.float64)
+    known = np.isfinite(fid) & (fid >= 0) & (fid < len(allowed))
+    fidIdx = np.where(known, fid, 0).astype(np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        significant = 1.09/np.asarray(sigmapsf, dtype=np.float64) >= criteria['significance']
+    return known & allowed[fidIdx] & significant
+
+
+def _countDistinct(group, values, nGroups):
+    '''Number of distinct values per group.'''
+    if len(group) == 0:
+        return np.zeros(nGroups, dtype=np.int64)
+    values = values.astype(np.int64)
+    offset = values.min()
+    span = values.max() - offset + 1
+    uniqueKeys = np.unique(group*span + (values - offset))
+    return np.bincount(uniqueKeys // span, minlength=nGroups)
+
+
+def evaluateGroups(criteria, group, nGroups, fid, nid, sigmapsf, magpsf):
+    '''
+    Evaluate a selection function for many objects at once.
+
+    group is an integer array (0..nGroups-1) giving the object each row belongs
+    to, the remaining arrays are the matching candidate columns. Returns a
+    boolean array of length nGroups. An object passes when:
+    - it has significant detections in at least minBands of the filters
+    - it has significant detections on at least minNights nights
+    - it is brighter than magLimit in at least one detection
+    '''
+    group = np.asarray(group, dtype=np.int64)
+    sigAndFilterBool = significantMask(criteria, fid, sigmapsf)
+
+    sigGroup = group[sigAndFilterBool]
+    nBands = _countDistinct(sigGroup, np.asarray(fid)[sigAndFilterBool], nGroups)
+    nNights = _countDistinct(sigGroup, np.asarray(nid)[sigAndFilterBool], nGroups)
+
+    # Non-detections have no magpsf, fmin skips over their NaNs
+    minMag = np.full(nGroups, np.inf)
+    np.fmin.at(minMag, group, np.asarray(magpsf, dtype=np.float64))
+
+    meetMinBands = nBands >= criteria['minBands']
+    meetMinNight = nNights >= criteria['minNights']
+    meetMagLimit = minMag <= criteria['magLimit']
+    return meetMinBands & meetMinNight & meetMagLimit
+
+
+def _firstAppearances(group, values, jd):
+    '''
+    Rows must be sorted by (group, jd). The group and JD at which every distinct
+    value of every group first appears, sorted by (group, JD), and the rank of
+    each appearance within its group (0 for the first distinct value).
+    '''
+    if len(group) == 0:
+        return group, jd, group
+    values = values.astype(np.int64)
+    offset = values.min()
+    span = values.max() - offset + 1
+    # Sorted by jd within each group, so return_index picks out the first appearance
+    _, first = np.unique(group*span + (values - offset), return_index=True)
+    firstGroup = group[first]
+    firstJd = jd[first]
+    order = np.lexsort((firstJd, firstGroup))
+    firstGroup = firstGroup[order]
+    firstJd = firstJd[order]
+    groupStart = np.searchsorted(firstGroup, firstGroup, side='left')
+    return firstGroup, firstJd, np.arange(len(firstGroup)) - groupStart
+
+
+def _kthJd(appearances, nGroups, k):
+    '''
+    For every group, the JD at which the k-th distinct value appears, inf if it
+    never does and -inf if k <= 0. k is one number, or one per group.
+    '''
+    if np.ndim(k) == 0 and k <= 0:
+        return np.full(nGroups, -np.inf)
+    firstGroup, firstJd, rank = appearances
+    kth = np.full(nGroups, np.inf)
+    isKth = rank == (k if np.ndim(k) == 0 else np.asarray(k)[firstGroup]) - 1
+    kth[firstGroup[isKth]] = firstJd[isKth]
+    if np.ndim(k) != 0:
+        kth[np.asarray(k) <= 0] = -np.inf
+    return kth
+
+
+def _kthFirstJd(group, values, jd, nGroups, k):
+    '''
+    Rows must be sorted by (group, jd). For every group, the JD at which the
+    k-th distinct value first appears, inf if it never does.
+    '''
+    return _kthJd(_firstAppearances(group, values, jd), nGroups, k)
+
+
+def triggerGroups(criteria, group, nGroups, jd, fid, nid, sigmapsf, magpsf, isDetection):
+    '''
+    The first detection JD at which each object satisfies the selection
+    function, NO_TRIGGER if it never does. Same arguments as evaluateGroups,
+    plus the candidate JDs and a mask of real detections (candid not null).
+
+    Walking the light curve in time order, the band set, night set and
+    minimum magnitude only ever grow or fall, so each criterion is met from
+    one JD onwards: the minBands-th band to appear, the minNights-th night to
+    appear and the first detection brighter than magLimit. The object triggers
+    on the first detection at or after the latest of the three. This gives the
+    same answer as re-evaluating lc[lc['jd']<=x] for every detection date x,
+    in a single sort rather than a pass per date.
+    '''
+    group = np.asarray(group, dtype=np.int64)
+    jd = np.asarray(jd, dtype=np.float64)
+    order = np.lexsort((jd, group))
+    group = group[order]
+    jd = jd[order]
+    fid = np.asarray(fid)[order]
+    nid = np.asarray(nid)[order]
+    magpsf = np.asarray(magpsf, dtype=np.float64)[order]
+    isDetection = np.asarray(isDetection, dtype=bool)[order]
+
+    sigAndFilterBool = significantMask(criteria, fid, np.asarray(sigmapsf)[order])
+    sigGroup = group[sigAndFilterBool]
+    sigJd = jd[sigAndFilterBool]
+    bandsJd = _kthFirstJd(sigGroup, fid[sigAndFilterBool], sigJd, nGroups, criteria['minBands'])
+    nightsJd = _kthFirstJd(sigGroup, nid[sigAndFilterBool], sigJd, nGroups, criteria['minNights'])
+
+    magJd = np.full(nGroups, np.inf)
+    brightEnough = magpsf <= criteria['magLimit']
+    np.minimum.at(magJd, group[brightEnough], jd[brightEnough])
+
+    allMetJd = np.maximum(np.maximum(bandsJd, nightsJd), magJd)
+
+    triggerJd = np.full(nGroups, np.inf)
+    afterAllMet = isDetection & (jd >= allMetJd[group])
+    np.minimum.at(triggerJd, group[afterAllMet], jd[afterAllMet])
+    return np.where(np.isfinite(triggerJd), triggerJd, NO_TRIGGER)
+
+
+def satisfyBatch(criteria, chunk):
+    '''
+    Pass/fail for every object of a LightcurveChunk, evaluated in one grouped
+    pass over its columns. Objects with no candidates fail.
+    Returns a boolean numpy array in the order of chunk.objectIds.
+    '''
+    if chunk.nRows == 0:
+        return np.zeros(len(chunk), dtype=bool)
+    cols = chunk.columns
+    return evaluateGroups(criteria, chunk.group, len(chunk), cols['fid'], cols['nid'],
+                          cols['sigmapsf'], cols['magpsf'])
+
+
+def triggerBatch(criteria, chunk):
+    '''
+    Trigger JD for every object of a LightcurveChunk, NO_TRIGGER for objects
+    that never pass.
+    '''
+    if chunk.nRows == 0:
+        return np.full(len(chunk), NO_TRIGGER, dtype=np.float64)
+    cols = chunk.columns
+    return triggerGroups(criteria, chunk.group, len(chunk), cols['jd'], cols['fid'], cols['nid'],
+                         cols['sigmapsf'], cols['magpsf'], chunk.isDetection)
+
+
+def _maskKey(criteria):
+    '''Selection functions with the same key share their significant detections.'''
+    return tuple(sorted(criteria['filters'])), criteria['significance']
+
+
+def evaluateCriteriaSet(criteriaSet, chunk):
+    '''
+    Evaluate several selection functions (a dict of name -> criteria, e.g. the
+    whole of tidesSelectionFunctions.yml) over a LightcurveChunk in one pass.
+
+    The chunk is sorted once, and the significant-detection mask with the JDs
+    at which each band and night first appears is worked out once per distinct
+    (filters, significance) pair. Each function then only has to pick out its
+    minBands-th band, minNights-th night and magLimit. Gives the same answers
+    as satisfyBatch and triggerBatch for each function on its own.
+
+    Returns the names, a boolean pass matrix and a trigger JD matrix, both of
+    shape (objects, functions) with columns in the order of the names.
+    '''
+    names = list(criteriaSet)
+    nGroups = len(chunk)
+    passes = np.zeros((nGroups, len(names)), dtype=bool)
+    triggers = np.full((nGroups, len(names)), NO_TRIGGER, dtype=np.float64)
+    if chunk.nRows == 0:
+        return names, passes, triggers
+
+    cols = chunk.columns
+    group = chunk.group
+    order = np.lexsort((cols['jd'], group))
+    group = group[order]
+    jd = cols['jd'][order]
+    fid = cols['fid'][order]
+    nid = cols['nid'][order]
+    sigmapsf = cols['sigmapsf'][order]
+    magpsf = cols['magpsf'][order]
+    isDetection = chunk.isDetection[order]
+
+    # Non-detections have no magpsf, fmin skips over their NaNs
+    minMag = np.full(nGroups, np.inf)
+    np.fmin.at(minMag, group, magpsf)
+
+    shared = {}
+    magJds = {}
+    for j, name in enumerate(names):
+        criteria = criteriaSet[name]
+        key = _maskKey(criteria)
+        if key not in shared:
+            sig = significantMask(criteria, fid, sigmapsf)
+            shared[key] = (_firstAppearances(group[sig], fid[sig], jd[sig]),
+                           _firstAppearances(group[sig], nid[sig], jd[sig]))
+        bands, nights = shared[key]
+
+        nBands = np.bincount(bands[0], minlength=nGroups)
+        nNights = np.bincount(nights[0], minlength=nGroups)
+        passes[:, j] = ((nBands >= criteria['minBands']) & (nNights >= criteria['minNights'])
+                        & (minMag <= criteria['magLimit']))
+
+        magLimit = criteria['magLimit']
+        if magLimit not in magJds:
+            magJds[magLimit] = np.full(nGroups, np.inf)
+            brightEnough = magpsf <= magLimit
+            np.minimum.at(magJds[magLimit], group[brightEnough], jd[brightEnough])
+        allMetJd = np.maximum(np.maximum(_kthJd(bands, nGroups, criteria['minBands']),
+                                         _kthJd(nights, nGroups, criteria['minNights'])), magJds[magLimit])
+        triggerJd = np.full(nGroups, np.inf)
+        afterAllMet = isDetection & (jd >= allMetJd[group])
+        np.minimum.at(triggerJd, group[afterAllMet], jd[afterAllMet])
+        triggers[:, j] = np.where(np.isfinite(triggerJd), triggerJd, NO_TRIGGER)
+    return names, passes, triggers
+
+
+def selectionFunctions(criteriaFile):
+    '''Every selection function (a mapping with filters) defined in a selection YAML file.'''
+    return {name: criteria for name, criteria in criteriaFile.items()
+            if isinstance(criteria, dict) and 'filters' in criteria}
+
+
+def lightcurveSatify(criteria, lightcurve):
+    '''
+    Our paper states that the tides slection criteria is as follows:
+    - only consider griz
+    - must have at least 3 5sigma detections
+    - Must have 5sigma detections across 2 nights
+    - Must reach brighter than 22.5mag
+
+    Single object version of satisfyBatch, lightcurve is one object of a
+    LightcurveChunk or a DataFrame of its candidates.
+    '''
+    if len(lightcurve) == 0:
+        return False
+    group = np.zeros(len(lightcurve), dtype=np.int64)
+    return bool(evaluateGroups(criteria, group, 1, lightcurve['fid'], lightcurve['nid'],
+                               lightcurve['sigmapsf'], lightcurve['magpsf'])[0])
+
+
+def lightcurveTriggerDate(criteria, lightcurve):
+    '''
+    Single object version of triggerBatch, lightcurve is one object of a
+    LightcurveChunk or a DataFrame of its candidates.
+    '''
+    if len(lightcurve) == 0:
+        return NO_TRIGGER
+    if isinstance(lightcurve, Lightcurve):
+        isDetection = lightcurve.isDetection
+    else:
+        isDetection = lightcurve['candid'].notna()
+    group = np.zeros(len(lightcurve), dtype=np.int64)
+    return float(triggerGroups(criteria, group, 1, lightcurve['jd'], lightcurve['fid'], lightcurve['nid'],
+                               lightcurve['sigmapsf'], lightcurve['magpsf'], isDetection)[0])
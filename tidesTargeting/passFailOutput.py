@@ -0,0 +1,152 @@
+'''
+Streamed, checkpointed output of checkObjects.py.
+
+PassFailCut.csv (and PassFailMatrix.csv with several selection functions) is
+written a chunk at a time as chunks are evaluated, rather than once at the end
+of the run. Chunks can arrive out of order, so each one is held back until
+every chunk before it has been written, which keeps the rows in input order.
+After each write a line is appended to the checkpoint file in the output
+directory, listing the objectIds written and the size of every output file:
+
+    {"objects": ["ZTF21aassamj", ...], "sizes": [5120, 9311]}
+
+A run started again with resume=True reads the checkpoint, cuts the output
+files back to the sizes of its last complete line (dropping anything written
+after the last checkpoint) and carries on, skipping the objects in it.
+
+    out = PassFailOutput('/data/out/', criteriaNames, resume=True)
+    names = readObjectIds('/data/ztfIaList.dat', skip=out.done)
+    ...
+    out.write(z, chunkNames, passFail, trigD, passMatrix, triggerMatrix)
+    out.close()
+'''
+
+import csv
+import itertools
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+CHECKPOINT = 'PassFailCut.checkpoint'
+
+
+def readObjectIds(path, skip=None, blockSize=100000):
+    '''
+    The objectIds in the list at path, read lazily blockSize lines at a time,
+    each once, in the order they first appear. Ids in skip are left out and
+    every id read is added to it.
+    '''
+    skip = set() if skip is None else skip
+    for block in pd.read_csv(str(path), header=None, names=['ztfname'], dtype=str, chunksize=blockSize):
+        for name in block['ztfname']:
+            if name not in skip:
+                skip.add(name)
+                yield name
+
+
+def splitIntoChunks(names, n):
+    '''Lists of n names at a time from any iterable, the last one shorter.'''
+    names = iter(names)
+    while chunk := list(itertools.islice(names, n)):
+        yield chunk
+
+
+class PassFailOutput():
+    def __init__(self, output, criteriaNames=None, resume=False):
+        '''
+        output:        directory the files are written in, with a trailing /.
+        criteriaNames: names of the selection functions. With more than one,
+                       PassFailMatrix.csv is written as well.
+        resume:        carry on from the checkpoint of an earlier run, if there is one.
+        '''
+        self.paths = [output + 'PassFailCut.csv']
+        self.headers = [['ZTFName', 'PassCut', 'TriggerDate']]
+        if criteriaNames is not None and len(criteriaNames) > 1:
+            self.paths.append(output + 'PassFailMatrix.csv')
+            self.headers.append(['ZTFName'] + [x + suffix for x in criteriaNames for suffix in ['_Pass', '_TriggerDate']])
+        self.checkpointPath = output + CHECKPOINT
+        ## objectIds already written by an earlier run
+        self.done = set()
+        self.written = 0
+        self.pending = {}
+        self.next = 0
+
+        sizes = self._readCheckpoint() if resume else None
+        if sizes is None:
+            self.files = [open(x, 'w', newline='') for x in self.paths]
+            for f, header in zip(self.files, self.headers):
+                f.write(','.join(header) + '\n')
+            self.checkpoint = open(self.checkpointPath, 'w')
+            self._commit([])
+        else:
+            for path, size in zip(self.paths, sizes):
+                os.truncate(path, size)
+            self.files = [open(x, 'a', newline='') for x in self.paths]
+            self.checkpoint = open(self.checkpointPath, 'a')
+            print('Resuming from', self.checkpointPath, 'with', len(self.done), 'objects already done')
+        ## Rows as pandas to_csv wrote them: True/False, and trigger dates as floats
+        self.writers = [csv.writer(f, lineterminator='\n') for f in self.files]
+
+    def _readCheckpoint(self):
+        '''
+        Fill done from the checkpoint and return the file sizes of its last
+        complete line, or None when there is nothing to resume from.
+        '''
+        if not os.path.isfile(self.checkpointPath) or not all(os.path.isfile(x) for x in self.paths):
+            return None
+        sizes = None
+        good = 0
+        with open(self.checkpointPath) as f:
+            for line in f:
+                ## A line cut short by a crash ends the checkpoint
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                if not line.endswith('\n') or len(entry['sizes']) != len(self.paths):
+                    break
+                self.done.update(entry['objects'])
+                sizes = entry['sizes']
+                good += len(line.encode())
+        if sizes is not None:
+            os.truncate(self.checkpointPath, good)
+        return sizes
+
+    def _commit(self, names):
+        for f in self.files:
+            f.flush()
+        self.checkpoint.write(json.dumps({'objects': list(names), 'sizes': [f.tell() for f in self.files]}) + '\n')
+        self.checkpoint.flush()
+
+    def write(self, z, names, passFail, trigD, passMatrix=None, triggerMatrix=None):
+        '''
+        The results of chunk z (numbered from 0 in the order the chunks were
+        made): the pass/fail ('No Data' for objects without a light curve) and
+        trigger date of the first selection function, and the pass and trigger
+        date matrices of all of them when there are several.
+        '''
+        self.pending[z] = (names, passFail, trigD, passMatrix, triggerMatrix)
+        while self.next in self.pending:
+            self._write(*self.pending.pop(self.next))
+            self.next += 1
+
+    def _write(self, names, passFail, trigD, passMatrix, triggerMatrix):
+        self.writers[0].writerows(zip(names, passFail, np.asarray(trigD, dtype=np.float64).tolist()))
+        if len(self.files) > 1:
+            passMatrix = passMatrix.astype(object)
+            passMatrix[np.array([x == 'No Data' for x in passFail], dtype=bool)] = 'No Data'
+            ## Pass and trigger date columns interleaved, one pair per selection function
+            matrix = np.empty((len(names), 2*passMatrix.shape[1]), dtype=object)
+            matrix[:, 0::2] = passMatrix
+            matrix[:, 1::2] = np.asarray(triggerMatrix, dtype=np.float64).tolist()
+            self.writers[1].writerows([name] + row for name, row in zip(names, matrix.tolist()))
+        self._commit(names)
+        self.written += len(names)
+
+    def close(self):
+        if self.pending:
+            print('Chunks left unwritten, waiting for earlier chunks:', sorted(self.pending))
+        for f in self.files + [self.checkpoint]:
+            f.close()
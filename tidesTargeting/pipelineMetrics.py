@@ -0,0 +1,215 @@
+'''
+Timers, counters and latency histograms for the TiDES scripts and flows.
+
+A Metrics object times named stages (Kafka draining, Lasair calls, selection,
+the MERGE, 4MOST calls...) and counts events (alerts consumed, passes, API
+errors...). Every timing is written as one JSON line to a log file, and the
+totals can be written as a Prometheus textfile for the node_exporter textfile
+collector. NO_METRICS has the same methods and does nothing, it is the default
+wherever metrics can be passed in, so the hooks cost next to nothing when
+instrumentation is switched off.
+
+    metrics = Metrics('tides_comm', jsonLog='metrics.jsonl', textfile='tides_comm.prom')
+    with metrics.timer('lasair'):
+        c = L.lightcurves(chunk)
+    metrics.count('passes', nPass)
+    metrics.writeTextfile()
+
+A LatencyTrace keeps, for every object of one flow run, the wall-clock time
+it reached each stage, from the alert arriving to the 4MOST call returning.
+The flow stores these with the object in tides_master and reports
+percentiles of the time between stages.
+
+    trace = LatencyTrace()
+    trace.mark('fetched', chunk)
+    trace.times('fetched', names)    # epoch seconds, NaN where never marked
+'''
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600]
+
+
+class _NullTimer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullMetrics():
+    '''Metrics that records nothing.'''
+    enabled = False
+    _timer = _NullTimer()
+
+    def timer(self, stage, **labels):
+        return self._timer
+
+    def observe(self, stage, seconds, **labels):
+        pass
+
+    def observeMany(self, stage, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def log(self, event, **fields):
+        pass
+
+    def writeTextfile(self):
+        pass
+
+    def close(self):
+        pass
+
+
+NO_METRICS = NullMetrics()
+
+
+class Metrics():
+    enabled = True
+
+    def __init__(self, prefix, jsonLog=None, textfile=None):
+        '''
+        prefix:   prefix of the Prometheus metric names, e.g. tides_comm.
+        jsonLog:  path of the JSON lines log, '-' for stdout, None for no log.
+        textfile: path of the Prometheus textfile written by writeTextfile.
+        '''
+        self.prefix = prefix
+        self.textfile = textfile
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        if jsonLog == '-':
+            self.out = sys.stdout
+        elif jsonLog is not None:
+            self.out = open(jsonLog, 'a', buffering=1)
+        else:
+            self.out = None
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        '''Time the body of a with block as one observation of stage.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    def observe(self, stage, seconds, **labels):
+        '''Add one timing of stage to its histogram and the log.'''
+        with self.lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = self.histograms[stage] = {'buckets': np.zeros(len(BUCKETS), dtype=np.int64),
+                                                 'count': 0, 'sum': 0.0}
+            hist['buckets'][np.searchsorted(BUCKETS, seconds):] += 1
+            hist['count'] += 1
+            hist['sum'] += seconds
+        self.log('timer', stage=stage, seconds=round(seconds, 6), **labels)
+
+    def observeMany(self, stage, seconds):
+        '''
+        Add many timings of stage to its histogram at once, e.g. the latency of
+        every object of a run, with one line in the log for all of them.
+        '''
+        seconds = np.asarray(seconds, dtype=np.float64)
+        seconds = seconds[np.isfinite(seconds)]
+        with self.lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = self.histograms[stage] = {'buckets': np.zeros(len(BUCKETS), dtype=np.int64),
+                                                 'count': 0, 'sum': 0.0}
+            hist['buckets'] += np.cumsum(np.bincount(np.searchsorted(BUCKETS, seconds), minlength=len(BUCKETS) + 1))[:len(BUCKETS)]
+            hist['count'] += len(seconds)
+            hist['sum'] += float(seconds.sum())
+        self.log('timers', stage=stage, count=len(seconds), seconds=round(float(seconds.sum()), 6))
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def log(self, event, **fields):
+        '''Write one JSON line to the log.'''
+        if self.out is None:
+            return
+        line = json.dumps(dict({'time': time.time(), 'event': event}, **fields), default=str)
+        with self.lock:
+            self.out.write(line + '\n')
+
+    def textfileLines(self):
+        p = self.prefix
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines += ['# TYPE %s_%s_total counter' % (p, name), '%s_%s_total %s' % (p, name, value)]
+            if self.histograms:
+                lines.append('# TYPE %s_stage_seconds histogram' % p)
+            for stage, hist in sorted(self.histograms.items()):
+                for le, n in zip(BUCKETS, hist['buckets']):
+                    lines.append('%s_stage_seconds_bucket{stage="%s",le="%g"} %d' % (p, stage, le, n))
+                lines.append('%s_stage_seconds_bucket{stage="%s",le="+Inf"} %d' % (p, stage, hist['count']))
+                lines.append('%s_stage_seconds_sum{stage="%s"} %.6f' % (p, stage, hist['sum']))
+                lines.append('%s_stage_seconds_count{stage="%s"} %d' % (p, stage, hist['count']))
+        return lines
+
+    def writeTextfile(self):
+        '''
+        Write the counters and histograms to the textfile. It is written next to
+        the target and renamed over it, so the collector never reads half a file.
+        '''
+        if self.textfile is None:
+            return
+        tmp = self.textfile + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(self.textfileLines()) + '\n')
+        os.replace(tmp, self.textfile)
+
+    def summary(self):
+        '''Counters and, per stage, the number of timings and total seconds.'''
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'stages': {s: {'count': h['count'], 'seconds': round(h['sum'], 6)} for s, h in self.histograms.items()}}
+
+    def close(self):
+        self.log('summary', **self.summary())
+        self.writeTextfile()
+        if self.out is not None and self.out is not sys.stdout:
+            self.out.close()
+        self.out = None
+
+
+class LatencyTrace():
+    '''The time.time() at which each object reached each stage of a flow run.'''
+    def __init__(self):
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def mark(self, stage, names, when=None):
+        '''Record that the named objects reached stage, now if when is not given.'''
+        when = time.time() if when is None else when
+        with self.lock:
+            self.stages.setdefault(stage, {}).update(dict.fromkeys(names, when))
+
+    def times(self, stage, names):
+        '''The times the named objects reached stage, NaN for those that never did.'''
+        with self.lock:
+            marked = self.stages.get(stage, {})
+            return np.array([marked.get(x, np.nan) for x in names], dtype=np.float64)
+
+
+def makeMetrics(prefix, jsonLog=None, textfile=None):
+    '''A Metrics, or NO_METRICS when there is neither a log nor a textfile to write.'''
+    if jsonLog is None and textfile is None:
+        return NO_METRICS
+    return Metrics(prefix, jsonLog=jsonLog, textfile=textfile)
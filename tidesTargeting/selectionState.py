@@ -0,0 +1,134 @@
+'''
+Incremental evaluation of a selection function.
+
+Every criterion of a selection function is a running aggregate over the
+light curve in time order: the bands and nights with significant detections
+only ever grow, and the minimum magnitude only ever falls. So rather than
+re-evaluating an object's whole history on every alert, we keep per object
+
+    bands     bitmask of the filter ids with a significant detection
+    nnights   number of nights with a significant detection
+    lastnid   latest of those nights
+    minmag    brightest magnitude seen
+    lastjd    JD of the latest row folded in
+    passed    whether the object has passed, and its triggerjd
+
+and fold in only the rows after lastjd. An object passes, with its trigger
+JD, on the first detection at which its state crosses all the thresholds,
+and stays passed, so objects that have passed need not be fetched again.
+This gives the same answers as satisfyBatch and triggerBatch over the whole
+light curve, as long as rows reach Lasair in time order.
+
+    state = stateFromTable(table, chunk.objectIds)
+    state = foldChunk(criteria, chunk, state)
+    table = stateToTable(chunk.objectIds, state)
+'''
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from lightcurveSelection import significantMask, BAND_NAMES, NO_TRIGGER, _firstAppearances, _kthJd, _countDistinct
+
+STATE_COLUMNS = ['bands', 'nnights', 'lastnid', 'minmag', 'lastjd', 'passed', 'triggerjd']
+# lastnid before any night has been seen, below every real (or missing, -1) night id
+NO_NIGHT = -2**31
+
+
+def criteriaKey(name, criteria):
+    '''
+    Name the state is stored under: the selection function name and a hash of
+    its criteria, so editing a selection function starts its state afresh.
+    '''
+    digest = hashlib.md5(yaml.safe_dump(criteria, sort_keys=True).encode()).hexdigest()[:8]
+    return str(name) + ':' + digest
+
+
+def emptyState(n):
+    '''The state of n objects nothing has been seen of.'''
+    return {
+        'bands': np.zeros(n, dtype=np.int64),
+        'nnights': np.zeros(n, dtype=np.int64),
+        'lastnid': np.full(n, NO_NIGHT, dtype=np.int64),
+        'minmag': np.full(n, np.inf),
+        'lastjd': np.full(n, -np.inf),
+        'passed': np.zeros(n, dtype=bool),
+        'triggerjd': np.full(n, NO_TRIGGER, dtype=np.float64),
+    }
+
+
+def stateFromTable(table, objectIds):
+    '''State arrays in the order of objectIds from a table with a name column, empty for objects not in it.'''
+    state = emptyState(len(objectIds))
+    if len(table) == 0:
+        return state
+    rows = pd.Index(table['name']).get_indexer(objectIds)
+    found = rows >= 0
+    for x in STATE_COLUMNS:
+        state[x][found] = np.asarray(table[x])[rows[found]]
+    return state
+
+
+def stateToTable(objectIds, state):
+    table = pd.DataFrame({x: state[x] for x in STATE_COLUMNS})
+    table.insert(0, 'name', list(objectIds))
+    return table
+
+
+def _popcount(bits):
+    return sum((bits >> i) & 1 for i in range(len(BAND_NAMES)))
+
+
+def foldChunk(criteria, chunk, state):
+    '''
+    Fold the rows of a LightcurveChunk that are newer than each object's
+    lastjd into its state. Returns the new state, the old one is left as is.
+    '''
+    nGroups = len(chunk)
+    old = state
+    state = {x: v.copy() for x, v in state.items()}
+    if chunk.nRows == 0:
+        return state
+
+    cols = chunk.columns
+    group = chunk.group
+    new = cols['jd'] > old['lastjd'][group]
+    group = group[new]
+    order = np.lexsort((cols['jd'][new], group))
+    group = group[order]
+    jd = cols['jd'][new][order]
+    fid = cols['fid'][new][order].astype(np.int64)
+    nid = cols['nid'][new][order].astype(np.int64)
+    magpsf = cols['magpsf'][new][order]
+    isDetection = chunk.isDetection[new][order]
+
+    sig = significantMask(criteria, fid, cols['sigmapsf'][new][order])
+    bit = np.left_shift(1, np.clip(fid, 0, len(BAND_NAMES) - 1))
+    newBand = sig & ((old['bands'][group] & bit) == 0)
+    newNight = sig & (nid > old['lastnid'][group])
+
+    ## The JD each threshold is crossed at, counting on from what the state already holds
+    bandsJd = _kthJd(_firstAppearances(group[newBand], fid[newBand], jd[newBand]), nGroups,
+                     criteria['minBands'] - _popcount(old['bands']))
+    nightsJd = _kthJd(_firstAppearances(group[newNight], nid[newNight], jd[newNight]), nGroups,
+                      criteria['minNights'] - old['nnights'])
+    magJd = np.where(old['minmag'] <= criteria['magLimit'], -np.inf, np.inf)
+    brightEnough = magpsf <= criteria['magLimit']
+    np.minimum.at(magJd, group[brightEnough], jd[brightEnough])
+    allMetJd = np.maximum(np.maximum(bandsJd, nightsJd), magJd)
+
+    triggerJd = np.full(nGroups, np.inf)
+    afterAllMet = isDetection & (jd >= allMetJd[group])
+    np.minimum.at(triggerJd, group[afterAllMet], jd[afterAllMet])
+    newlyPassed = ~old['passed'] & np.isfinite(triggerJd)
+
+    np.bitwise_or.at(state['bands'], group[sig], bit[sig])
+    state['nnights'] += _countDistinct(group[newNight], nid[newNight], nGroups)
+    np.maximum.at(state['lastnid'], group[sig], nid[sig])
+    np.fmin.at(state['minmag'], group, magpsf)
+    np.maximum.at(state['lastjd'], group, jd)
+    state['passed'] |= newlyPassed
+    state['triggerjd'][newlyPassed] = triggerJd[newlyPassed]
+    return state
@@ -0,0 +1,252 @@
+"""Replay a sample of ZTF objects night by night through the selection functions
+Usage:
+    surveyReplay.py [--input=<PATH>] [--output=<PATH>] [--selection=<PATH>] [--name=<NAME>] [--cache=<PATH>] [--archive=<PATH>] [--chunk=<NUM>] [--workers=<NUM>] [--recent=<DAYS>] [--faint=<MAG>]
+    surveyReplay.py -h | --help
+
+Options:
+    -i PATH, --input=PATH      A list of ZTF objects, one per line, or a CSV with ZTFID and peakt columns such as ZTF_BTS_SNIa.csv.
+    -o PATH, --output=PATH     The full path to the output directory.
+    -s PATH, --selection=PATH  The full path to the YAML file containing the selection function criteria.
+    -n NAME, --name=NAME       Comma separated names of the selection functions to replay, or all. [default: all]
+    --cache=PATH               Read the light curves from this light curve cache (SQLite) file.
+    --archive=PATH             Read the light curves from this Parquet archive instead.
+    -c NUM, --chunk=NUM        The number of objects evaluated at once. [default: 500]
+    -w NUM, --workers=NUM      The number of processes evaluating chunks, 0 to evaluate in the main process. [default: 2]
+    --recent=DAYS              A target stays active this many days after its latest detection. [default: 4]
+    --faint=MAG                A target is dropped once its latest g and r magnitudes are both fainter than this. [default: 20.5]
+    -h --help                  Show this screen
+
+Light curves are never requested from Lasair, they are read back from the cache
+or archive a previous checkObjects.py or tidesCom.py run filled. Every object
+is evaluated once against all the selection functions, the trigger JDs say on
+which night each function would have picked it up. The nights are then
+counted with running sums over each object's detections, the same way the
+tides_master deactivation (deactivateUnobserved.sql) would have treated it:
+
+    ReplayTriggers.csv   ZTFName, selection, TriggerJD, TriggerNight, PeakJD, Delay
+    ReplayNights.csv     Night, selection, NewTriggers, Triggered, Active
+
+A night is labelled by the JD at its end (noon UTC), so night N covers
+detections with N-1 < jd <= N. Delay is TriggerJD - PeakJD in days, negative
+for triggers before peak, and is only filled when the input has peakt
+(JD - 2458000, as in the Bright Transient Survey).
+
+#Example:
+#    python surveyReplay.py -i ZTF_BTS_SNIa.csv -s tidesSelectionFunctions.yml -n all --cache=/data/tides/lc.sqlite -o /data/tides/replay/
+"""
+
+from docopt import docopt
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from lightcurveSelection import evaluateCriteriaSet, selectionFunctions, NO_TRIGGER
+from lightcurveChunk import LightcurveChunk, COLUMN_DTYPES
+
+# peakt in the Bright Transient Survey tables is JD - 2458000
+BTS_JD_OFFSET = 2458000.0
+BAND_G = 1
+BAND_R = 2
+
+
+def readSample(path):
+    '''ZTF names and their peak JD (NaN where unknown) from a plain list or a BTS style CSV.'''
+    if str(path).endswith('.csv'):
+        sample = pd.read_csv(path)
+        peak = sample['peakt'].to_numpy(dtype=np.float64) if 'peakt' in sample else np.full(len(sample), np.nan)
+        peak = np.where(peak < BTS_JD_OFFSET, peak + BTS_JD_OFFSET, peak)
+        names = sample['ZTFID'].astype(str).to_numpy()
+    else:
+        names = pd.read_csv(path, header=None, names=['ztfname'])['ztfname'].astype(str).to_numpy()
+        peak = np.full(len(names), np.nan)
+    names, first = np.unique(names, return_index=True)
+    return list(names), peak[first]
+
+
+def cacheChunks(path, ztfNameChunks):
+    '''A LightcurveChunk per chunk of names, from a light curve cache. Uncached objects have no rows.'''
+    from lightcurveCache import LightcurveCache
+    cache = LightcurveCache(path)
+    for names in ztfNameChunks:
+        found = cache.getMany(names)
+        yield LightcurveChunk.fromResponses(names, [found.get(x, []) for x in names])
+    print('Light curves found in the cache:', cache.hits, 'missing:', cache.misses)
+    cache.close()
+
+
+def archiveChunks(path, ztfNameChunks):
+    '''A LightcurveChunk per chunk of names from the Parquet archive, the latest fetch of every object.'''
+    import pyarrow.compute as pc
+    from lightcurveArchive import openArchive
+    candidates = openArchive(path, 'candidates')
+    columns = ['objectId', 'processed'] + [name for name, _ in COLUMN_DTYPES]
+    for names in ztfNameChunks:
+        table = candidates.to_table(filter=pc.field('objectId').isin(names), columns=columns).to_pandas()
+        ## An object archived by several runs keeps only the rows of the latest one
+        latest = table.groupby('objectId')['processed'].transform('max')
+        table = table[table['processed'] == latest]
+        position = {x: i for i, x in enumerate(names)}
+        table = table.iloc[np.argsort(table['objectId'].map(position).to_numpy(), kind='stable')]
+        counts = np.bincount(table['objectId'].map(position).to_numpy(dtype=np.int64), minlength=len(names))
+        yield LightcurveChunk.fromColumns(names, counts, {name: table[name].to_numpy() for name, _ in COLUMN_DTYPES})
+
+
+def _latestBandMag(group, fid, magpsf, band):
+    '''For every row, magpsf of the latest row of band up to and including it in the same group, else NaN.'''
+    index = np.where(fid == band, np.arange(len(fid)), -1)
+    np.maximum.accumulate(index, out=index)
+    valid = index >= 0
+    valid[valid] = group[index[valid]] == group[valid]
+    return np.where(valid, magpsf[np.maximum(index, 0)], np.nan)
+
+
+def replayChunk(criteriaSet, lcChunk, firstNight, nNights, recent=4.0, faint=20.5):
+    '''
+    Trigger JDs of every object in the chunk (objects x functions), and for every
+    function and night the number of new triggers and of active targets.
+
+    An object is active on night N if it has triggered by N, was detected in
+    the recent days up to N and its latest g and r magnitudes are not both
+    fainter than faint. Each detection starts a run of nights, up to the next
+    detection or recent days later, during which the object is active or not,
+    so the nights are counted by adding every run into a difference array.
+    '''
+    names, passes, triggers = evaluateCriteriaSet(criteriaSet, lcChunk)
+    triggers = np.where(passes, triggers, NO_TRIGGER)
+    nFunc = len(names)
+    newTriggers = np.zeros((nFunc, nNights), dtype=np.int64)
+    active = np.zeros((nFunc, nNights + 1), dtype=np.int64)
+    for j in range(nFunc):
+        triggered = triggers[:, j] != NO_TRIGGER
+        nightIndex = np.ceil(triggers[triggered, j]).astype(np.int64) - firstNight
+        nightIndex = nightIndex[(nightIndex >= 0) & (nightIndex < nNights)]
+        newTriggers[j] = np.bincount(nightIndex, minlength=nNights)
+
+    cols = lcChunk.columns
+    detected = lcChunk.isDetection
+    if not detected.any():
+        return triggers, newTriggers, active[:, :-1]
+    group = lcChunk.group[detected]
+    jd = cols['jd'][detected]
+    order = np.lexsort((jd, group))
+    group, jd = group[order], jd[order]
+    fid = cols['fid'][detected][order]
+    magpsf = cols['magpsf'][detected][order]
+
+    isFaint = (_latestBandMag(group, fid, magpsf, BAND_G) > faint) & (_latestBandMag(group, fid, magpsf, BAND_R) > faint)
+    nextJd = np.full(len(jd), np.inf)
+    sameObject = group[1:] == group[:-1]
+    nextJd[:-1][sameObject] = jd[1:][sameObject]
+    ## Nights N with jd <= N < nextJd and N <= jd + recent have this row as latest detection
+    lastNight = np.minimum(np.ceil(nextJd) - 1, np.floor(jd + recent))
+    for j in range(nFunc):
+        startJd = np.maximum(jd, triggers[group, j])
+        keep = ~isFaint & (triggers[group, j] != NO_TRIGGER)
+        start = np.clip(np.ceil(startJd[keep]) - firstNight, 0, nNights).astype(np.int64)
+        stop = np.clip(lastNight[keep] - firstNight + 1, 0, nNights).astype(np.int64)
+        run = start < stop
+        np.add.at(active[j], start[run], 1)
+        np.add.at(active[j], stop[run], -1)
+    return triggers, newTriggers, np.cumsum(active, axis=1)[:, :-1]
+
+
+def nightRange(lcChunks, recent):
+    '''First night and number of nights covering every detection of the chunks, plus recent days.'''
+    jds = [chunk.columns['jd'][chunk.isDetection] for chunk in lcChunks]
+    jds = np.concatenate(jds) if jds else np.array([])
+    if len(jds) == 0:
+        return 0, 0
+    firstNight = int(np.ceil(jds.min()))
+    return firstNight, int(np.ceil(jds.max() + recent)) - firstNight + 1
+
+
+def main():
+    args = docopt(__doc__)
+    input = args['--input']
+    output = args['--output']
+    selection = args['--selection']
+    if None in [input, output, selection] or (args['--cache'] is None) == (args['--archive'] is None):
+        print('You must give --input, --output, --selection and one of --cache or --archive')
+        print(__doc__)
+        sys.exit(1)
+    try:
+        chunk = int(args['--chunk'])
+        workers = int(args['--workers'])
+        recent = float(args['--recent'])
+        faint = float(args['--faint'])
+    except ValueError as ve:
+        print('The chunk and workers must be integers, recent and faint numbers')
+        sys.exit(1)
+    Path(output).mkdir(parents=True, exist_ok=True)
+
+    inputCriteriaOpen = yaml.load(open(selection), Loader=yaml.SafeLoader)
+    if args['--name'] == 'all':
+        criteriaSet = selectionFunctions(inputCriteriaOpen)
+    else:
+        criteriaSet = {x: inputCriteriaOpen[x] for x in args['--name'].split(',')}
+    criteriaNames = list(criteriaSet)
+    print('Replaying selection functions:', ', '.join(criteriaNames))
+
+    ztfNames, peakJd = readSample(input)
+    ztfNameChunks = [ztfNames[i:i + chunk] for i in range(0, len(ztfNames), chunk)]
+    print('Objects in the sample:', len(ztfNames), 'in', len(ztfNameChunks), 'chunks')
+
+    ## The chunks are compact numpy buffers, the whole sample is read before the
+    ## night range is known
+    if args['--cache'] is not None:
+        lcChunks = list(cacheChunks(args['--cache'], ztfNameChunks))
+    else:
+        lcChunks = list(archiveChunks(args['--archive'], ztfNameChunks))
+    firstNight, nNights = nightRange(lcChunks, recent)
+    print('Nights replayed:', nNights)
+
+    jobArgs = [(criteriaSet, x, firstNight, nNights, recent, faint) for x in lcChunks]
+    if workers > 0:
+        ## A forkserver where there is one (not Windows), the platform default otherwise
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else None)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            results = list(pool.map(replayChunk, *zip(*jobArgs)))
+    else:
+        results = [replayChunk(*x) for x in jobArgs]
+
+    nFunc = len(criteriaNames)
+    triggers = np.concatenate([x[0] for x in results]) if results else np.empty((0, nFunc))
+    newTriggers = sum((x[1] for x in results), np.zeros((nFunc, nNights), dtype=np.int64))
+    active = sum((x[2] for x in results), np.zeros((nFunc, nNights), dtype=np.int64))
+
+    triggers = np.where(triggers == NO_TRIGGER, np.nan, triggers)
+    perObject = pd.DataFrame({
+        'ZTFName': np.repeat(ztfNames, nFunc),
+        'selection': np.tile(criteriaNames, len(ztfNames)),
+        'TriggerJD': triggers.ravel(),
+        'TriggerNight': np.ceil(triggers).ravel(),
+        'PeakJD': np.repeat(peakJd, nFunc),
+    })
+    perObject['Delay'] = perObject['TriggerJD'] - perObject['PeakJD']
+    perObject.to_csv(output + 'ReplayTriggers.csv', index=False)
+
+    perNight = pd.DataFrame({
+        'Night': np.tile(np.arange(firstNight, firstNight + nNights), nFunc),
+        'selection': np.repeat(criteriaNames, nNights),
+        'NewTriggers': newTriggers.ravel(),
+        'Triggered': np.cumsum(newTriggers, axis=1).ravel(),
+        'Active': active.ravel(),
+    })
+    perNight.to_csv(output + 'ReplayNights.csv', index=False)
+
+    for name, rows in perObject.groupby('selection', sort=False):
+        triggered = rows['TriggerJD'].notna()
+        delay = rows['Delay'][triggered]
+        print('%-28s triggered %6d/%d  median delay %7.1f d  before peak %5.1f%%  peak active %d' % (
+            name, triggered.sum(), len(rows), delay.median() if delay.notna().any() else np.nan,
+            100*(delay < 0).sum()/max(delay.notna().sum(), 1), active[criteriaNames.index(name)].max(initial=0)))
+    print('Results saved in', output)
+
+
+if __name__ == "__main__":
+    main()
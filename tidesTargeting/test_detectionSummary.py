@@ -0,0 +1,79 @@
+'''
+summariseChunk keeps every detection any selection function can depend on,
+so evaluating a selection function over the summary rows gives the same
+pass/fail and trigger JD as over the whole light curves. The SQL rescore of
+the stored summaries is checked against the same answers in
+tidesCommunicate/test_commStages.py.
+'''
+
+import itertools
+
+import numpy as np
+import pytest
+
+import lightcurveSelection as lcs
+from detectionSummary import summariseChunk, SUMMARY_COLUMNS
+from lightcurveChunk import LightcurveChunk
+from syntheticLightcurves import makeResponses
+
+
+def criteriaGrid():
+    '''Selection functions spanning the thresholds, so every kind of record matters.'''
+    grid = {}
+    for filters, significance, minBands, minNights, magLimit in itertools.product(
+            [['g', 'r', 'i', 'z'], ['r'], ['g', 'i']], [3, 5, 20], [1, 2, 3], [1, 2, 5], [18.5, 20, 22.5]):
+        grid['%s_%s_%s_%s_%s' % (''.join(filters), significance, minBands, minNights, magLimit)] = {
+            'filters': filters, 'significance': significance, 'minBands': minBands,
+            'minNights': minNights, 'magLimit': magLimit}
+    return grid
+
+
+def summaryChunk(table, objectIds):
+    '''The summary rows as a LightcurveChunk of detections, in the order of objectIds.'''
+    counts = table['name'].value_counts().reindex(objectIds, fill_value=0).to_numpy()
+    with np.errstate(divide='ignore'):
+        sigmapsf = 1.09/table['sig'].to_numpy()
+    return LightcurveChunk.fromColumns(objectIds, counts, {
+        'candid': np.arange(1, len(table) + 1), 'jd': table['jd'], 'fid': table['fid'],
+        'nid': table['nid'], 'magpsf': table['magpsf'], 'sigmapsf': sigmapsf})
+
+
+@pytest.fixture(scope='module')
+def chunk():
+    resp = makeResponses(500, 25, seed=6)
+    rng = np.random.default_rng(2)
+    for r in resp.values():
+        for c in (r['candidates'] if len(r) != 0 else []):
+            if c.get('sigmapsf') is not None and rng.random() < 0.05:
+                c['sigmapsf'] = 0.0
+    names = list(resp)
+    return LightcurveChunk.fromResponses(names, [resp[n] for n in names])
+
+
+def test_summaryColumns(chunk):
+    table = summariseChunk(chunk)
+    assert list(table.columns) == SUMMARY_COLUMNS
+    assert len(table) < chunk.nRows
+    ## Sorted by object (in chunk order) and JD
+    order = np.asarray(chunk.objectIds, dtype=object)
+    position = {name: i for i, name in enumerate(order)}
+    key = list(zip(table['name'].map(position), table['jd']))
+    assert key == sorted(key)
+    assert np.isinf(table['sig']).any()
+
+
+def test_summaryGivesSameSelection(chunk):
+    table = summariseChunk(chunk)
+    summary = summaryChunk(table, chunk.objectIds)
+    criteria = criteriaGrid()
+    names, passes, triggers = lcs.evaluateCriteriaSet(criteria, chunk)
+    _, summaryPasses, summaryTriggers = lcs.evaluateCriteriaSet(criteria, summary)
+    for j, name in enumerate(names):
+        assert np.array_equal(summaryPasses[:, j], passes[:, j]), name
+        assert np.array_equal(summaryTriggers[:, j], triggers[:, j]), name
+    assert passes.any(axis=0).sum() > len(names)//2
+
+
+def test_emptyChunk():
+    table = summariseChunk(LightcurveChunk.fromResponses(['a'], [[]]))
+    assert len(table) == 0 and list(table.columns) == SUMMARY_COLUMNS
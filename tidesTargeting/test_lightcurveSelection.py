@@ -0,0 +1,136 @@
+'''
+The vectorised selection (satisfyBatch, triggerBatch, evaluateCriteriaSet and
+the single object versions) against the object by object evaluation the
+original checkObjects.py did, over synthetic light curves.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+
+import lightcurveSelection as lcs
+from lightcurveChunk import LightcurveChunk
+from syntheticLightcurves import makeResponses
+
+SELECTION_FILE = __file__.replace('test_lightcurveSelection.py', 'tidesSelectionFunctions.yml')
+FILTER_NAMES = {1: 'g', 2: 'r', 3: 'i'}
+CANDIDATE_COLUMNS = ['candid', 'jd', 'fid', 'nid', 'magpsf', 'sigmapsf', 'diffmaglim']
+
+
+def candidateFrame(resp):
+    '''One Lasair response as a DataFrame, with every column even when all missing.'''
+    return pd.json_normalize(resp['candidates']).reindex(columns=CANDIDATE_COLUMNS)
+
+
+def criteriaSet():
+    '''The selection functions of the repo, plus a few that cut differently.'''
+    criteria = lcs.selectionFunctions(yaml.safe_load(open(SELECTION_FILE)))
+    base = criteria['tidesSNZTFSelect']
+    criteria['rOnlyBright'] = dict(base, filters=['r'], minBands=1, magLimit=19.0)
+    criteria['loose'] = dict(base, significance=3, minBands=1, minNights=1)
+    criteria['strict'] = dict(base, significance=20, minBands=3, minNights=4, magLimit=20.0)
+    return criteria
+
+
+def referenceSatisfy(criteria, lc):
+    '''Pass/fail of one light curve, as the original lightcurveSatify.'''
+    filtersBool = np.array([FILTER_NAMES.get(x) in criteria['filters'] for x in lc['fid']], dtype=bool)
+    significanceBool = 1.09/lc['sigmapsf'] >= criteria['significance']
+    sigAndFilterBool = filtersBool & significanceBool
+    meetMinBands = len(np.unique(lc['fid'][sigAndFilterBool])) >= criteria['minBands']
+    meetMinNight = len(np.unique(lc['nid'][sigAndFilterBool])) >= criteria['minNights']
+    meetMagLimit = lc['magpsf'].min() <= criteria['magLimit']
+    return bool(meetMinBands and meetMinNight and meetMagLimit)
+
+
+def referenceTrigger(criteria, lc):
+    '''
+    The first detection at which the light curve up to it passes, stepping
+    through the detections as the original checkObjects.py did.
+    '''
+    if not referenceSatisfy(criteria, lc):
+        return lcs.NO_TRIGGER
+    datesTest = np.unique(lc['jd'][lc['candid'].notna()])
+    pf = np.array([referenceSatisfy(criteria, lc[lc['jd'] <= x]) for x in datesTest])
+    return min(datesTest[pf])
+
+
+@pytest.fixture(scope='module')
+def responses():
+    resp = makeResponses(150, 15, seed=11)
+    rng = np.random.default_rng(3)
+    names = list(resp)
+    ## Edge cases: no data, infinitely significant (sigmapsf 0) and unknown band detections
+    resp[names[0]] = []
+    withData = [n for n in names[1:] if len(resp[n]) != 0]
+    for name in withData[:30]:
+        for c in resp[name]['candidates']:
+            if c.get('sigmapsf') is not None and rng.random() < 0.3:
+                c['sigmapsf'] = 0.0
+    for name in withData[30:45]:
+        for c in resp[name]['candidates']:
+            if rng.random() < 0.3:
+                c['fid'] = 4
+    return resp
+
+
+@pytest.fixture(scope='module')
+def chunk(responses):
+    names = list(responses)
+    return LightcurveChunk.fromResponses(names, [responses[n] for n in names])
+
+
+@pytest.fixture(scope='module')
+def reference(responses):
+    '''Reference pass/fail and trigger JD of every object, per selection function.'''
+    expected = {}
+    for name, criteria in criteriaSet().items():
+        passes, triggers = [], []
+        for resp in responses.values():
+            if len(resp) == 0:
+                passes.append(False)
+                triggers.append(lcs.NO_TRIGGER)
+                continue
+            lc = candidateFrame(resp)
+            passes.append(referenceSatisfy(criteria, lc))
+            triggers.append(referenceTrigger(criteria, lc))
+        expected[name] = np.array(passes), np.array(triggers, dtype=np.float64)
+    return expected
+
+
+@pytest.mark.parametrize('name', list(criteriaSet()))
+def test_batchMatchesReference(name, chunk, reference):
+    criteria = criteriaSet()[name]
+    passes, triggers = reference[name]
+    assert 0 < passes.sum() < len(passes)
+    assert np.array_equal(lcs.satisfyBatch(criteria, chunk), passes)
+    assert np.array_equal(lcs.triggerBatch(criteria, chunk), triggers)
+
+
+def test_criteriaSetMatchesReference(chunk, reference):
+    names, passes, triggers = lcs.evaluateCriteriaSet(criteriaSet(), chunk)
+    for j, name in enumerate(names):
+        assert np.array_equal(passes[:, j], reference[name][0]), name
+        assert np.array_equal(triggers[:, j], reference[name][1]), name
+
+
+def test_singleObjectMatchesReference(responses, chunk, reference):
+    criteria = criteriaSet()['tidesSNZTFSelect']
+    passes, triggers = reference['tidesSNZTFSelect']
+    for i, resp in enumerate(responses.values()):
+        assert lcs.lightcurveSatify(criteria, chunk[i]) == passes[i]
+        assert lcs.lightcurveTriggerDate(criteria, chunk[i]) == triggers[i]
+        if len(resp) != 0:
+            lc = candidateFrame(resp)
+            assert lcs.lightcurveSatify(criteria, lc) == passes[i]
+            assert lcs.lightcurveTriggerDate(criteria, lc) == triggers[i]
+
+
+def test_emptyChunk():
+    chunk = LightcurveChunk.fromResponses(['a', 'b'], [[], []])
+    criteria = criteriaSet()['tidesSNZTFSelect']
+    assert not lcs.satisfyBatch(criteria, chunk).any()
+    assert (lcs.triggerBatch(criteria, chunk) == lcs.NO_TRIGGER).all()
+    names, passes, triggers = lcs.evaluateCriteriaSet(criteriaSet(), chunk)
+    assert passes.shape == (2, len(names)) and not passes.any()
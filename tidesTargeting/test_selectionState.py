@@ -0,0 +1,116 @@
+'''
+foldChunk against evaluating the whole light curve: Lasair is asked for a
+random subset of objects at a time, each returning its light curve so far in
+no particular order, and the state is kept in a table between steps as the
+flow keeps it in Postgres.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+
+import lightcurveSelection as lcs
+from lightcurveChunk import LightcurveChunk
+from selectionState import criteriaKey, emptyState, foldChunk, stateFromTable, stateToTable, STATE_COLUMNS
+from syntheticLightcurves import makeResponses
+
+SELECTION_FILE = __file__.replace('test_selectionState.py', 'tidesSelectionFunctions.yml')
+
+
+def criteriaSet():
+    criteria = lcs.selectionFunctions(yaml.safe_load(open(SELECTION_FILE)))
+    criteria['rOnlyBright'] = dict(criteria['tidesSNZTFSelect'], filters=['r'], minBands=1, magLimit=19.0)
+    return criteria
+
+
+@pytest.fixture(scope='module')
+def responses():
+    resp = makeResponses(400, 12, seed=4)
+    rng = np.random.default_rng(8)
+    for r in resp.values():
+        for c in (r['candidates'] if len(r) != 0 else []):
+            if c.get('sigmapsf') is not None and rng.random() < 0.05:
+                c['sigmapsf'] = 0.0
+    return resp
+
+
+def lightcurvesUpTo(responses, names, cut, rng):
+    '''What Lasair would return for names at JD cut, in a shuffled order.'''
+    c = []
+    for name in names:
+        resp = responses[name]
+        rows = [x for x in resp['candidates'] if x['jd'] <= cut] if len(resp) != 0 else []
+        rng.shuffle(rows)
+        c.append({'candidates': rows} if rows else [])
+    return LightcurveChunk.fromResponses(names, c)
+
+
+@pytest.mark.parametrize('name', list(criteriaSet()))
+def test_foldMatchesWholeLightcurve(name, responses):
+    criteria = criteriaSet()[name]
+    rng = np.random.default_rng(1)
+    names = list(responses)
+    jds = [x['jd'] for r in responses.values() if len(r) != 0 for x in r['candidates']]
+    cuts = np.sort(rng.uniform(min(jds), max(jds), 8)).tolist() + [np.inf]
+
+    table = stateToTable([], emptyState(0))
+    everPassed = set()
+    for cut in cuts:
+        fetched = list(rng.choice(names, size=len(names)//2, replace=False))
+        chunk = lightcurvesUpTo(responses, fetched, cut, rng)
+        state = foldChunk(criteria, chunk, stateFromTable(table, fetched))
+        assert np.array_equal(state['passed'], lcs.satisfyBatch(criteria, chunk))
+        assert np.array_equal(state['triggerjd'], lcs.triggerBatch(criteria, chunk))
+        ## Once passed, an object keeps its trigger JD
+        old = stateFromTable(table, fetched)
+        assert np.array_equal(state['triggerjd'][old['passed']], old['triggerjd'][old['passed']])
+        everPassed.update(np.asarray(fetched)[state['passed']])
+        table = pd.concat([table[~table['name'].isin(fetched)], stateToTable(fetched, state)], ignore_index=True)
+
+    ## Everything is fetched at the end
+    chunk = lightcurvesUpTo(responses, names, np.inf, rng)
+    state = foldChunk(criteria, chunk, stateFromTable(table, names))
+    assert np.array_equal(state['passed'], lcs.satisfyBatch(criteria, chunk))
+    assert np.array_equal(state['triggerjd'], lcs.triggerBatch(criteria, chunk))
+    assert 0 < state['passed'].sum() < len(names)
+    assert everPassed <= set(np.asarray(names)[state['passed']])
+
+
+def test_magLimitReachedInEarlierFold():
+    ## Bright enough (exactly at magLimit) on the first night, the bands and nights only on the second
+    criteria = criteriaSet()['tidesSNZTFSelect']
+    rows = [{'candid': 1, 'jd': 2460000.7, 'fid': 1, 'nid': 1000, 'magpsf': 22.5, 'sigmapsf': 0.1},
+            {'candid': 2, 'jd': 2460001.7, 'fid': 2, 'nid': 1001, 'magpsf': 22.7, 'sigmapsf': 0.1}]
+    state = emptyState(1)
+    for n in [1, 2]:
+        chunk = LightcurveChunk.fromCandidates(['a'], [rows[:n]])
+        state = foldChunk(criteria, chunk, state)
+        assert state['passed'][0] == lcs.satisfyBatch(criteria, chunk)[0] == (n == 2)
+    assert state['triggerjd'][0] == rows[1]['jd']
+
+
+def test_foldLeavesStateAlone(responses):
+    criteria = criteriaSet()['tidesSNZTFSelect']
+    names = list(responses)
+    chunk = lightcurvesUpTo(responses, names, np.inf, np.random.default_rng(0))
+    state = emptyState(len(names))
+    foldChunk(criteria, chunk, state)
+    empty = emptyState(len(names))
+    assert all(np.array_equal(state[x], empty[x]) for x in STATE_COLUMNS)
+
+
+def test_refoldChangesNothing(responses):
+    criteria = criteriaSet()['tidesSNLSSTSelect']
+    names = list(responses)
+    chunk = lightcurvesUpTo(responses, names, np.inf, np.random.default_rng(0))
+    once = foldChunk(criteria, chunk, emptyState(len(names)))
+    twice = foldChunk(criteria, chunk, once)
+    assert all(np.array_equal(once[x], twice[x]) for x in STATE_COLUMNS)
+
+
+def test_criteriaKey():
+    criteria = criteriaSet()['tidesSNZTFSelect']
+    assert criteriaKey('a', criteria) == criteriaKey('a', dict(reversed(list(criteria.items()))))
+    assert criteriaKey('a', criteria) != criteriaKey('a', dict(criteria, magLimit=22.0))
+    assert criteriaKey('a', criteria) != criteriaKey('b', criteria)